@@ -1,6 +1,50 @@
+import logging
+import os
+import sys
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def is_server_process(argv=None) -> bool:
+    """是否为处理请求的服务进程
+
+    通过 manage.py / django-admin 启动时只有 VECTOR_DB_WARMUP_COMMANDS 中的命令算作服务进程
+    （migrate、shell、test 等不算），runserver 自动重载的监视进程也不算；
+    gunicorn、uvicorn 等直接加载 WSGI/ASGI 应用的进程都算。
+    """
+    argv = sys.argv if argv is None else argv
+    program = argv[0] if argv else ''
+    is_management = (os.path.basename(program) in ('manage.py', 'django-admin')
+                     or program.endswith(os.path.join('django', '__main__.py')))
+    if not is_management:
+        return True
+    command = argv[1] if len(argv) > 1 else None
+    if command not in settings.VECTOR_DB_WARMUP_COMMANDS:
+        return False
+    if command == 'runserver' and '--noreload' not in argv and os.environ.get('RUN_MAIN') != 'true':
+        return False
+    return True
 
 
 class DiagnosisConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "diagnosis"
+
+    def ready(self):
+        # SQLite 连接建立后应用 WAL 等 PRAGMA
+        from django.db.backends.signals import connection_created
+        from .db import apply_sqlite_pragmas
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='diagnosis.apply_sqlite_pragmas')
+
+        # 通过 API/Admin 写入的知识条目自动进入后台索引队列
+        if settings.VECTOR_INDEX_AUTO_SYNC:
+            from . import signals  # noqa: F401
+
+        # 可选预热：在 worker 接收流量前加载模型并执行一次空编码（只在服务进程中执行）
+        if settings.VECTOR_DB_WARMUP and is_server_process():
+            from .services import get_vector_db
+            timings = get_vector_db().warm_up()
+            logger.info("Vector DB warm-up finished: %s",
+                        ', '.join(f'{stage}={seconds:.3f}s' for stage, seconds in timings.items()))
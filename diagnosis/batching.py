@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = registry.histogram(
+    'embedding_batch_size', 'Number of texts per micro-batched encode call',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+QUEUE_WAIT = registry.histogram(
+    'embedding_queue_wait_seconds', 'Time a text waits in the embedding batcher before its batch starts',
+    buckets=(0.0001, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+)
+
+
+class EmbeddingBatcher:
+    """将并发的单条编码请求合并为一次批量前向计算
+
+    后台线程收集请求，凑满 max_batch_size 条或最早的请求等待超过 max_wait 秒后，
+    把这一批（批内相同文本只编码一次）交给 encode_fn，再把各自的向量交还给调用方。
+    等待超过 timeout 秒（后台线程卡住或批次过慢）时放弃排队，在调用线程中直接编码。
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch_size: int = 32,
+                 max_wait: float = 0.003, timeout: float = 10.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._pending: List[Tuple[str, Future, float]] = []
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+            self._worker.start()
+
+    def encode(self, text: str) -> np.ndarray:
+        """提交一条文本并等待其向量"""
+        future: Future = Future()
+        with self._cond:
+            self._pending.append((text, future, time.perf_counter()))
+            self._ensure_worker()
+            self._cond.notify()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # 尚未开始的请求取消后不会再被编码；已在批次中的结果直接丢弃
+            future.cancel()
+            logger.warning(f"Embedding batcher did not answer within {self.timeout}s, encoding directly")
+            return self.encode_fn([text])[0]
+
+    def _next_batch(self) -> List[Tuple[str, Future, float]]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+        # 跳过调用方已超时取消的请求
+        return [item for item in batch if item[1].set_running_or_notify_cancel()]
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            for _, _, enqueued_at in batch:
+                QUEUE_WAIT.observe(started - enqueued_at)
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            BATCH_SIZE.observe(len(texts))
+            try:
+                vectors = dict(zip(texts, self.encode_fn(texts)))
+            except Exception as e:
+                logger.error(f"Failed to encode batch of {len(texts)} texts: {str(e)}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for text, future, _ in batch:
+                future.set_result(vectors[text])
@@ -0,0 +1,347 @@
+import itertools
+import json
+import logging
+import math
+import random
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+
+from .metrics import collect_samples
+from .models import FaultCase
+from .pipeline import with_db_cleanup
+
+logger = logging.getLogger(__name__)
+
+# 合成知识库的组成部分，按条目序号确定性组合，保证不同提交间的数据一致
+SYNTHETIC_CATEGORIES = ['数据库故障', '网络故障', '存储故障', '应用故障', '资源耗尽', '中间件故障', '安全告警', '配置错误']
+_COMPONENTS = ['MySQL', 'PostgreSQL', 'Redis', 'Kafka', 'Nginx', 'Elasticsearch', 'RabbitMQ', 'MongoDB',
+               'JVM', 'Kubernetes', 'DNS', 'Zookeeper', '负载均衡', '对象存储', 'API 网关', '消息队列']
+_SYMPTOMS = ['连接数超过阈值', '响应时间升高', '内存使用率过高', 'CPU 使用率持续 100%', '磁盘空间不足',
+             '请求超时', '复制延迟', '频繁重启', '丢包率升高', '错误率超过 5%', '队列堆积', '慢查询增多']
+_CAUSES = ['配置上限过低', '流量突增', '资源泄漏', '下游依赖故障', '硬件故障', '版本缺陷', '参数不合理', '网络抖动']
+_ACTIONS = ['扩容实例', '调整配置参数', '重启服务', '清理历史数据', '切换备用节点', '回滚版本', '限流降级', '优化索引']
+
+
+def git_commit() -> str:
+    """当前代码的提交号，写入基准测试结果以便跨提交比较"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def synthetic_knowledge(index: int) -> Dict:
+    """生成第 index 条合成知识条目"""
+    rng = random.Random(index)
+    component = rng.choice(_COMPONENTS)
+    symptom = rng.choice(_SYMPTOMS)
+    cause = rng.choice(_CAUSES)
+    return {
+        'category': SYNTHETIC_CATEGORIES[index % len(SYNTHETIC_CATEGORIES)],
+        'title': f'{component}{symptom} #{index}',
+        'symptoms': f'{component} {symptom}，原因可能是{cause}，节点 node-{rng.randint(1, 500)}',
+        'solution': f'{rng.choice(_ACTIONS)}，并{rng.choice(_ACTIONS)}',
+    }
+
+
+def load_requests(path: str) -> List[Dict]:
+    """读取 JSONL 格式的诊断请求，每行为 analyze 接口的请求体（或其外层的 data 字段）"""
+    requests = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record.get('data'), dict):
+                record = record['data']
+            if not record.get('alert_info'):
+                logger.warning(f"Skipping request on line {line_number}: missing alert_info")
+                continue
+            requests.append({
+                'alert_info': record['alert_info'],
+                'metrics_info': record.get('metrics_info', ''),
+                'log_info': record.get('log_info', ''),
+            })
+    return requests
+
+
+def summarize(samples: List[float]) -> Dict:
+    """计算耗时样本（秒）的次数、均值与 p50/p95/p99（毫秒）"""
+    if not samples:
+        return {'count': 0}
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': len(samples),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+    }
+
+
+def replay(call: Callable[[Dict], None], requests: List[Dict], concurrency: int = 1,
+           repeat: int = 1) -> Dict:
+    """以给定并发重放请求，返回端到端耗时样本、错误数与吞吐量"""
+    workload = [request for _ in range(repeat) for request in requests]
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    def run_one(request: Dict) -> None:
+        start = time.perf_counter()
+        try:
+            call(request)
+        except Exception as e:
+            errors.append(str(e))
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='benchmark') as executor:
+        list(executor.map(with_db_cleanup(run_one), workload))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': len(workload),
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'wall_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        'latency': summarize(latencies),
+    }
+
+
+class SyntheticKnowledgeBase:
+    """在数据库与向量库中逐步扩充合成知识条目，已生成的条目在更大规模下复用"""
+
+    def __init__(self, vector_db, batch_size: int = 1000):
+        self.vector_db = vector_db
+        self.batch_size = batch_size
+        self.size = 0
+        self._categories: Optional[Dict[str, object]] = None
+
+    def _category_map(self) -> Dict[str, object]:
+        from knowledge_base.models import FaultCategory
+
+        if self._categories is None:
+            FaultCategory.objects.bulk_create(
+                [FaultCategory(name=name) for name in SYNTHETIC_CATEGORIES], ignore_conflicts=True
+            )
+            self._categories = {c.name: c for c in FaultCategory.objects.filter(name__in=SYNTHETIC_CATEGORIES)}
+        return self._categories
+
+    def grow_to(self, size: int) -> Dict:
+        """扩充到 size 条，返回数据库写入与向量索引的耗时（秒）"""
+        from knowledge_base.models import FaultKnowledge
+        from .services import knowledge_to_dict
+
+        categories = self._category_map()
+        db_seconds = index_seconds = 0.0
+        while self.size < size:
+            count = min(self.batch_size, size - self.size)
+            start = time.perf_counter()
+            rows = []
+            for index in range(self.size, self.size + count):
+                data = synthetic_knowledge(index)
+                rows.append(FaultKnowledge(
+                    category=categories[data['category']],
+                    title=data['title'],
+                    symptoms=data['symptoms'],
+                    solution=data['solution'],
+                ))
+            # bulk_create 不触发 post_save 信号，索引在下面显式批量写入
+            rows = FaultKnowledge.objects.bulk_create(rows)
+            db_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            self.vector_db.upsert_knowledge_batch([knowledge_to_dict(row) for row in rows])
+            index_seconds += time.perf_counter() - start
+            self.size += count
+            logger.info(f"Synthetic knowledge base grown to {self.size} entries")
+        return {'db_seconds': round(db_seconds, 3), 'index_seconds': round(index_seconds, 3)}
+
+
+def run_inprocess(pipeline, requests: List[Dict], concurrency: int = 1, repeat: int = 1) -> Dict:
+    """直接调用诊断流程重放请求，附带各阶段的精确分位数"""
+    def call(request: Dict) -> None:
+        pipeline.run(request['alert_info'], request['metrics_info'], request['log_info'])
+
+    with collect_samples() as samples:
+        report = replay(call, requests, concurrency, repeat)
+    report['stages'] = {stage: summarize(values) for stage, values in sorted(samples.items())}
+    return report
+
+
+_BUCKET_PATTERN = re.compile(
+    r'^diagnosis_stage_seconds_bucket\{stage="(?P<stage>[^"]*)",le="(?P<le>[^"]+)"\} (?P<count>\S+)$', re.M
+)
+
+
+def parse_stage_buckets(text: str) -> Dict[str, List[Tuple[float, float]]]:
+    """从 /metrics 的文本中解析各阶段的累计分桶计数"""
+    stages: Dict[str, List[Tuple[float, float]]] = {}
+    for match in _BUCKET_PATTERN.finditer(text):
+        bound = math.inf if match.group('le') == '+Inf' else float(match.group('le'))
+        stages.setdefault(match.group('stage'), []).append((bound, float(match.group('count'))))
+    return {stage: sorted(buckets) for stage, buckets in stages.items()}
+
+
+def bucket_quantile(q: float, buckets: List[Tuple[float, float]]) -> Optional[float]:
+    """按 Prometheus histogram_quantile 的方式在分桶内线性插值估算分位数（秒）"""
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = q * buckets[-1][1]
+    previous_bound, previous_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if math.isinf(bound):
+                return previous_bound
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def summarize_buckets(before: Dict, after: Dict) -> Dict:
+    """根据重放前后两次抓取的分桶计数之差估算各阶段分位数（毫秒）"""
+    stages = {}
+    for stage, buckets in after.items():
+        previous = dict(before.get(stage, []))
+        delta = [(bound, count - previous.get(bound, 0.0)) for bound, count in buckets]
+        if not delta or delta[-1][1] <= 0:
+            continue
+        summary = {'count': int(delta[-1][1])}
+        for name, q in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            value = bucket_quantile(q, delta)
+            summary[name] = round(value * 1000, 3) if value is not None else None
+        stages[stage] = summary
+    return stages
+
+
+def run_http(base_url: str, requests: List[Dict], concurrency: int = 1, repeat: int = 1,
+             timeout: float = 60.0) -> Dict:
+    """通过 HTTP 向运行中的服务重放请求，各阶段分位数由服务端 /metrics 的分桶估算"""
+    import requests as http
+
+    base_url = base_url.rstrip('/')
+    session = http.Session()
+    adapter = http.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, concurrency))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def scrape() -> Dict[str, List[Tuple[float, float]]]:
+        try:
+            response = session.get(f'{base_url}/metrics', timeout=timeout)
+            response.raise_for_status()
+        except http.RequestException as e:
+            logger.warning(f"Failed to scrape {base_url}/metrics: {str(e)}")
+            return {}
+        return parse_stage_buckets(response.text)
+
+    def call(request: Dict) -> None:
+        response = session.post(f'{base_url}/api/diagnosis/cases/analyze/', json=request, timeout=timeout)
+        if response.status_code >= 400:
+            raise RuntimeError(f'HTTP {response.status_code}: {response.text[:200]}')
+
+    before = scrape()
+    report = replay(call, requests, concurrency, repeat)
+    report['stages'] = summarize_buckets(before, scrape())
+    return report
+
+
+def iter_sizes(value: str) -> Iterator[int]:
+    """解析 '1k,10k,1m' 形式的规模列表"""
+    multipliers = {'k': 1000, 'm': 1000000}
+    for part in value.split(','):
+        part = part.strip().lower()
+        if not part:
+            continue
+        if part[-1] in multipliers:
+            yield int(float(part[:-1]) * multipliers[part[-1]])
+        else:
+            yield int(part)
+
+
+def _synthetic_case(index: int) -> FaultCase:
+    knowledge = synthetic_knowledge(index)
+    return FaultCase(
+        alert_info=f"[{knowledge['category']}] {knowledge['title']}",
+        metrics_info='cpu_usage=93%, p99_latency=1.8s',
+        log_info='ERROR connection pool exhausted (x128)\nWARN retrying request <*> (x42)',
+        analysis_result=knowledge['symptoms'],
+        solution=knowledge['solution'],
+    )
+
+
+def run_db_writes(writers: int = 8, duration: float = 10.0, batch_size: int = 1, readers: int = 0) -> Dict:
+    """多个线程在 duration 秒内持续写入诊断记录，返回写入吞吐量、耗时分布与锁冲突次数
+
+    每次写入模拟一个请求：batch_size 为 1 时单条 INSERT（同步保存），大于 1 时在一个事务中 bulk_create
+    （后台批量写入），写完按 CONN_MAX_AGE 释放连接。readers 个线程同时按列表接口的排序读取最新记录。
+    """
+    deadline = time.perf_counter() + duration
+    write_latencies: List[float] = []
+    read_latencies: List[float] = []
+    errors: List[str] = []
+    counter = itertools.count()
+
+    def write_once() -> None:
+        cases = [_synthetic_case(next(counter)) for _ in range(batch_size)]
+        if batch_size == 1:
+            cases[0].save(force_insert=True)
+        else:
+            with transaction.atomic():
+                FaultCase.objects.bulk_create(cases)
+
+    def read_once() -> None:
+        list(FaultCase.objects.order_by('-created_at', '-id').values_list('id', 'alert_info')[:50])
+
+    def loop(call: Callable[[], None], latencies: List[float]) -> None:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                call()
+                latencies.append(time.perf_counter() - start)
+            except DatabaseError as e:
+                errors.append(str(e))
+            finally:
+                close_old_connections()
+
+    threads = [threading.Thread(target=loop, args=(write_once, write_latencies), name=f'db-writer-{i}')
+               for i in range(writers)]
+    threads += [threading.Thread(target=loop, args=(read_once, read_latencies), name=f'db-reader-{i}')
+                for i in range(readers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'writers': writers,
+        'readers': readers,
+        'batch_size': batch_size,
+        'wall_seconds': round(elapsed, 3),
+        'writes': len(write_latencies),
+        'rows_written': len(write_latencies) * batch_size,
+        'writes_per_second': round(len(write_latencies) / elapsed, 3) if elapsed else 0.0,
+        'rows_per_second': round(len(write_latencies) * batch_size / elapsed, 3) if elapsed else 0.0,
+        'reads_per_second': round(len(read_latencies) / elapsed, 3) if elapsed else 0.0,
+        'errors': len(errors),
+        'locked_errors': sum('locked' in error or 'busy' in error for error in errors),
+        'error_samples': sorted(set(errors))[:5],
+        'write_latency': summarize(write_latencies),
+        'read_latency': summarize(read_latencies),
+    }
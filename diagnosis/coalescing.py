@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from .pipeline import get_executor, with_db_cleanup
+
+logger = logging.getLogger(__name__)
+
+# 归一化时需要屏蔽的可变部分，按顺序替换
+_MASK_PATTERNS = [
+    (re.compile(r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b', re.I), '<uuid>'),
+    (re.compile(r'\b(?:\d{1,3}\.){3}\d{1,3}(?::\d+)?\b'), '<ip>'),
+    (re.compile(r'\b(?:[0-9a-f]{1,4}:){2,7}[0-9a-f]{1,4}\b', re.I), '<ip>'),
+    (re.compile(r'\b(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z]{2,}\b', re.I), '<host>'),
+    (re.compile(r'\b[a-z][a-z0-9]*(?:[-_][a-z0-9]+)*[-_]\d+[a-z0-9]*\b', re.I), '<host>'),
+    (re.compile(r'\b0x[0-9a-f]+\b|\b[0-9a-f]{12,}\b', re.I), '<hex>'),
+    (re.compile(r'\d+(?:\.\d+)?'), '<num>'),
+]
+
+
+def normalize_alert(text: str) -> str:
+    """屏蔽主机名、IP、UUID 和数字等可变部分，得到用于聚合的告警模板"""
+    for pattern, placeholder in _MASK_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def input_fingerprint(metrics_info: str = '', log_info: str = '', categories: Optional[List[str]] = None,
+                      metrics_series=None) -> str:
+    """告警以外的诊断输入：检索分类 + 指标与日志内容的哈希，只有这部分相同的告警才能聚合"""
+    digest = hashlib.sha256()
+    series = json.dumps(metrics_series, sort_keys=True, ensure_ascii=False, default=str) if metrics_series else ''
+    for part in (metrics_info or '', log_info or '', series):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return f"{','.join(sorted(categories or []))}|{digest.hexdigest()[:16]}"
+
+
+class AlertGroup:
+    """一组在时间窗口内聚合到一起的告警，只由第一条（leader）触发诊断"""
+
+    def __init__(self, key: str, fingerprint: str, vector: Optional[np.ndarray]):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.vector = vector
+        self.started_at = time.time()
+        self.future: Future = Future()
+        self.members: List[Dict] = []
+        self.case_uid: Optional[str] = None
+        # leader 命中诊断缓存时 case_uid 指向已有记录，聚合的告警追加到其列表中
+        self.cached = False
+        self.flushed_members = 0
+
+
+class AlertCoalescer:
+    """告警风暴聚合
+
+    在 window 秒内，分类、指标与日志相同（input_fingerprint），且归一化文本相同或归一化文本向量相似度
+    不低于阈值的告警归为一组，
+    每组只执行一次诊断，其余告警直接复用结果，并记录到诊断记录的 coalesced_alerts 中。
+    """
+
+    def __init__(self, window: float = 30.0, similarity_threshold: float = 0.97,
+                 vector_fn: Optional[Callable[[str], List[float]]] = None):
+        self.window = window
+        self.similarity_threshold = similarity_threshold
+        self.vector_fn = vector_fn
+        self._groups: Dict[str, AlertGroup] = {}
+        self._lock = threading.Lock()
+        self.groups_total = 0
+        self.coalesced_total = 0
+
+    @classmethod
+    def from_settings(cls) -> 'AlertCoalescer':
+        from .services import get_vector_db
+        return cls(
+            window=settings.ALERT_COALESCING_WINDOW,
+            similarity_threshold=settings.ALERT_COALESCING_SIMILARITY,
+            vector_fn=get_vector_db().embed_query,
+        )
+
+    def _purge(self, now: float) -> None:
+        expired = [key for key, group in self._groups.items()
+                   if now - group.started_at > self.window and group.future.done()]
+        for key in expired:
+            del self._groups[key]
+
+    def _vector(self, key: str) -> Optional[np.ndarray]:
+        if self.vector_fn is None or self.similarity_threshold >= 1:
+            return None
+        vector = np.asarray(self.vector_fn(key), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def _find_similar(self, vector: Optional[np.ndarray], fingerprint: str, now: float) -> Optional[AlertGroup]:
+        if vector is None:
+            return None
+        best, best_score = None, self.similarity_threshold
+        for group in self._groups.values():
+            if group.vector is None or group.fingerprint != fingerprint or now - group.started_at > self.window:
+                continue
+            score = float(group.vector @ vector)
+            if score >= best_score:
+                best, best_score = group, score
+        return best
+
+    def _admit(self, alert_info: str, fingerprint: str = ''):
+        """返回 (分组, 是否为 leader)"""
+        template = normalize_alert(alert_info)
+        key = f'{fingerprint}|{template}'
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            group = self._groups.get(key)
+            if group is not None and now - group.started_at <= self.window:
+                return self._join(group, alert_info), False
+
+        # 计算向量可能较慢，在锁外进行
+        vector = self._vector(template)
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None or now - group.started_at > self.window:
+                group = self._find_similar(vector, fingerprint, now)
+            if group is not None:
+                return self._join(group, alert_info), False
+            group = AlertGroup(key, fingerprint, vector)
+            self._groups[key] = group
+            self.groups_total += 1
+            return group, True
+
+    def _join(self, group: AlertGroup, alert_info: str) -> AlertGroup:
+        group.members.append({
+            'alert_info': alert_info,
+            'received_at': datetime.now(timezone.utc).isoformat(),
+        })
+        self.coalesced_total += 1
+        return group
+
+    def _follower_result(self, group: AlertGroup, payload: Dict) -> Dict:
+        return {**payload, 'coalesced': True, 'group_size': len(group.members) + 1}
+
+    def _complete(self, group: AlertGroup, payload: Optional[Dict], error: Optional[BaseException]) -> None:
+        if error is not None:
+            # 诊断失败时立即解散分组，下一条告警重新触发诊断
+            with self._lock:
+                if self._groups.get(group.key) is group:
+                    del self._groups[group.key]
+            group.future.set_exception(error)
+            return
+        group.case_uid = payload.get('uid')
+        group.cached = bool(payload.get('cached'))
+        group.future.set_result(payload)
+        self._flush_members(group)
+        # 窗口结束时再写入一次，记录诊断完成后才到达的告警
+        remaining = group.started_at + self.window - time.time()
+        if remaining > 0:
+            timer = threading.Timer(remaining, with_db_cleanup(self._flush_members), args=(group,))
+            timer.daemon = True
+            timer.start()
+
+    def _flush_members(self, group: AlertGroup) -> None:
+        from .persistence import append_coalesced_alerts, update_case
+
+        with self._lock:
+            members = list(group.members)
+            flushed = group.flushed_members
+            if group.case_uid is None or len(members) == flushed:
+                return
+            group.flushed_members = len(members)
+        try:
+            if group.cached:
+                # 已有记录可能聚合过其他告警，只追加本组新到达的告警，不覆盖
+                if not append_coalesced_alerts(group.case_uid, members[flushed:]):
+                    logger.warning(f"Cached case {group.case_uid} is not stored yet, coalesced alerts not recorded")
+            else:
+                # 诊断记录可能仍在后台写入队列中，按 uid 更新
+                update_case(group.case_uid, coalesced_alerts=members)
+        except Exception as e:
+            logger.error(f"Failed to attach coalesced alerts to case {group.case_uid}: {str(e)}")
+
+    def submit(self, alert_info: str, diagnose: Callable[[], Dict], fingerprint: str = '') -> Dict:
+        """提交一条告警：leader 执行 diagnose()，同组其余告警等待并复用其结果"""
+        group, is_leader = self._admit(alert_info, fingerprint)
+        if not is_leader:
+            logger.info(f"Alert coalesced into group '{group.key}' ({len(group.members) + 1} alerts)")
+            return self._follower_result(group, group.future.result())
+        try:
+            payload = diagnose()
+        except Exception as e:
+            self._complete(group, None, e)
+            raise
+        self._complete(group, payload, None)
+        return {**payload, 'coalesced': False}
+
+    async def asubmit(self, alert_info: str, diagnose, fingerprint: str = '') -> Dict:
+        """submit 的异步版本，diagnose 为返回协程的函数"""
+        loop = asyncio.get_running_loop()
+        group, is_leader = await loop.run_in_executor(get_executor(), self._admit, alert_info, fingerprint)
+        if not is_leader:
+            payload = await asyncio.wrap_future(group.future)
+            return self._follower_result(group, payload)
+        try:
+            payload = await diagnose()
+        except Exception as e:
+            self._complete(group, None, e)
+            raise
+        await loop.run_in_executor(get_executor(), with_db_cleanup(self._complete), group, payload, None)
+        return {**payload, 'coalesced': False}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'active_groups': len(self._groups),
+                'groups_total': self.groups_total,
+                'coalesced_total': self.coalesced_total,
+                'window': self.window,
+            }
+
+
+_coalescer: Optional[AlertCoalescer] = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer() -> AlertCoalescer:
+    """获取进程内共享的告警聚合器"""
+    global _coalescer
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                _coalescer = AlertCoalescer.from_settings()
+    return _coalescer
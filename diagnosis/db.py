@@ -0,0 +1,31 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """新建 SQLite 连接后执行数据库配置中 PRAGMAS 指定的 PRAGMA（connection_created 信号处理函数）"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = connection.settings_dict.get('PRAGMAS') or {}
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if 'journal_mode' in pragmas:
+            cursor.execute('PRAGMA journal_mode')
+            mode = cursor.fetchone()[0]
+            # 内存数据库（测试库）不支持 WAL，会保持 memory 模式
+            if mode.lower() != str(pragmas['journal_mode']).lower() and mode.lower() != 'memory':
+                logger.warning(f"SQLite journal_mode is {mode}, requested {pragmas['journal_mode']}")
+
+
+def sqlite_status(connection) -> dict:
+    """读取当前 SQLite 连接实际生效的 PRAGMA"""
+    status = {}
+    with connection.cursor() as cursor:
+        for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size'):
+            cursor.execute(f'PRAGMA {name}')
+            status[name] = cursor.fetchone()[0]
+    return status
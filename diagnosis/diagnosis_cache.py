@@ -0,0 +1,250 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .metrics import CACHE_HITS, CACHE_MISSES
+
+logger = logging.getLogger(__name__)
+
+
+class DiagnosisCache:
+    """近期诊断结果缓存
+
+    - 精确匹配：按提示词哈希查找，先查进程内缓存，再查数据库中近期的 FaultCase（多 worker 共享）
+    - 语义匹配：复用范围（检索分类、指标序列与参考案例）相同，且告警/指标/日志各部分输入的向量
+      与近期诊断的余弦相似度都不低于阈值时复用结果
+    缓存条目超过 TTL 后失效，知识库变化时整体失效：本进程内的变化直接调用 invalidate()，
+    其他进程（worker、导入命令）的变化通过每隔 version_interval 秒查询一次知识库版本发现。
+    """
+
+    def __init__(self, ttl: float = 600, similarity_threshold: float = 0.95, max_entries: int = 1000,
+                 version_interval: float = 5):
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.version_interval = version_interval
+        self._version: Optional[Tuple] = None
+        self._version_checked_at = 0.0
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()  # prompt_hash -> 条目
+        # 语义匹配用的向量矩阵，按 (复用范围, 向量形状) 分组（按需重建）
+        self._index: Optional[Dict[Tuple, Tuple[List[str], np.ndarray]]] = None
+        self._lock = threading.Lock()
+        self.invalidated_at = time.time()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls) -> 'DiagnosisCache':
+        return cls(
+            ttl=settings.DIAGNOSIS_CACHE_TTL,
+            similarity_threshold=settings.DIAGNOSIS_CACHE_SIMILARITY,
+            max_entries=settings.DIAGNOSIS_CACHE_MAX_ENTRIES,
+            version_interval=settings.DIAGNOSIS_CACHE_VERSION_INTERVAL,
+        )
+
+    @staticmethod
+    def knowledge_version() -> Tuple[Optional[datetime], int]:
+        """知识库版本：最近的更新时间与条目数（条目数用于发现删除）"""
+        from django.db.models import Count, Max
+        from knowledge_base.models import FaultKnowledge
+
+        version = FaultKnowledge.objects.aggregate(updated=Max('updated_at'), count=Count('id'))
+        return version['updated'], version['count']
+
+    def _check_version(self, now: float) -> None:
+        """节流地比较共享的知识库版本，其他进程修改了知识库时清空本进程缓存"""
+        if now - self._version_checked_at < self.version_interval:
+            return
+        self._version_checked_at = now
+        try:
+            version = self.knowledge_version()
+        except Exception as e:
+            logger.warning(f"Failed to read knowledge version: {str(e)}")
+            return
+        previous, self._version = self._version, version
+        if previous is None or version == previous:
+            return
+        updated_at = version[0].timestamp() if version[0] is not None and version[1] >= previous[1] else now
+        # 数据库中早于知识变化时间的诊断记录同样不再复用
+        self.invalidate(since=min(updated_at, now))
+
+    def _expired(self, entry: Dict, now: float) -> bool:
+        return now - entry['created_at'] > self.ttl
+
+    def _purge_expired(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._index = None
+
+    def _hit(self, payload: Dict, cache_type: str) -> Dict:
+        if cache_type == 'exact':
+            self.exact_hits += 1
+        else:
+            self.semantic_hits += 1
+        CACHE_HITS.inc(cache=f'diagnosis_{cache_type}')
+        logger.info(f"Diagnosis cache {cache_type} hit for case {payload.get('id')}")
+        return {**payload, 'cached': True, 'cache_type': cache_type}
+
+    def lookup_exact(self, prompt_hash: str, reference_cases: List[Dict]) -> Optional[Dict]:
+        """按提示词哈希查找；进程内未命中时查询数据库中 TTL 内且晚于最近一次失效的诊断记录"""
+        from .models import FaultCase
+
+        now = time.time()
+        self._check_version(now)
+        with self._lock:
+            entry = self._entries.get(prompt_hash)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(prompt_hash)
+                return self._hit(entry['payload'], 'exact')
+
+        since = datetime.fromtimestamp(max(now - self.ttl, self.invalidated_at), tz=timezone.utc)
+        case = (FaultCase.objects
+                .filter(prompt_hash=prompt_hash, created_at__gte=since)
+                .order_by('-created_at')
+                .first())
+        if case is None:
+            return None
+        try:
+            result = json.loads(case.analysis_result)
+        except ValueError:
+            return None
+        # 提示词相同意味着检索到的参考案例相同，直接使用本次检索结果
+        payload = {
+            'id': case.id,
+            'uid': case.uid,
+            'category': result.get('category'),
+            'analysis': result.get('analysis'),
+            'solution': result.get('solution'),
+            'matched_knowledge_id': case.matched_knowledge_id,
+            'reference_cases': reference_cases,
+            'prompt_tokens': case.prompt_tokens,
+        }
+        with self._lock:
+            return self._hit(payload, 'exact')
+
+    @staticmethod
+    def _stack(query_vectors) -> Optional[np.ndarray]:
+        """将各部分输入的向量归一化后按行排列，缺失的部分为零向量；传入单个向量时视为只有一部分"""
+        if query_vectors is None or len(query_vectors) == 0:
+            return None
+        parts = list(query_vectors)
+        if parts[0] is not None and np.ndim(parts[0]) == 0:
+            parts = [query_vectors]
+        present = [np.asarray(part, dtype=np.float32) for part in parts if part is not None]
+        if not present:
+            return None
+        rows = np.zeros((len(parts), present[0].shape[0]), dtype=np.float32)
+        for row, part in enumerate(parts):
+            if part is None:
+                continue
+            vector = np.asarray(part, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                rows[row] = vector / norm
+        return rows if rows.any() else None
+
+    def _build_index(self) -> Dict[Tuple, Tuple[List[str], np.ndarray]]:
+        groups: Dict[Tuple, List[str]] = {}
+        for key, entry in self._entries.items():
+            if entry['vectors'] is not None:
+                groups.setdefault((entry['scope'], entry['vectors'].shape), []).append(key)
+        return {
+            group: (keys, np.stack([self._entries[key]['vectors'] for key in keys]))
+            for group, keys in groups.items()
+        }
+
+    def _miss(self) -> None:
+        self.misses += 1
+        CACHE_MISSES.inc(cache='diagnosis')
+
+    def lookup_similar(self, query_vectors, scope: str = '') -> Optional[Dict]:
+        """在复用范围相同的近期诊断中，查找各部分输入都足够相近、整体最相近的一条
+
+        query_vectors 为各部分输入（告警、指标、日志）的向量，空的部分为 None；
+        两边都为空的部分视为相同，只有一边为空的部分视为不同。
+        """
+        query = self._stack(query_vectors)
+        if query is None:
+            return None
+        now = time.time()
+        self._check_version(now)
+        with self._lock:
+            self._purge_expired(now)
+            if self._index is None:
+                self._index = self._build_index()
+            keys, matrix = self._index.get((scope, query.shape), ([], None))
+            if matrix is None:
+                self._miss()
+                return None
+            present = query.any(axis=1)
+            entry_present = matrix.any(axis=2)
+            scores = np.einsum('npd,pd->np', matrix, query)
+            scores = np.where(present & entry_present, scores,
+                              np.where(present == entry_present, 1.0, -1.0))
+            # 以最不相近的部分作为整体相似度，避免告警相同但日志或指标不同的输入被复用
+            overall = scores.min(axis=1)
+            best = int(np.argmax(overall))
+            if overall[best] < self.similarity_threshold:
+                self._miss()
+                return None
+            return self._hit(self._entries[keys[best]]['payload'], 'semantic')
+
+    def store(self, prompt_hash: str, query_vectors, payload: Dict, scope: str = '') -> None:
+        """缓存一次新的诊断结果及其复用范围"""
+        vectors = self._stack(query_vectors)
+        with self._lock:
+            self._entries.pop(prompt_hash, None)
+            self._entries[prompt_hash] = {
+                'payload': payload,
+                'vectors': vectors,
+                'scope': scope,
+                'created_at': time.time(),
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._index = None
+
+    def invalidate(self, since: Optional[float] = None) -> None:
+        """知识库发生变化，之前（或 since 之前）的诊断结果不再复用"""
+        with self._lock:
+            self._entries.clear()
+            self._index = None
+            self.invalidated_at = max(self.invalidated_at, since if since is not None else time.time())
+        logger.info("Diagnosis cache invalidated")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'ttl': self.ttl,
+                'similarity_threshold': self.similarity_threshold,
+                'exact_hits': self.exact_hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+_diagnosis_cache: Optional[DiagnosisCache] = None
+_diagnosis_cache_lock = threading.Lock()
+
+
+def get_diagnosis_cache() -> DiagnosisCache:
+    """获取进程内共享的诊断缓存"""
+    global _diagnosis_cache
+    if _diagnosis_cache is None:
+        with _diagnosis_cache_lock:
+            if _diagnosis_cache is None:
+                _diagnosis_cache = DiagnosisCache.from_settings()
+    return _diagnosis_cache
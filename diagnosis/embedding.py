@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 导出目录中的文件名
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_QUANTIZED_MODEL_FILE = 'model.int8.onnx'
+ONNX_CONFIG_FILE = 'embedding_config.json'
+
+
+class Encoder:
+    """句向量编码器接口：encode 返回 (文本数, 维度) 的 float32 矩阵"""
+
+    dimension: int
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        raise NotImplementedError
+
+
+class SentenceTransformerEncoder(Encoder):
+    """PyTorch 推理（sentence-transformers）"""
+
+    def __init__(self, model_name: str, num_threads: int = 0):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                 show_progress_bar=False).astype(np.float32, copy=False)
+
+
+class OnnxEncoder(Encoder):
+    """ONNX Runtime 推理，模型由 export_embedding_model 命令导出（可选 int8 动态量化）
+
+    文本按长度排序后分批，每批只填充到批内最长的序列，避免短告警被填充到 max_length。
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = True, num_threads: int = 0,
+                 max_length: Optional[int] = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        config_path = os.path.join(model_dir, ONNX_CONFIG_FILE)
+        if not os.path.exists(config_path):
+            raise FileNotFoundError(
+                f'No exported embedding model in {model_dir}, run "python manage.py export_embedding_model" first'
+            )
+        with open(config_path, encoding='utf-8') as f:
+            config = json.load(f)
+        self.dimension = config['dimension']
+        self.max_length = max_length or config['max_length']
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(self.max_length)
+        self.tokenizer.enable_padding(pad_id=config['pad_token_id'], pad_token=config['pad_token'])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.asarray([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.asarray([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+        # 与 sentence-transformers 的 Pooling(mean) 一致：按注意力掩码对 token 向量求平均
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            indexes = order[start:start + batch_size]
+            vectors[indexes] = self._encode_batch([texts[i] for i in indexes])
+        return vectors
+
+
+def export_onnx_model(model_name: str, output_dir: str, max_length: int = 128, quantize: bool = True,
+                      opset: int = 14) -> List[str]:
+    """把 sentence-transformers 模型的 Transformer 部分导出为 ONNX，并可选做 int8 动态量化，返回写入的文件"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device='cpu')
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+
+    sample = tokenizer(['warm up'], return_tensors='pt', padding=True)
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            (sample['input_ids'], sample['attention_mask']),
+            model_path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['last_hidden_state'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'last_hidden_state': {0: 'batch', 1: 'sequence'},
+            },
+            opset_version=opset,
+        )
+    written = [model_path]
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE)
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        written.append(quantized_path)
+
+    tokenizer.save_pretrained(output_dir)
+    config_path = os.path.join(output_dir, ONNX_CONFIG_FILE)
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'model_name': model_name,
+            'dimension': model.get_sentence_embedding_dimension(),
+            'max_length': min(max_length, model.max_seq_length),
+            'pad_token': tokenizer.pad_token,
+            'pad_token_id': tokenizer.pad_token_id,
+        }, f, indent=2)
+    written += [os.path.join(output_dir, 'tokenizer.json'), config_path]
+    return written
+
+
+def create_encoder(backend: str, model_name: str, **options) -> Encoder:
+    """按配置创建编码器：torch（sentence-transformers）或 onnx（ONNX Runtime）"""
+    if backend == 'torch':
+        return SentenceTransformerEncoder(model_name, num_threads=options.get('num_threads', 0))
+    if backend == 'onnx':
+        return OnnxEncoder(
+            options['model_dir'],
+            quantized=options.get('quantized', True),
+            num_threads=options.get('num_threads', 0),
+            max_length=options.get('max_length'),
+        )
+    raise ValueError(f'Unknown embedding backend: {backend}')
@@ -0,0 +1,183 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from .metrics import CACHE_HITS, CACHE_MISSES
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """查询向量缓存
+
+    键为 (模型名, 文本) 的 SHA-256 摘要。第一层是进程内 LRU，同时受条目数和字节数限制；
+    可选的第二层是 SQLite 文件（WAL 模式），可在多个 worker 之间及重启后共享；
+    文件中的条目超过 persist_max_rows 时按写入先后淘汰最早的条目（每写入一定数量检查一次）。
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                 persist_path: Optional[str] = None, persist_max_rows: int = 50000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.persist_path = persist_path
+        self.persist_max_rows = persist_max_rows
+        # 每写入这么多条检查一次持久化层的行数，超出上限的部分最多为其 1/10
+        self._trim_every = max(1, persist_max_rows // 10)
+        self._puts_since_trim = 0
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if persist_path:
+            self._init_db()
+
+    @classmethod
+    def from_settings(cls, model_name: str) -> 'EmbeddingCache':
+        from django.conf import settings
+        return cls(
+            model_name,
+            max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+            max_bytes=settings.EMBEDDING_CACHE_MAX_BYTES,
+            persist_path=settings.EMBEDDING_CACHE_PATH or None,
+            persist_max_rows=settings.EMBEDDING_CACHE_PERSIST_MAX_ROWS,
+        )
+
+    def _init_db(self):
+        """初始化持久化缓存层，失败时仅使用内存缓存"""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.persist_path)), exist_ok=True)
+            self._db = sqlite3.connect(self.persist_path, timeout=5, check_same_thread=False,
+                                       isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)'
+            )
+            self._trim()
+            logger.info(f"Embedding cache persisted at {self.persist_path}")
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to open embedding cache file, using memory only: {str(e)}")
+            self._db = None
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f'{self.model_name}\0{text}'.encode('utf-8')).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """读取缓存向量，未命中返回 None"""
+        key = self.key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                CACHE_HITS.inc(cache='embedding_memory')
+                return vector
+
+        vector = self._db_get(key)
+        if vector is not None:
+            self._remember(key, vector)
+            with self._lock:
+                self.disk_hits += 1
+            CACHE_HITS.inc(cache='embedding_disk')
+            return vector
+
+        with self._lock:
+            self.misses += 1
+        CACHE_MISSES.inc(cache='embedding')
+        return None
+
+    def put(self, text: str, vector) -> None:
+        """写入缓存向量"""
+        key = self.key(text)
+        vector = np.array(vector, dtype=np.float32)
+        self._remember(key, vector)
+        self._db_put(key, vector)
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        vector.setflags(write=False)
+        size = vector.nbytes + len(key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes + len(key)
+            self._entries[key] = vector
+            self._bytes += size
+            # 超出条目数或字节数上限时淘汰最久未使用的条目
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                old_key, old_vector = self._entries.popitem(last=False)
+                self._bytes -= old_vector.nbytes + len(old_key)
+
+    def _db_get(self, key: str) -> Optional[np.ndarray]:
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute('SELECT vector FROM embeddings WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read embedding cache: {str(e)}")
+            return None
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).copy()
+
+    def _db_put(self, key: str, vector: np.ndarray) -> None:
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute('INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)',
+                                 (key, vector.tobytes()))
+                self._puts_since_trim += 1
+                if self._puts_since_trim >= self._trim_every:
+                    self._trim()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write embedding cache: {str(e)}")
+
+    def _trim(self) -> None:
+        """只保留最近写入的 persist_max_rows 条（INSERT OR REPLACE 会分配新的 rowid，rowid 越小写入越早）"""
+        self._puts_since_trim = 0
+        if self.persist_max_rows <= 0:
+            return
+        deleted = self._db.execute(
+            'DELETE FROM embeddings WHERE rowid <= '
+            '(SELECT rowid FROM embeddings ORDER BY rowid DESC LIMIT 1 OFFSET ?)',
+            (self.persist_max_rows,)
+        ).rowcount
+        if deleted > 0:
+            logger.info(f"Evicted {deleted} oldest entries from embedding cache file")
+
+    def clear(self) -> None:
+        """清空内存缓存（持久化层按内容寻址，无需随知识库变化而清理）"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'model': self.model_name,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'persistent': self._db is not None,
+                'persist_max_rows': self.persist_max_rows,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class IndexingQueue:
+    """后台向量索引队列
+
+    知识条目的保存/删除只把 ID 放入队列，由后台线程批量处理：
+    - 同一 ID 的多次修改会被合并，只按数据库中的最新状态索引一次
+    - 待处理条目达到 batch_size 或最早条目等待超过 flush_interval 秒时触发刷新
+    - 刷新时一次查询读取整批条目，存在的批量编码并 upsert，不存在的批量删除
+    """
+
+    def __init__(self, service_factory: Callable, batch_size: int = 64, flush_interval: float = 2.0):
+        self.service_factory = service_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._service = None
+        self._pending: Dict[int, float] = {}  # knowledge_id -> 首次入队时间
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._flushing = 0
+        self.last_flush_at: Optional[float] = None
+        self.indexed_total = 0
+        self.deleted_total = 0
+        self.failed_total = 0
+        self.last_error: Optional[str] = None
+
+    def enqueue(self, knowledge_id: int) -> None:
+        """将知识条目 ID 加入待索引队列，已在队列中的 ID 保留最早入队时间"""
+        with self._cond:
+            self._pending.setdefault(knowledge_id, time.time())
+            self._ensure_worker()
+            self._cond.notify()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='vector-indexing-queue', daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._should_flush():
+                    self._cond.wait(timeout=self._time_until_flush())
+                batch = self._take_batch()
+            try:
+                self._process(batch)
+            finally:
+                with self._cond:
+                    self._flushing = 0
+                close_old_connections()
+
+    def _should_flush(self) -> bool:
+        if not self._pending:
+            return False
+        if len(self._pending) >= self.batch_size:
+            return True
+        return time.time() - min(self._pending.values()) >= self.flush_interval
+
+    def _time_until_flush(self) -> Optional[float]:
+        if not self._pending:
+            return None
+        return max(0.0, self.flush_interval - (time.time() - min(self._pending.values())))
+
+    def _take_batch(self) -> Dict[int, float]:
+        ids = sorted(self._pending, key=self._pending.get)[:self.batch_size]
+        batch = {knowledge_id: self._pending.pop(knowledge_id) for knowledge_id in ids}
+        self._flushing = len(batch)
+        return batch
+
+    def _get_service(self):
+        if self._service is None:
+            self._service = self.service_factory()
+        return self._service
+
+    def _process(self, batch: Dict[int, float]) -> None:
+        from knowledge_base.models import FaultKnowledge
+        from .services import knowledge_to_dict
+
+        try:
+            existing = list(FaultKnowledge.objects.select_related('category').filter(id__in=list(batch)))
+            deleted_ids = set(batch) - {knowledge.id for knowledge in existing}
+            service = self._get_service()
+            self.indexed_total += service.upsert_knowledge_batch([knowledge_to_dict(k) for k in existing])
+            self.deleted_total += service.delete_knowledge_batch(sorted(deleted_ids))
+            # 知识库已变化，近期的诊断结果不再复用
+            from .diagnosis_cache import get_diagnosis_cache
+            get_diagnosis_cache().invalidate()
+            self.last_flush_at = time.time()
+            self.last_error = None
+        except Exception as e:
+            self.failed_total += len(batch)
+            self.last_error = str(e)
+            logger.error(f"Failed to index knowledge batch {sorted(batch)}: {str(e)}")
+            # 失败的条目重新入队，等待下一次刷新重试
+            with self._cond:
+                for knowledge_id, enqueued_at in batch.items():
+                    self._pending.setdefault(knowledge_id, enqueued_at)
+            # 避免向量库不可用时空转重试
+            time.sleep(self.flush_interval)
+
+    def status(self) -> Dict:
+        """返回队列深度与索引滞后情况"""
+        with self._cond:
+            depth = len(self._pending) + self._flushing
+            oldest = min(self._pending.values()) if self._pending else None
+        now = time.time()
+        return {
+            'queue_depth': depth,
+            'lag_seconds': round(now - oldest, 3) if oldest is not None else 0.0,
+            'last_flush_at': self.last_flush_at,
+            'indexed_total': self.indexed_total,
+            'deleted_total': self.deleted_total,
+            'failed_total': self.failed_total,
+            'last_error': self.last_error,
+        }
+
+
+_queue: Optional[IndexingQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_indexing_queue() -> IndexingQueue:
+    """获取进程内共享的索引队列"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                from .services import get_vector_db
+                _queue = IndexingQueue(
+                    service_factory=get_vector_db,
+                    batch_size=settings.VECTOR_INDEX_BATCH_SIZE,
+                    flush_interval=settings.VECTOR_INDEX_FLUSH_INTERVAL,
+                )
+    return _queue
+
+
+def _queue_status(key: str) -> float:
+    # 队列尚未创建时不为了导出指标而启动后台线程
+    return _queue.status()[key] if _queue is not None else 0
+
+
+registry.gauge('vector_index_queue_depth', 'Knowledge entries waiting to be indexed',
+               lambda: _queue_status('queue_depth'))
+registry.gauge('vector_index_lag_seconds', 'Age of the oldest entry waiting to be indexed',
+               lambda: _queue_status('lag_seconds'))
+
+
+def schedule_index(knowledge_id: int) -> None:
+    """事务提交后再入队，避免索引到回滚的数据"""
+    transaction.on_commit(lambda: get_indexing_queue().enqueue(knowledge_id))
+
+
+def index_status() -> Dict:
+    """汇总索引队列状态，并给出数据库最新修改与最近一次索引之间的滞后"""
+    from django.db.models import Max
+    from knowledge_base.models import FaultKnowledge
+
+    status = get_indexing_queue().status()
+    latest_update = FaultKnowledge.objects.aggregate(latest=Max('updated_at'))['latest']
+    status['auto_sync'] = settings.VECTOR_INDEX_AUTO_SYNC
+    status['db_latest_update'] = latest_update.isoformat() if latest_update else None
+    return status
@@ -0,0 +1,375 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Optional
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 可重试的 HTTP 状态码：限流与网关/服务端临时错误
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """大模型调用失败"""
+
+    def __init__(self, message: str, retryable: bool = False, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.message = message
+        self.retryable = retryable
+        self.status_code = status_code
+
+
+class LLMConfigurationError(LLMError):
+    """大模型后端配置错误（如缺少 API 密钥）"""
+
+
+@dataclass
+class LLMResult:
+    content: str
+    model: str
+    usage: Dict[str, int] = field(default_factory=dict)
+    attempts: int = 1
+
+
+@dataclass
+class RouteOptions:
+    """单个调用场景（路由）的模型参数与时间预算"""
+    model: str = 'qwen-max'
+    temperature: float = 0.7
+    top_p: float = 0.8
+    max_tokens: int = 1500
+    timeout: float = 60.0  # 整次调用（含重试）的总时间预算，秒
+
+    @classmethod
+    def for_route(cls, route: str) -> 'RouteOptions':
+        routes = settings.LLM_ROUTES
+        return cls(**{**routes.get('default', {}), **routes.get(route, {})})
+
+
+class LLMBackend:
+    """大模型后端基类
+
+    子类实现 _generate_once / _stream_once（以及可选的 _agenerate_once），
+    基类负责时间预算内的带抖动指数退避重试，只重试 retryable 的错误。
+    """
+
+    def __init__(self, max_retries: int = 2, backoff: float = 0.5, max_backoff: float = 8.0, **options):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.options = options
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # full jitter：在 [0, min(max_backoff, backoff * 2^attempt)] 内随机
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def _next_delay(self, error: LLMError, attempt: int, deadline: float) -> Optional[float]:
+        """返回下一次重试前的等待时间；不应重试时返回 None"""
+        if not error.retryable or attempt >= self.max_retries:
+            return None
+        delay = self._backoff_delay(attempt)
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def generate(self, prompt: str, options: RouteOptions) -> LLMResult:
+        deadline = time.monotonic() + options.timeout
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMError(f'调用超时（预算 {options.timeout:.1f}s）', retryable=True)
+            try:
+                result = self._generate_once(prompt, options, remaining)
+                result.attempts = attempt + 1
+                return result
+            except LLMError as e:
+                delay = self._next_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                logger.warning(f"LLM call failed ({e.message}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    async def agenerate(self, prompt: str, options: RouteOptions) -> LLMResult:
+        deadline = time.monotonic() + options.timeout
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMError(f'调用超时（预算 {options.timeout:.1f}s）', retryable=True)
+            try:
+                result = await self._agenerate_once(prompt, options, remaining)
+                result.attempts = attempt + 1
+                return result
+            except LLMError as e:
+                delay = self._next_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                logger.warning(f"LLM call failed ({e.message}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def stream(self, prompt: str, options: RouteOptions, usage: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        """流式输出只在尚未产出任何内容时重试；传入 usage 时输出完成后其中为本次调用的 token 用量"""
+        deadline = time.monotonic() + options.timeout
+        attempt = 0
+        usage = usage if usage is not None else {}
+        while True:
+            produced = False
+            try:
+                for chunk in self._stream_once(prompt, options, deadline, usage):
+                    produced = True
+                    yield chunk
+                return
+            except LLMError as e:
+                delay = None if produced else self._next_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                logger.warning(f"LLM stream failed ({e.message}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def _generate_once(self, prompt: str, options: RouteOptions, timeout: float) -> LLMResult:
+        raise NotImplementedError
+
+    async def _agenerate_once(self, prompt: str, options: RouteOptions, timeout: float) -> LLMResult:
+        # 默认在线程中执行同步实现
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._generate_once, prompt, options, timeout
+        )
+
+    def _stream_once(self, prompt: str, options: RouteOptions, deadline: float,
+                     usage: Dict[str, int]) -> Iterator[str]:
+        # 默认一次性返回完整结果
+        result = self._generate_once(prompt, options, max(0.0, deadline - time.monotonic()))
+        usage.update(result.usage)
+        yield result.content
+
+
+class DashScopeBackend(LLMBackend):
+    """通义千问 DashScope HTTP 接口
+
+    使用带连接池的 requests.Session（同步）和按事件循环复用的 aiohttp.ClientSession（异步），
+    API 密钥随请求头传递，不再修改 dashscope 的全局状态。
+    """
+
+    endpoint = 'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation'
+
+    def __init__(self, api_key: Optional[str] = None, endpoint: Optional[str] = None,
+                 pool_maxsize: int = 32, **options):
+        super().__init__(**options)
+        self.api_key = api_key
+        self.endpoint = endpoint or self.endpoint
+        self.pool_maxsize = pool_maxsize
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        # 每个事件循环复用一个 aiohttp 会话（连接池），事件循环销毁后自动释放引用
+        self._async_sessions = weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
+
+    def _headers(self, stream: bool = False) -> Dict[str, str]:
+        if not self.api_key:
+            raise LLMConfigurationError('API密钥未配置')
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+        }
+        if stream:
+            headers['Accept'] = 'text/event-stream'
+            headers['X-DashScope-SSE'] = 'enable'
+        return headers
+
+    def _body(self, prompt: str, options: RouteOptions, stream: bool = False) -> Dict:
+        parameters = {
+            'result_format': 'message',
+            'max_tokens': options.max_tokens,
+            'temperature': options.temperature,
+            'top_p': options.top_p,
+        }
+        if stream:
+            parameters['incremental_output'] = True
+        return {'model': options.model, 'input': {'prompt': prompt}, 'parameters': parameters}
+
+    @staticmethod
+    def _error_for_status(status_code: int, text: str) -> LLMError:
+        try:
+            message = json.loads(text).get('message') or text
+        except ValueError:
+            message = text
+        return LLMError(f'API返回错误({status_code}): {message[:200]}',
+                        retryable=status_code in RETRYABLE_STATUS_CODES, status_code=status_code)
+
+    @staticmethod
+    def _parse(data: Dict, model: str) -> LLMResult:
+        try:
+            content = data['output']['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            raise LLMError('无法获取API响应内容')
+        return LLMResult(content=content, model=model, usage=data.get('usage') or {})
+
+    def _generate_once(self, prompt: str, options: RouteOptions, timeout: float) -> LLMResult:
+        try:
+            response = self._session.post(
+                self.endpoint,
+                headers=self._headers(),
+                json=self._body(prompt, options),
+                timeout=timeout
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise LLMError(f'API调用失败: {str(e)}', retryable=True)
+        if response.status_code != 200:
+            raise self._error_for_status(response.status_code, response.text)
+        return self._parse(response.json(), options.model)
+
+    def _get_async_session(self):
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            session = self._async_sessions.get(loop)
+            if session is None or session.closed:
+                session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_maxsize))
+                self._async_sessions[loop] = session
+        return session
+
+    async def _agenerate_once(self, prompt: str, options: RouteOptions, timeout: float) -> LLMResult:
+        import aiohttp
+
+        session = self._get_async_session()
+        try:
+            async with session.post(
+                self.endpoint,
+                headers=self._headers(),
+                json=self._body(prompt, options),
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                text = await response.text()
+                if response.status != 200:
+                    raise self._error_for_status(response.status, text)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise LLMError(f'API调用失败: {str(e) or type(e).__name__}', retryable=True)
+        return self._parse(json.loads(text), options.model)
+
+    def _stream_once(self, prompt: str, options: RouteOptions, deadline: float,
+                     usage: Dict[str, int]) -> Iterator[str]:
+        try:
+            response = self._session.post(
+                self.endpoint,
+                headers=self._headers(stream=True),
+                json=self._body(prompt, options, stream=True),
+                timeout=max(0.1, deadline - time.monotonic()),
+                stream=True
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise LLMError(f'API调用失败: {str(e)}', retryable=True)
+        with response:
+            if response.status_code != 200:
+                raise self._error_for_status(response.status_code, response.text)
+            # SSE 响应头可能不带 charset，requests 会按 ISO-8859-1 解码导致中文乱码
+            response.encoding = 'utf-8'
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if time.monotonic() > deadline:
+                        raise LLMError(f'调用超时（预算 {options.timeout:.1f}s）')
+                    if not line or not line.startswith('data:'):
+                        continue
+                    try:
+                        data = json.loads(line[5:])
+                    except ValueError:
+                        raise LLMError(f'API返回的流式数据格式不正确: {line[:200]}')
+                    if data.get('code'):
+                        raise LLMError(f"API返回错误: {data.get('message')}")
+                    result = self._parse(data, options.model)
+                    # 增量输出时每帧携带截至当前的累计用量
+                    usage.update(result.usage)
+                    if result.content:
+                        yield result.content
+            except (requests.ConnectionError, requests.Timeout) as e:
+                raise LLMError(f'API调用失败: {str(e)}')
+
+
+class StubBackend(LLMBackend):
+    """本地确定性桩后端，用于离线压测和基准测试
+
+    同一提示词总是返回相同的诊断 JSON，延迟为 latency 秒（可加 jitter 秒的均匀抖动）。
+    """
+
+    categories = ['数据库故障', '网络故障', '存储故障', '应用故障', '资源耗尽']
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.0, stream_chunk_size: int = 8, **options):
+        super().__init__(**options)
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_chunk_size = stream_chunk_size
+
+    def _content(self, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        category = self.categories[int(digest[:8], 16) % len(self.categories)]
+        return json.dumps({
+            'category': category,
+            'analysis': f'桩后端分析结果 {digest[:12]}',
+            'solution': f'桩后端解决方案 {digest[12:24]}',
+        }, ensure_ascii=False)
+
+    def _delay(self) -> float:
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _result(self, prompt: str, options: RouteOptions) -> LLMResult:
+        content = self._content(prompt)
+        return LLMResult(content=content, model=f'stub:{options.model}',
+                         usage={'input_tokens': len(prompt), 'output_tokens': len(content)})
+
+    def _generate_once(self, prompt: str, options: RouteOptions, timeout: float) -> LLMResult:
+        delay = self._delay()
+        if delay > timeout:
+            time.sleep(timeout)
+            raise LLMError(f'调用超时（预算 {options.timeout:.1f}s）', retryable=True)
+        time.sleep(delay)
+        return self._result(prompt, options)
+
+    async def _agenerate_once(self, prompt: str, options: RouteOptions, timeout: float) -> LLMResult:
+        delay = self._delay()
+        if delay > timeout:
+            await asyncio.sleep(timeout)
+            raise LLMError(f'调用超时（预算 {options.timeout:.1f}s）', retryable=True)
+        await asyncio.sleep(delay)
+        return self._result(prompt, options)
+
+    def _stream_once(self, prompt: str, options: RouteOptions, deadline: float,
+                     usage: Dict[str, int]) -> Iterator[str]:
+        content = self._content(prompt)
+        usage.update(self._result(prompt, options).usage)
+        chunks = [content[i:i + self.stream_chunk_size] for i in range(0, len(content), self.stream_chunk_size)]
+        per_chunk = self._delay() / max(1, len(chunks))
+        for chunk in chunks:
+            time.sleep(per_chunk)
+            yield chunk
+
+
+_backend: Optional[LLMBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_llm_backend() -> LLMBackend:
+    """按 settings.LLM_BACKEND / LLM_OPTIONS 创建进程内共享的大模型后端"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = import_string(settings.LLM_BACKEND)
+                _backend = backend_class(**settings.LLM_OPTIONS)
+    return _backend
@@ -0,0 +1,139 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+WILDCARD = '<*>'
+
+# 行首时间戳：ISO 8601 / "2024-01-01 12:00:00,123" / syslog "Jan  1 12:00:00"
+_TIMESTAMP_PATTERN = re.compile(
+    r'^\[?(?P<ts>\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?'
+    r'|[A-Z][a-z]{2} +\d{1,2} \d{2}:\d{2}:\d{2})\]?\s*'
+)
+# 含数字的 token（IP、ID、耗时等）视为变量，不参与分组
+_VARIABLE_TOKEN = re.compile(r'\d')
+_ERROR_PATTERN = re.compile(r'\b(?:ERROR|FATAL|CRITICAL|Exception|Traceback|panic)\b|错误|异常|失败', re.I)
+
+
+@dataclass
+class LogCluster:
+    """一个日志模板及其统计"""
+    template: List[str]
+    order: int
+    count: int = 0
+    first_ts: Optional[str] = None
+    last_ts: Optional[str] = None
+    has_error: bool = False
+    samples: Dict[int, List[str]] = field(default_factory=dict)
+
+
+class LogReducer:
+    """Drain 风格的单遍日志模板提取
+
+    按 token 数和首个 token 分组，组内与已有模板逐位置比较，相似度不低于 similarity 时归入该模板，
+    不同的位置替换为 <*> 并保留少量变量取值示例。模板数达到 max_clusters 后，
+    无法归入已有模板的行只计数，内存占用与输入行数无关。
+    """
+
+    def __init__(self, similarity: float = 0.5, max_clusters: int = 1000, max_samples: int = 3,
+                 max_line_length: int = 2000):
+        self.similarity = similarity
+        self.max_clusters = max_clusters
+        self.max_samples = max_samples
+        self.max_line_length = max_line_length
+        self._groups: Dict[Tuple[int, str], List[LogCluster]] = {}
+        self.clusters: List[LogCluster] = []
+        self.lines = 0
+        self.unclustered = 0
+
+    @staticmethod
+    def _group_key(tokens: List[str]) -> Tuple[int, str]:
+        first = tokens[0] if tokens and not _VARIABLE_TOKEN.search(tokens[0]) else WILDCARD
+        return len(tokens), first
+
+    def _score(self, template: List[str], tokens: List[str]) -> float:
+        same = sum(1 for a, b in zip(template, tokens) if a == b or a == WILDCARD)
+        return same / len(tokens) if tokens else 1.0
+
+    def add(self, line: str) -> None:
+        line = line.rstrip()
+        if not line.strip():
+            return
+        self.lines += 1
+        timestamp = None
+        match = _TIMESTAMP_PATTERN.match(line)
+        if match:
+            timestamp = match.group('ts')
+            line = line[match.end():]
+        tokens = line[:self.max_line_length].split()
+        group = self._groups.setdefault(self._group_key(tokens), [])
+
+        best, best_score = None, self.similarity
+        for cluster in group:
+            score = self._score(cluster.template, tokens)
+            if score >= best_score:
+                best, best_score = cluster, score
+        if best is None:
+            if len(self.clusters) >= self.max_clusters:
+                self.unclustered += 1
+                return
+            # 新模板中含数字的 token 直接视为变量
+            best = LogCluster(
+                template=[WILDCARD if _VARIABLE_TOKEN.search(t) else t for t in tokens],
+                order=len(self.clusters),
+            )
+            group.append(best)
+            self.clusters.append(best)
+
+        best.count += 1
+        best.first_ts = best.first_ts or timestamp
+        best.last_ts = timestamp or best.last_ts
+        best.has_error = best.has_error or bool(_ERROR_PATTERN.search(line))
+        for position, (template_token, token) in enumerate(zip(best.template, tokens)):
+            if template_token != token and template_token != WILDCARD:
+                best.template[position] = WILDCARD
+            if best.template[position] == WILDCARD:
+                values = best.samples.setdefault(position, [])
+                if len(values) < self.max_samples and token not in values:
+                    values.append(token)
+
+    def feed(self, lines: Iterable[str]) -> 'LogReducer':
+        for line in lines:
+            self.add(line)
+        return self
+
+    def render(self, max_templates: int = 50) -> str:
+        """输出压缩后的日志：优先保留含错误关键字和出现次数多的模板，按首次出现顺序排列"""
+        kept = sorted(self.clusters, key=lambda c: (not c.has_error, -c.count))[:max_templates]
+        kept_orders = {c.order for c in kept}
+        omitted = [c for c in self.clusters if c.order not in kept_orders]
+        lines = [f'[日志已压缩：原始 {self.lines} 行，{len(self.clusters)} 个模板]']
+        for cluster in sorted(kept, key=lambda c: c.order):
+            parts = [f'[x{cluster.count}]']
+            if cluster.first_ts:
+                span = cluster.first_ts if cluster.first_ts == cluster.last_ts else f'{cluster.first_ts} ~ {cluster.last_ts}'
+                parts.append(span)
+            parts.append(' '.join(cluster.template))
+            line = ' '.join(parts)
+            samples = [
+                f'{index}={",".join(cluster.samples[position])}'
+                for index, position in enumerate(sorted(cluster.samples), 1)
+                if cluster.samples[position]
+            ]
+            if samples:
+                line += f' | 变量示例: {" ".join(samples)}'
+            lines.append(line)
+        if omitted:
+            lines.append(f'[另有 {len(omitted)} 个模板共 {sum(c.count for c in omitted)} 行未列出]')
+        if self.unclustered:
+            lines.append(f'[另有 {self.unclustered} 行超出模板数上限未归类]')
+        return '\n'.join(lines)
+
+
+def reduce_log(log_info: str, min_lines: int = 20, max_templates: int = 50, similarity: float = 0.5,
+               max_clusters: int = 1000) -> str:
+    """压缩日志文本；行数少于 min_lines 时原样返回"""
+    if not log_info or log_info.count('\n') + 1 < min_lines:
+        return log_info
+    reducer = LogReducer(similarity=similarity, max_clusters=max_clusters)
+    reducer.feed(log_info.splitlines())
+    return reducer.render(max_templates=max_templates)
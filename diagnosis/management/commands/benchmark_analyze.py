@@ -0,0 +1,123 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from diagnosis import benchmark
+
+
+class Command(BaseCommand):
+    help = ('重放记录的诊断请求并输出吞吐量与各阶段 p50/p95/p99 耗时（JSON）。'
+            'inprocess 模式在临时数据库和临时向量库中生成各规模的合成知识库，大模型替换为固定延迟的桩后端；'
+            'http 模式向运行中的服务发送请求（服务端需自行配置 LLM_BACKEND=diagnosis.llm.StubBackend）')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            default=os.path.join(settings.BASE_DIR, 'benchmarks', 'analyze_requests.jsonl'),
+            help='JSONL 格式的请求文件，每行为 analyze 接口的请求体'
+        )
+        parser.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess')
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='http 模式下的服务地址')
+        parser.add_argument(
+            '--sizes',
+            default='1k,10k',
+            help='inprocess 模式下合成知识库的规模，逗号分隔，如 1k,10k,100k,1m（条目依次扩充复用）'
+        )
+        parser.add_argument('--concurrency', type=int, default=4, help='并发请求数')
+        parser.add_argument('--repeat', type=int, default=3, help='请求文件重放的轮数')
+        parser.add_argument('--warmup', type=int, default=1, help='正式计时前预热重放的轮数')
+        parser.add_argument('--llm-latency', type=float, default=0.2, help='桩后端的固定延迟（秒）')
+        parser.add_argument('--llm-jitter', type=float, default=0.0, help='桩后端延迟的均匀抖动（秒）')
+        parser.add_argument(
+            '--with-cache',
+            action='store_true',
+            help='保留诊断缓存（默认关闭，否则重放的请求会直接命中缓存）'
+        )
+        parser.add_argument('--index-batch-size', type=int, default=1000, help='生成合成知识库时的批大小')
+        parser.add_argument('--output', default='', help='结果 JSON 的输出路径，默认输出到标准输出')
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['requests']):
+            raise CommandError(f"Requests file not found: {options['requests']}")
+        requests = benchmark.load_requests(options['requests'])
+        if not requests:
+            raise CommandError('No valid requests to replay')
+
+        report = {
+            'commit': benchmark.git_commit(),
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'mode': options['mode'],
+            'requests_file': options['requests'],
+            'unique_requests': len(requests),
+            'concurrency': options['concurrency'],
+            'repeat': options['repeat'],
+        }
+        if options['mode'] == 'http':
+            report['url'] = options['url']
+            self._warm_up(lambda reqs: benchmark.run_http(options['url'], reqs, options['concurrency']),
+                          requests, options['warmup'])
+            report['results'] = [benchmark.run_http(options['url'], requests, options['concurrency'],
+                                                    options['repeat'])]
+        else:
+            report['llm_latency'] = options['llm_latency']
+            report['llm_jitter'] = options['llm_jitter']
+            with override_settings(DIAGNOSIS_CACHE_ENABLED=options['with_cache']):
+                report['results'] = self._run_inprocess(requests, options)
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Benchmark results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def _warm_up(self, run, requests, rounds):
+        for _ in range(rounds):
+            run(requests)
+
+    def _run_inprocess(self, requests, options):
+        from diagnosis.diagnosis_cache import DiagnosisCache
+        from diagnosis.llm import StubBackend
+        from diagnosis.pipeline import DiagnosisPipeline
+        from diagnosis.services import VectorDBService
+
+        vector_dir = tempfile.mkdtemp(prefix='benchmark-chroma-')
+        db_dir = tempfile.mkdtemp(prefix='benchmark-db-')
+        # SQLite 默认的测试库在内存中，这里改为临时文件，以便测到真实的磁盘写入且多线程共享同一个库
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            connection.settings_dict['TEST']['NAME'] = os.path.join(db_dir, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            vector_db = VectorDBService(persist_directory=vector_dir, collection_name='benchmark')
+            pipeline = DiagnosisPipeline(
+                vector_db=vector_db,
+                diagnosis_cache=DiagnosisCache(),
+                llm=StubBackend(latency=options['llm_latency'], jitter=options['llm_jitter']),
+            )
+            knowledge_base = benchmark.SyntheticKnowledgeBase(vector_db, batch_size=options['index_batch_size'])
+            results = []
+            for size in sorted(set(benchmark.iter_sizes(options['sizes']))):
+                self.stderr.write(f'Building synthetic knowledge base with {size} entries...')
+                build = knowledge_base.grow_to(size)
+                self._warm_up(lambda reqs: benchmark.run_inprocess(pipeline, reqs, options['concurrency']),
+                              requests, options['warmup'])
+                # 预热只为加载模型和建立连接，正式计时从冷的查询向量缓存开始，避免掩盖编码耗时
+                vector_db.embedding_cache.clear()
+                self.stderr.write(f'Replaying {len(requests) * options["repeat"]} requests...')
+                result = benchmark.run_inprocess(pipeline, requests, options['concurrency'], options['repeat'])
+                results.append({'kb_size': size, 'build': build, **result})
+            return results
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(vector_dir, ignore_errors=True)
+            shutil.rmtree(db_dir, ignore_errors=True)
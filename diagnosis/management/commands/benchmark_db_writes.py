@@ -0,0 +1,101 @@
+import copy
+import json
+import os
+import platform
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from diagnosis import benchmark
+from diagnosis.db import sqlite_status
+
+# 对照组：各数据库在本项目调优前的默认配置
+BASELINE_OVERRIDES = {
+    # 回滚日志 + 每次提交 fsync，事务以 BEGIN DEFERRED 开始，每个请求新建连接
+    'sqlite': {'PRAGMAS': {'journal_mode': 'DELETE', 'synchronous': 'FULL'}, 'OPTIONS': {}, 'CONN_MAX_AGE': 0},
+    # 每个请求新建连接，不使用连接池
+    'postgresql': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False},
+}
+
+
+class Command(BaseCommand):
+    help = ('并发写入诊断记录的数据库负载测试（JSON）：在临时测试库中分别以 baseline（数据库默认配置）'
+            '和 configured（当前 DATABASE_PROFILE 的调优配置）运行，输出写入吞吐量、p50/p95/p99 耗时与锁冲突次数')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default='baseline,configured',
+                            help='依次运行的配置，逗号分隔：baseline、configured')
+        parser.add_argument('--writers', default='1,4,16', help='并发写线程数，逗号分隔，每个值运行一轮')
+        parser.add_argument('--readers', type=int, default=2, help='同时执行列表查询的读线程数')
+        parser.add_argument('--batch-size', type=int, default=1,
+                            help='每次写入的记录数：1 为单条 INSERT，大于 1 时模拟后台批量写入')
+        parser.add_argument('--duration', type=float, default=5.0, help='每轮持续时间（秒）')
+        parser.add_argument('--output', default='', help='结果 JSON 的输出路径，默认输出到标准输出')
+
+    def handle(self, *args, **options):
+        profiles = [name.strip() for name in options['profiles'].split(',') if name.strip()]
+        unknown = set(profiles) - {'baseline', 'configured'}
+        if unknown:
+            raise CommandError(f"Unknown profiles: {', '.join(sorted(unknown))}")
+        try:
+            writer_counts = [int(value) for value in options['writers'].split(',') if value.strip()]
+        except ValueError:
+            raise CommandError('--writers must be a comma-separated list of integers')
+
+        report = {
+            'commit': benchmark.git_commit(),
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'vendor': connection.vendor,
+            'duration': options['duration'],
+            'results': [],
+        }
+        for profile in profiles:
+            report['results'].append(self._run_profile(profile, writer_counts, options))
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Benchmark results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def _run_profile(self, profile, writer_counts, options):
+        original = copy.deepcopy(connection.settings_dict)
+        if profile == 'baseline':
+            overrides = BASELINE_OVERRIDES.get(connection.vendor, {})
+            connection.settings_dict.update(copy.deepcopy(overrides))
+            connection.settings_dict['OPTIONS'].pop('pool', None)
+        db_dir = tempfile.mkdtemp(prefix='benchmark-db-')
+        # 与 benchmark_analyze 相同，SQLite 测试库使用临时文件，以测到真实的磁盘写入和文件锁
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            connection.settings_dict['TEST']['NAME'] = os.path.join(db_dir, 'benchmark.sqlite3')
+        connection.close()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            result = {'profile': profile, 'conn_max_age': connection.settings_dict['CONN_MAX_AGE']}
+            if connection.vendor == 'sqlite':
+                result['pragmas'] = sqlite_status(connection)
+            elif 'pool' in connection.settings_dict['OPTIONS']:
+                result['pool'] = connection.settings_dict['OPTIONS']['pool']
+            connection.close()
+            result['runs'] = []
+            for writers in writer_counts:
+                self.stderr.write(f'[{profile}] {writers} writers, {options["readers"]} readers, '
+                                  f'{options["duration"]}s...')
+                run = benchmark.run_db_writes(writers, options['duration'], options['batch_size'],
+                                              options['readers'])
+                self.stderr.write(f'[{profile}] {run["rows_per_second"]} rows/s, '
+                                  f'p99 {run["write_latency"].get("p99_ms")} ms, {run["locked_errors"]} locked errors')
+                result['runs'].append(run)
+            return result
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            connection.close()
+            connection.settings_dict.clear()
+            connection.settings_dict.update(original)
+            shutil.rmtree(db_dir, ignore_errors=True)
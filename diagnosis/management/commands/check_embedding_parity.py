@@ -0,0 +1,92 @@
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from diagnosis import benchmark
+from diagnosis.embedding import create_encoder
+from diagnosis.services import VectorDBService
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+class Command(BaseCommand):
+    help = ('比较 ONNX 编码器与 PyTorch 模型的输出：同一文本向量的余弦相似度、查询-知识相似度分数的最大偏差，'
+            '以及单条与批量编码的耗时，超出容差时返回错误')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model-dir', default=settings.EMBEDDING_ONNX_DIR)
+        parser.add_argument('--no-quantize', action='store_true', help='检查未量化的 ONNX 模型')
+        parser.add_argument('--min-cosine', type=float, default=0.98, help='同一文本两种输出的最小余弦相似度')
+        parser.add_argument('--max-score-diff', type=float, default=0.02, help='查询-知识相似度分数的最大绝对偏差')
+        parser.add_argument('--limit', type=int, default=500, help='最多使用的知识条目数')
+        parser.add_argument('--repeat', type=int, default=3, help='计时重复次数')
+
+    def _texts(self, limit):
+        from knowledge_base.models import FaultKnowledge
+
+        queries = []
+        requests_path = os.path.join(settings.BASE_DIR, 'benchmarks', 'analyze_requests.jsonl')
+        if os.path.exists(requests_path):
+            queries = [r['alert_info'] for r in benchmark.load_requests(requests_path)]
+        documents = list(FaultKnowledge.objects.values_list('symptoms', flat=True)[:limit])
+        if not documents:
+            documents = [benchmark.synthetic_knowledge(i)['symptoms'] for i in range(limit)]
+        return queries or documents[:20], documents
+
+    def _time(self, encoder, queries, documents, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for query in queries:
+                encoder.encode([query])
+        single = (time.perf_counter() - start) / (repeat * len(queries))
+        start = time.perf_counter()
+        for _ in range(repeat):
+            encoder.encode(documents, batch_size=VectorDBService.encode_batch_size)
+        batch = (time.perf_counter() - start) / (repeat * len(documents))
+        return single, batch
+
+    def handle(self, *args, **options):
+        queries, documents = self._texts(options['limit'])
+        reference = create_encoder('torch', VectorDBService.model_name, num_threads=settings.EMBEDDING_NUM_THREADS)
+        candidate = create_encoder(
+            'onnx', VectorDBService.model_name,
+            model_dir=options['model_dir'],
+            quantized=not options['no_quantize'],
+            num_threads=settings.EMBEDDING_NUM_THREADS,
+            max_length=settings.EMBEDDING_MAX_LENGTH,
+        )
+
+        texts = queries + documents
+        expected = _normalize(reference.encode(texts))
+        actual = _normalize(candidate.encode(texts))
+        cosines = (expected * actual).sum(axis=1)
+        expected_scores = expected[:len(queries)] @ expected[len(queries):].T
+        actual_scores = actual[:len(queries)] @ actual[len(queries):].T
+        score_diff = float(np.abs(expected_scores - actual_scores).max())
+
+        self.stdout.write(f'{len(queries)} queries, {len(documents)} documents')
+        self.stdout.write(f'cosine(torch, onnx): min {cosines.min():.4f}, mean {cosines.mean():.4f}')
+        self.stdout.write(f'max |score diff|: {score_diff:.4f}')
+
+        # 先各编码一次预热，再计时
+        reference.encode(queries[:1])
+        candidate.encode(queries[:1])
+        timings = {
+            'torch': self._time(reference, queries, documents, options['repeat']),
+            'onnx': self._time(candidate, queries, documents, options['repeat']),
+        }
+        for name, (single, batch) in timings.items():
+            self.stdout.write(f'{name:<6} single {single * 1000:8.2f} ms/text   batch {batch * 1000:8.2f} ms/text')
+        self.stdout.write(
+            f"speedup: single {timings['torch'][0] / timings['onnx'][0]:.2f}x, "
+            f"batch {timings['torch'][1] / timings['onnx'][1]:.2f}x"
+        )
+
+        if cosines.min() < options['min_cosine'] or score_diff > options['max_score_diff']:
+            raise CommandError('ONNX encoder output is outside the parity tolerance')
+        self.stdout.write(self.style.SUCCESS('ONNX encoder output is within tolerance'))
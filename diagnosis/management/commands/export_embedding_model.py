@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from diagnosis.embedding import export_onnx_model
+from diagnosis.services import VectorDBService
+
+
+class Command(BaseCommand):
+    help = '将句向量模型导出为 ONNX（默认同时生成 int8 动态量化版本），供 EMBEDDING_BACKEND=onnx 使用'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default=settings.EMBEDDING_ONNX_DIR, help='导出目录')
+        parser.add_argument('--max-length', type=int, default=settings.EMBEDDING_MAX_LENGTH, help='最大序列长度')
+        parser.add_argument('--no-quantize', action='store_true', help='只导出 float32 模型')
+
+    def handle(self, *args, **options):
+        written = export_onnx_model(
+            VectorDBService.model_name,
+            options['output_dir'],
+            max_length=options['max_length'],
+            quantize=not options['no_quantize'],
+        )
+        for path in written:
+            self.stdout.write(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {VectorDBService.model_name} to {options['output_dir']}; "
+            f"run check_embedding_parity before switching EMBEDDING_BACKEND to onnx"
+        ))
@@ -0,0 +1,54 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from diagnosis.services import VectorDBService
+from diagnosis.vector_sidecar import VectorSidecarServer
+
+
+class Command(BaseCommand):
+    help = ('启动向量服务边车：在本进程中加载句向量模型并打开向量库，通过 Unix 域套接字为各 worker 提供编码、检索与写入'
+            '（worker 端设置 VECTOR_SIDECAR_SOCKET 为同一路径）')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            default=settings.VECTOR_SIDECAR_SOCKET,
+            help='Unix 域套接字路径，默认取 VECTOR_SIDECAR_SOCKET'
+        )
+        parser.add_argument(
+            '--no-warmup',
+            action='store_true',
+            help='不预加载模型，首个请求到达时再加载'
+        )
+
+    def handle(self, *args, **options):
+        path = options['socket']
+        if not path:
+            raise CommandError('Set --socket or VECTOR_SIDECAR_SOCKET')
+
+        # 边车本身必须使用本地服务，不能再连接到自己
+        service = VectorDBService()
+        if not options['no_warmup']:
+            timings = service.warm_up()
+            self.stdout.write('预热完成：' + ', '.join(f'{stage}={seconds:.3f}s' for stage, seconds in timings.items()))
+
+        try:
+            server = VectorSidecarServer(path, service)
+        except (OSError, RuntimeError) as e:
+            raise CommandError(str(e))
+
+        def stop(signum, frame):
+            # shutdown() 会等待 serve_forever 退出，不能在运行 serve_forever 的线程中直接调用
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(self.style.SUCCESS(f'Vector sidecar listening on {path}'))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        self.stdout.write('Vector sidecar stopped')
@@ -0,0 +1,32 @@
+import importlib
+import time
+from django.core.management.base import BaseCommand
+from diagnosis import services
+
+
+class Command(BaseCommand):
+    help = '报告向量库服务各启动阶段（依赖导入、模型加载、Chroma 初始化、预热编码）的耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skip-llm',
+            action='store_true',
+            help='不统计 dashscope 的导入耗时'
+        )
+
+    def handle(self, *args, **options):
+        timings = {}
+        if not options['skip_llm']:
+            start = time.perf_counter()
+            importlib.import_module('dashscope')
+            timings['import_dashscope'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        timings.update(services.get_vector_db().warm_up())
+        total = time.perf_counter() - start + timings.get('import_dashscope', 0.0)
+
+        width = max(len(stage) for stage in timings)
+        for stage, seconds in timings.items():
+            share = seconds / total * 100 if total else 0.0
+            self.stdout.write(f'{stage:<{width}}  {seconds:8.3f}s  {share:5.1f}%')
+        self.stdout.write(self.style.SUCCESS(f'{"total":<{width}}  {total:8.3f}s'))
@@ -1,38 +1,87 @@
 from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
 from diagnosis.models import FaultKnowledge
-from diagnosis.services import VectorDBService
+from diagnosis.services import get_vector_db, knowledge_to_dict
 import logging
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = '将知识库数据同步到向量数据库'
+    help = '将知识库数据增量同步到向量数据库（批量编码、批量 upsert，并清理已删除条目）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='忽略水位线，重新索引全部知识条目'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=256,
+            help='每批读取、编码并写入的条目数（默认 256）'
+        )
 
     def handle(self, *args, **options):
-        vector_db = VectorDBService()
-        
-        # 获取所有知识库条目
-        knowledge_entries = FaultKnowledge.objects.all()
-        self.stdout.write(f'找到 {knowledge_entries.count()} 条知识库条目')
-        
-        # 同步到向量数据库
-        for knowledge in knowledge_entries:
+        batch_size = max(1, options['batch_size'])
+        vector_db = get_vector_db()
+
+        # 读取水位线，只同步 updated_at 不早于水位线的条目
+        watermark = None if options['full'] else parse_datetime(vector_db.get_sync_watermark() or '')
+        knowledge_entries = FaultKnowledge.objects.select_related('category').order_by('updated_at', 'id')
+        if watermark:
+            # 使用 >= 以免漏掉与水位线同一时刻更新的条目，upsert 保证重复写入无副作用
+            knowledge_entries = knowledge_entries.filter(updated_at__gte=watermark)
+            self.stdout.write(f'增量同步，水位线: {watermark.isoformat()}')
+        else:
+            self.stdout.write('全量同步')
+
+        total = knowledge_entries.count()
+        self.stdout.write(f'找到 {total} 条待同步的知识库条目')
+
+        synced = 0
+        failed = 0
+        new_watermark = watermark
+        batch = []
+
+        def flush(batch):
+            nonlocal synced, failed, new_watermark
             try:
-                # 准备数据
-                knowledge_data = {
-                    'id': knowledge.id,
-                    'category': knowledge.category.name,
-                    'title': knowledge.title,
-                    'symptoms': knowledge.symptoms,
-                    'solution': knowledge.solution
-                }
-                
-                # 添加到向量数据库
-                if vector_db.add_knowledge(knowledge_data):
-                    self.stdout.write(self.style.SUCCESS(f'成功同步知识条目: {knowledge.title}'))
-                else:
-                    self.stdout.write(self.style.ERROR(f'同步知识条目失败: {knowledge.title}'))
+                synced += vector_db.upsert_knowledge_batch([knowledge_to_dict(k) for k in batch])
+                if failed == 0:
+                    new_watermark = batch[-1].updated_at
+                self.stdout.write(f'已同步 {synced}/{total}')
             except Exception as e:
-                self.stdout.write(self.style.ERROR(f'处理知识条目时出错: {knowledge.title}, 错误: {str(e)}'))
-        
-        self.stdout.write(self.style.SUCCESS('同步完成')) 
\ No newline at end of file
+                failed += len(batch)
+                self.stdout.write(self.style.ERROR(
+                    f'同步批次失败（ID {batch[0].id} - {batch[-1].id}），错误: {str(e)}'
+                ))
+
+        # 分块读取，避免一次性加载整表；select_related 消除逐条查询分类
+        for knowledge in knowledge_entries.iterator(chunk_size=batch_size):
+            batch.append(knowledge)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+        # 清理数据库中已删除的条目
+        stale_ids = vector_db.get_indexed_ids() - set(FaultKnowledge.objects.values_list('id', flat=True))
+        stale_ids = sorted(stale_ids)
+        for start in range(0, len(stale_ids), batch_size):
+            try:
+                vector_db.delete_knowledge_batch(stale_ids[start:start + batch_size])
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'删除失效条目失败，错误: {str(e)}'))
+        if stale_ids:
+            self.stdout.write(f'已删除 {len(stale_ids)} 条失效向量')
+
+        # 只有全部批次成功时才推进水位线到最后同步的 updated_at
+        if new_watermark and new_watermark != watermark:
+            vector_db.set_sync_watermark(new_watermark.isoformat())
+
+        if failed:
+            self.stdout.write(self.style.ERROR(f'同步完成，成功 {synced} 条，失败 {failed} 条'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'同步完成，共同步 {synced} 条'))
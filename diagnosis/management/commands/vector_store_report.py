@@ -0,0 +1,120 @@
+import json
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from diagnosis.vector_store import NumpyVectorStore
+
+# 对比的存储配置：(精度, 重新打分倍数)
+CONFIGURATIONS = [('float32', 0), ('float16', 0), ('float16', 4), ('int8', 0), ('int8', 4)]
+
+
+class Command(BaseCommand):
+    help = '对比 numpy 向量存储在 float32/float16/int8（及全精度重新打分）下的内存占用、检索耗时与 recall@k'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            choices=['knowledge', 'synthetic'],
+            default='knowledge',
+            help='knowledge：编码知识库中的全部条目；synthetic：生成聚簇分布的随机向量'
+        )
+        parser.add_argument('--size', type=int, default=10000, help='synthetic 模式下的向量数')
+        parser.add_argument('--dim', type=int, default=384, help='synthetic 模式下的向量维度')
+        parser.add_argument('--queries', type=int, default=200, help='查询数（对已有向量加噪声得到）')
+        parser.add_argument('--top-k', default='3,10', help='计算 recall@k 的 k 值，逗号分隔')
+        parser.add_argument('--rescore-factor', type=int, default=4, help='重新打分配置使用的候选倍数')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='', help='同时将结果写入该 JSON 文件')
+
+    def _knowledge_vectors(self) -> np.ndarray:
+        from knowledge_base.models import FaultKnowledge
+        from diagnosis.services import VectorDBService
+
+        symptoms = list(FaultKnowledge.objects.order_by('id').values_list('symptoms', flat=True))
+        if not symptoms:
+            raise CommandError('Knowledge base is empty, use --source synthetic')
+        # 需要直接调用编码器，配置了边车时也在本进程内加载模型
+        service = VectorDBService()
+        self.stderr.write(f'Encoding {len(symptoms)} knowledge entries (dim={service.dim})...')
+        vectors = []
+        for start in range(0, len(symptoms), 1024):
+            vectors.extend(service._generate_vectors(symptoms[start:start + 1024]))
+        return np.asarray(vectors, dtype=np.float32)
+
+    @staticmethod
+    def _synthetic_vectors(rng, size: int, dim: int) -> np.ndarray:
+        """围绕若干中心生成向量，近似真实句向量的聚簇分布"""
+        centers = rng.standard_normal((max(1, size // 100), dim)).astype(np.float32)
+        assignments = rng.integers(0, len(centers), size)
+        return centers[assignments] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        ks = sorted({int(k) for k in options['top_k'].split(',') if k.strip()})
+        if options['source'] == 'knowledge':
+            vectors = self._knowledge_vectors()
+        else:
+            vectors = self._synthetic_vectors(rng, options['size'], options['dim'])
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        # 查询为加了噪声的已有向量，精确结果由全精度暴力检索得到
+        picks = rng.integers(0, len(vectors), options['queries'])
+        queries = vectors[picks] + 0.05 * rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        max_k = min(max(ks), len(vectors))
+        exact_scores = vectors @ queries.T
+        exact = np.argsort(-exact_scores, axis=0)[:max_k].T
+
+        ids = [str(i) for i in range(len(vectors))]
+        results = []
+        for dtype, factor in CONFIGURATIONS:
+            factor = options['rescore_factor'] if factor else 0
+            if dtype == 'float32' and factor:
+                continue
+            path = tempfile.mkdtemp(prefix=f'vector-store-{dtype}-')
+            try:
+                store = NumpyVectorStore(path, dtype=dtype, rescore_factor=factor)
+                for start in range(0, len(vectors), 10000):
+                    store.upsert(ids=ids[start:start + 10000], embeddings=vectors[start:start + 10000])
+
+                latencies = []
+                recall = {k: 0.0 for k in ks}
+                for query, expected in zip(queries, exact):
+                    start = time.perf_counter()
+                    found = store.query(query_embeddings=[query], n_results=max_k)['ids'][0]
+                    latencies.append(time.perf_counter() - start)
+                    for k in ks:
+                        k_eff = min(k, max_k)
+                        recall[k] += len({int(i) for i in found[:k_eff]} & set(expected[:k_eff].tolist())) / k_eff
+                usage = store.memory_usage()
+                results.append({
+                    'dtype': dtype,
+                    'rescore_factor': factor,
+                    **usage,
+                    'query_p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+                    'query_p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3),
+                    **{f'recall@{k}': round(recall[k] / len(queries), 4) for k in ks},
+                })
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+
+        self.stdout.write(f'{len(vectors)} vectors, dim={vectors.shape[1]}, {len(queries)} queries')
+        header = f'{"dtype":<8} {"rescore":>7} {"index MiB":>10} {"rescore MiB":>12} {"disk MiB":>9} ' \
+                 f'{"p50 ms":>8} {"p99 ms":>8} ' + ' '.join(f'{"recall@" + str(k):>10}' for k in ks)
+        self.stdout.write(header)
+        for row in results:
+            self.stdout.write(
+                f'{row["dtype"]:<8} {row["rescore_factor"]:>7} {row["index_bytes"] / 2 ** 20:>10.2f} '
+                f'{row["rescore_bytes"] / 2 ** 20:>12.2f} {row["disk_bytes"] / 2 ** 20:>9.2f} '
+                f'{row["query_p50_ms"]:>8.3f} {row["query_p99_ms"]:>8.3f} '
+                + ' '.join(f'{row[f"recall@{k}"]:>10.4f}' for k in ks)
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({'entries': len(vectors), 'dim': int(vectors.shape[1]), 'queries': len(queries),
+                           'results': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
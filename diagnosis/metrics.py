@@ -0,0 +1,236 @@
+import bisect
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+# 默认直方图桶（秒），覆盖从亚毫秒级的缓存查询到数十秒的大模型调用
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def expose(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def expose(self) -> List[str]:
+        lines = super().expose()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}  # key -> [各桶计数, sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels) -> Optional[Dict]:
+        """返回某个标签组合的桶计数、总和与次数"""
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            if series is None:
+                return None
+            return {'buckets': list(zip(self.buckets, series[0])), 'sum': series[1], 'count': series[2]}
+
+    def series(self) -> Dict[Tuple[str, ...], Dict]:
+        with self._lock:
+            keys = list(self._series)
+        return {key: self.snapshot(**dict(zip(self.labelnames, key))) for key in keys}
+
+    def expose(self) -> List[str]:
+        lines = super().expose()
+        with self._lock:
+            items = sorted((key, ([*series[0]], series[1], series[2])) for key, series in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {repr(float(total))}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class CallbackGauge(Metric):
+    """导出时才调用回调取值的仪表盘指标，用于队列深度等瞬时状态"""
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def expose(self) -> List[str]:
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        return super().expose() + [f'{self.name} {_format_value(value)}']
+
+
+class Registry:
+    """进程内指标注册表，按 Prometheus 文本格式导出"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, callback) -> CallbackGauge:
+        return self.register(CallbackGauge(name, documentation, callback))
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'diagnosis_stage_seconds', 'Latency of each diagnosis and vector DB stage in seconds', ['stage']
+)
+CACHE_HITS = registry.counter('diagnosis_cache_hits_total', 'Cache hits by cache', ['cache'])
+CACHE_MISSES = registry.counter('diagnosis_cache_misses_total', 'Cache misses by cache', ['cache'])
+LLM_TOKENS = registry.counter('diagnosis_llm_tokens_total', 'LLM tokens by direction', ['route', 'direction'])
+LLM_REQUESTS = registry.counter('diagnosis_llm_requests_total', 'LLM calls by route and outcome',
+                                ['route', 'outcome'])
+ERRORS = registry.counter('diagnosis_errors_total', 'Errors by stage', ['stage'])
+
+
+# 基准测试等场景下收集原始耗时样本（直方图只保留分桶计数，无法给出精确分位数）
+_sample_sinks: List[Dict[str, List[float]]] = []
+_sample_lock = threading.Lock()
+
+
+@contextmanager
+def collect_samples():
+    """在上下文内收集各阶段的原始耗时样本，返回 {stage: [秒, ...]}"""
+    samples: Dict[str, List[float]] = {}
+    with _sample_lock:
+        _sample_sinks.append(samples)
+    try:
+        yield samples
+    finally:
+        with _sample_lock:
+            _sample_sinks.remove(samples)
+
+
+def observe_stage(stage: str, elapsed: float) -> None:
+    """记录一个阶段的耗时（用于无法用一个 with 块包住的阶段，例如分段累计的流式调用）"""
+    STAGE_SECONDS.observe(elapsed, stage=stage)
+    if _sample_sinks:
+        with _sample_lock:
+            for sink in _sample_sinks:
+                sink.setdefault(stage, []).append(elapsed)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """记录一个阶段的耗时；阶段内抛出异常时同时计入错误数"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def timed(stage: str):
+    """stage_timer 的装饰器形式"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def should_log_payload() -> bool:
+    """完整提示词/响应按 DIAGNOSIS_PAYLOAD_LOG_SAMPLE_RATE 采样记录，避免热路径上的大量日志 I/O"""
+    rate = settings.DIAGNOSIS_PAYLOAD_LOG_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
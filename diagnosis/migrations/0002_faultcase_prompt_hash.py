@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faultcase',
+            name='prompt_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
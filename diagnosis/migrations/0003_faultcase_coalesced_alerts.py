@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0002_faultcase_prompt_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faultcase',
+            name='coalesced_alerts',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0003_faultcase_coalesced_alerts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faultcase',
+            name='raw_log_info',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0004_faultcase_raw_log_info'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faultcase',
+            name='prompt_tokens',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
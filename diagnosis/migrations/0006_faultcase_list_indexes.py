@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0005_faultcase_prompt_tokens'),
+        ('knowledge_base', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='faultcase',
+            index=models.Index(fields=['created_at', 'id'], name='faultcase_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='faultcase',
+            index=models.Index(fields=['category', 'created_at'], name='faultcase_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='faultcase',
+            index=models.Index(fields=['matched_knowledge', 'created_at'], name='faultcase_knowledge_idx'),
+        ),
+    ]
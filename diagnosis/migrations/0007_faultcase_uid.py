@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0006_faultcase_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faultcase',
+            name='uid',
+            field=models.CharField(editable=False, max_length=26, null=True),
+        ),
+    ]
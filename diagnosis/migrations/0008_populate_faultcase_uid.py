@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from diagnosis.ulid import new_ulid
+
+
+def populate_uid(apps, schema_editor):
+    """为已有的诊断记录分配 ULID"""
+    FaultCase = apps.get_model('diagnosis', 'FaultCase')
+    ids = list(FaultCase.objects.filter(uid__isnull=True).order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ids), 1000):
+        FaultCase.objects.bulk_update(
+            [FaultCase(id=case_id, uid=new_ulid()) for case_id in ids[start:start + 1000]], ['uid']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0007_faultcase_uid'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_uid, migrations.RunPython.noop),
+    ]
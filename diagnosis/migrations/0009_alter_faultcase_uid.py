@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:40
+
+import diagnosis.ulid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0008_populate_faultcase_uid'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='faultcase',
+            name='uid',
+            field=models.CharField(default=diagnosis.ulid.new_ulid, editable=False, max_length=26, unique=True),
+        ),
+    ]
@@ -1,14 +1,25 @@
 from django.db import models
 from knowledge_base.models import FaultCategory, FaultKnowledge
+from .ulid import new_ulid
 
 class FaultCase(models.Model):
+    # 写入数据库前即可分配的 ULID，后台批量写入时作为响应中的记录标识
+    uid = models.CharField(max_length=26, unique=True, default=new_ulid, editable=False)
     alert_info = models.TextField()
     metrics_info = models.TextField()
     log_info = models.TextField()
+    # 日志压缩前的原始日志，仅在请求要求保留时保存
+    raw_log_info = models.TextField(blank=True, default='')
     category = models.ForeignKey(FaultCategory, on_delete=models.SET_NULL, null=True, blank=True)
     matched_knowledge = models.ForeignKey(FaultKnowledge, on_delete=models.SET_NULL, null=True, blank=True)
     analysis_result = models.TextField()
     solution = models.TextField()
+    # 提示词的 SHA-256，用于诊断缓存按提示词精确匹配近期结果
+    prompt_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # 提示词各部分的 token 数、截断的部分及丢弃的参考案例数
+    prompt_tokens = models.JSONField(default=dict, blank=True)
+    # 告警风暴中与本条诊断聚合在一起、复用本条诊断结果的其他告警
+    coalesced_alerts = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -17,3 +28,9 @@ class FaultCase(models.Model):
 
     class Meta:
         verbose_name_plural = "Fault Cases"
+        # 列表按 created_at 游标分页，可按分类或匹配的知识条目过滤
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='faultcase_created_idx'),
+            models.Index(fields=['category', 'created_at'], name='faultcase_category_idx'),
+            models.Index(fields=['matched_knowledge', 'created_at'], name='faultcase_knowledge_idx'),
+        ]
@@ -0,0 +1,10 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class FaultCaseCursorPagination(CursorPagination):
+    """按创建时间倒序的游标（keyset）分页，翻页耗时与表大小无关，也不执行 COUNT 查询"""
+    ordering = ('-created_at', '-id')
+    page_size = settings.FAULT_CASE_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.FAULT_CASE_MAX_PAGE_SIZE
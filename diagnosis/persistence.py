@@ -0,0 +1,235 @@
+import atexit
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .metrics import registry, stage_timer
+from .models import FaultCase
+
+logger = logging.getLogger(__name__)
+
+CASE_WRITES = registry.counter('fault_case_writes_total', 'Fault case rows written by mode and outcome',
+                               ['mode', 'outcome'])
+
+
+class CaseWriter:
+    """诊断记录的后台批量写入（write-behind）
+
+    请求线程只把 FaultCase 放入队列并立即返回（响应中的 uid 在入队前已分配），
+    后台线程在待写入条目达到 batch_size 或最早条目等待超过 flush_interval 秒时，
+    用一次 bulk_create 写入整批；批量写入失败时逐条重试，只丢弃自身写入失败的记录。
+    队列超过 max_queue 时退回同步写入，避免数据库长时间不可用时内存无限增长。
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 0.5, max_queue: int = 10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._pending: List[FaultCase] = []
+        self._pending_by_uid: Dict[str, FaultCase] = {}
+        self._enqueued_at: List[float] = []  # 与 _pending 一一对应的入队时间
+        self._inflight: Dict[str, Dict] = {}  # 正在写入的 uid -> 写入完成后需要补充更新的字段
+        self._oldest: Optional[float] = None
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self.written_total = 0
+        self.failed_total = 0
+        self.last_error: Optional[str] = None
+
+    def submit(self, cases: List[FaultCase]) -> None:
+        """将诊断记录加入写入队列"""
+        with self._cond:
+            if len(self._pending) + len(cases) > self.max_queue:
+                overflow = True
+            else:
+                overflow = False
+                now = time.time()
+                self._pending.extend(cases)
+                self._pending_by_uid.update((case.uid, case) for case in cases)
+                self._enqueued_at.extend([now] * len(cases))
+                self._oldest = self._oldest or now
+                self._ensure_worker()
+                self._cond.notify()
+        if overflow:
+            logger.warning(f"Case write queue full ({self.max_queue}), writing {len(cases)} cases synchronously")
+            FaultCase.objects.bulk_create(cases)
+            CASE_WRITES.inc(len(cases), mode='sync', outcome='success')
+
+    def update(self, uid: str, **fields) -> None:
+        """更新一条诊断记录：仍在队列中时直接修改待写入的对象，正在写入时等写入完成后再更新"""
+        with self._cond:
+            case = self._pending_by_uid.get(uid)
+            if case is not None:
+                for name, value in fields.items():
+                    setattr(case, name, value)
+                return
+            if uid in self._inflight:
+                self._inflight[uid].update(fields)
+                return
+        FaultCase.objects.filter(uid=uid).update(**fields)
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='fault-case-writer', daemon=True)
+            self._worker.start()
+
+    def _should_flush(self) -> bool:
+        if not self._pending:
+            return False
+        return len(self._pending) >= self.batch_size or time.time() - self._oldest >= self.flush_interval
+
+    def _take_batch(self) -> List[FaultCase]:
+        batch = self._pending[:self.batch_size]
+        del self._pending[:self.batch_size]
+        del self._enqueued_at[:self.batch_size]
+        for case in batch:
+            del self._pending_by_uid[case.uid]
+            self._inflight[case.uid] = {}
+        # 剩余条目按其中最早的入队时间计算等待时长，不因取走一批而重新计时
+        self._oldest = self._enqueued_at[0] if self._enqueued_at else None
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._should_flush():
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0.0, self.flush_interval - (time.time() - self._oldest))
+                    self._cond.wait(timeout=timeout)
+                batch = self._take_batch()
+            try:
+                self._write(batch)
+            finally:
+                close_old_connections()
+
+    def _write(self, batch: List[FaultCase]) -> None:
+        written = batch
+        with stage_timer('db_flush'):
+            try:
+                with transaction.atomic():
+                    FaultCase.objects.bulk_create(batch)
+            except Exception as e:
+                logger.error(f"Bulk write of {len(batch)} cases failed, retrying one by one: {str(e)}")
+                written = []
+                for case in batch:
+                    try:
+                        # 每条在各自的保存点中写入，一条失败不影响同一连接上的后续写入
+                        with transaction.atomic():
+                            case.save(force_insert=True)
+                        written.append(case)
+                    except Exception as case_error:
+                        self.last_error = str(case_error)
+                        logger.error(f"Failed to write case {case.uid}: {str(case_error)}")
+        self.written_total += len(written)
+        self.failed_total += len(batch) - len(written)
+        CASE_WRITES.inc(len(written), mode='write_behind', outcome='success')
+        if len(written) < len(batch):
+            CASE_WRITES.inc(len(batch) - len(written), mode='write_behind', outcome='error')
+
+        with self._cond:
+            deferred = {case.uid: self._inflight.pop(case.uid, {}) for case in batch}
+        for uid, fields in deferred.items():
+            if fields:
+                try:
+                    FaultCase.objects.filter(uid=uid).update(**fields)
+                except Exception as e:
+                    logger.error(f"Failed to update case {uid} after write: {str(e)}")
+
+    def flush(self) -> None:
+        """同步写入队列中剩余的全部记录（进程退出时调用）"""
+        while True:
+            with self._cond:
+                if not self._pending:
+                    return
+                batch = self._take_batch()
+            self._write(batch)
+
+    def status(self) -> Dict:
+        with self._cond:
+            return {
+                'queue_depth': len(self._pending) + len(self._inflight),
+                'lag_seconds': round(time.time() - self._oldest, 3) if self._oldest else 0.0,
+                'written_total': self.written_total,
+                'failed_total': self.failed_total,
+                'last_error': self.last_error,
+            }
+
+
+_writer: Optional[CaseWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_case_writer() -> CaseWriter:
+    """获取进程内共享的诊断记录写入队列"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = CaseWriter(
+                    batch_size=settings.FAULT_CASE_WRITE_BATCH_SIZE,
+                    flush_interval=settings.FAULT_CASE_WRITE_FLUSH_INTERVAL,
+                    max_queue=settings.FAULT_CASE_WRITE_MAX_QUEUE,
+                )
+                atexit.register(_writer.flush)
+    return _writer
+
+
+registry.gauge('fault_case_write_queue_depth', 'Fault cases waiting to be written',
+               lambda: _writer.status()['queue_depth'] if _writer is not None else 0)
+
+
+def save_cases(cases: List[FaultCase]) -> None:
+    """保存诊断记录：启用 FAULT_CASE_WRITE_BEHIND 时入队后台批量写入，否则单条 INSERT / 一次 bulk_create"""
+    if settings.FAULT_CASE_WRITE_BEHIND:
+        get_case_writer().submit(cases)
+        return
+    if len(cases) == 1:
+        cases[0].save(force_insert=True)
+    else:
+        FaultCase.objects.bulk_create(cases)
+    CASE_WRITES.inc(len(cases), mode='sync', outcome='success')
+
+
+def save_cases_with_fallback(cases: List[FaultCase]) -> Dict[str, str]:
+    """保存一批诊断记录，整批写入失败时逐条在各自的保存点中重试，返回写入失败的 uid -> 错误信息"""
+    try:
+        with transaction.atomic():
+            save_cases(cases)
+        return {}
+    except Exception as e:
+        logger.error(f"Saving {len(cases)} cases failed, retrying one by one: {str(e)}")
+    failed = {}
+    for case in cases:
+        try:
+            with transaction.atomic():
+                case.save(force_insert=True)
+            CASE_WRITES.inc(mode='sync', outcome='success')
+        except Exception as case_error:
+            logger.error(f"Failed to write case {case.uid}: {str(case_error)}")
+            CASE_WRITES.inc(mode='sync', outcome='error')
+            failed[case.uid] = str(case_error)
+    return failed
+
+
+def append_coalesced_alerts(uid: str, alerts: List[Dict]) -> bool:
+    """把聚合的告警追加到已入库诊断记录的 coalesced_alerts（行锁下读改写），记录不存在时返回 False"""
+    with transaction.atomic():
+        case = FaultCase.objects.select_for_update().filter(uid=uid).only('id', 'coalesced_alerts').first()
+        if case is None:
+            return False
+        case.coalesced_alerts = list(case.coalesced_alerts or []) + alerts
+        case.save(update_fields=['coalesced_alerts'])
+    return True
+
+
+def update_case(uid: str, **fields) -> None:
+    """按 uid 更新诊断记录，兼容记录仍在写入队列中的情况"""
+    if settings.FAULT_CASE_WRITE_BEHIND:
+        get_case_writer().update(uid, **fields)
+    else:
+        FaultCase.objects.filter(uid=uid).update(**fields)
@@ -0,0 +1,609 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .diagnosis_cache import get_diagnosis_cache
+from .log_reduction import reduce_log
+from .models import FaultCase
+from .persistence import CASE_WRITES, save_cases, save_cases_with_fallback
+from .prompt_builder import get_prompt_builder
+from .services import get_vector_db, normalize_categories
+from .streaming import IncrementalJSONFieldParser
+from .timeseries import summarize_metrics
+from .llm import LLMConfigurationError, LLMError, LLMResult, RouteOptions, get_llm_backend
+from .metrics import ERRORS, LLM_REQUESTS, LLM_TOKENS, observe_stage, should_log_payload, stage_timer, timed
+
+logger = logging.getLogger(__name__)
+
+# 只有相似度（百分比）高于该阈值的知识条目才会被记录为匹配并作为参考案例返回
+REFERENCE_SCORE_THRESHOLD = 5
+
+
+class DiagnosisError(Exception):
+    """诊断流程中的可预期错误，携带返回给客户端的错误信息与状态码"""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _diagnosis_error(error: LLMError) -> DiagnosisError:
+    if isinstance(error, LLMConfigurationError):
+        return DiagnosisError(error.message)
+    return DiagnosisError(f'API调用失败: {error.message}')
+
+
+def clean_json_string(json_str: Optional[str]) -> Optional[str]:
+    """清理JSON字符串，移除控制字符和多余空白"""
+    if not json_str:
+        return None
+
+    # 移除 Markdown 代码块标记
+    json_str = json_str.replace('```json', '').replace('```', '')
+
+    # 查找第一个 { 和最后一个 } 之间的内容
+    start = json_str.find('{')
+    end = json_str.rfind('}') + 1
+    if start >= 0 and end > start:
+        json_str = json_str[start:end]
+    else:
+        logger.error(f"Could not find JSON in response: {json_str}")
+        return None
+
+    # 移除所有控制字符
+    json_str = ''.join(char for char in json_str if ord(char) >= 32)
+
+    # 替换换行符为空格
+    json_str = json_str.replace('\n', ' ')
+
+    # 替换多个空格为单个空格
+    json_str = re.sub(r'\s+', ' ', json_str)
+
+    # 移除开头和结尾的空白字符
+    return json_str.strip()
+
+
+def hash_prompt(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+@timed('parse')
+def parse_diagnosis(content: str) -> Dict:
+    """清理并解析大模型返回的 JSON，校验必要字段"""
+    cleaned_content = clean_json_string(content)
+    if not cleaned_content:
+        logger.error("Cleaned content is empty")
+        raise DiagnosisError('API返回内容为空')
+
+    try:
+        result = json.loads(cleaned_content)
+        if should_log_payload():
+            logger.info("Parsed JSON result: %s", result)
+    except json.JSONDecodeError as e:
+        logger.error("JSON parsing error: %s", str(e))
+        logger.error("Failed content: %s", cleaned_content)
+        raise DiagnosisError(f'JSON解析错误: {str(e)}')
+
+    # 验证返回的JSON格式
+    required_fields = ['category', 'analysis', 'solution']
+    if not all(field in result for field in required_fields):
+        logger.error("Missing required fields in JSON response")
+        raise DiagnosisError('API返回的JSON格式不正确，缺少必要字段')
+    return result
+
+
+def build_reference_cases(matched_knowledge_list: List[Dict]) -> List[Dict]:
+    """将检索结果转换为返回给前端的参考案例，只保留相似度高于阈值的案例"""
+    return [
+        {
+            'id': knowledge['id'],
+            'title': knowledge['title'],
+            'category': knowledge['category'],
+            'symptoms': knowledge['symptoms'],
+            'solution': knowledge['solution'],
+            'similarity': f"{knowledge['score']:.2f}%"
+        }
+        for knowledge in matched_knowledge_list
+        if knowledge['score'] > REFERENCE_SCORE_THRESHOLD
+    ]
+
+
+def similarity_parts(alert_info: str, metrics_info: str, log_info: str) -> Tuple[str, str, str]:
+    """用于语义缓存比对的输入：告警、指标与归并后的日志分别编码，避免拼接后超出编码模型的长度上限被截断"""
+    return alert_info or '', metrics_info or '', log_info or ''
+
+
+def cache_scope(categories: Optional[List[str]], metrics_series, reference_cases: List[Dict]) -> str:
+    """语义缓存的复用范围：检索分类、原始指标序列与参考案例都相同时才允许按相似度复用"""
+    series = json.dumps(metrics_series, sort_keys=True, ensure_ascii=False, default=str) if metrics_series else ''
+    references = ','.join(sorted(str(case['id']) for case in reference_cases))
+    digest = hashlib.sha256('\0'.join((','.join(sorted(categories or [])), series, references)).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+@dataclass
+class DiagnosisContext:
+    """一次诊断在调用大模型之前准备好的数据"""
+    alert_info: str
+    metrics_info: str
+    log_info: str
+    matched_knowledge_list: List[Dict]
+    reference_cases: List[Dict]
+    prompt: str
+    prompt_hash: str
+    # 告警/指标/日志各部分的向量（空的部分为 None）及语义缓存的复用范围
+    query_vectors: Optional[List[Optional[List[float]]]] = None
+    cache_scope: str = ''
+    cached: Optional[Dict] = None
+    raw_log_info: str = ''
+    # 提示词各部分的 token 数及截断情况
+    prompt_tokens: Dict = field(default_factory=dict)
+
+
+def _record_llm_result(route: str, result: LLMResult) -> None:
+    LLM_REQUESTS.inc(route=route, outcome='success')
+    for direction in ('input_tokens', 'output_tokens'):
+        if result.usage.get(direction):
+            LLM_TOKENS.inc(result.usage[direction], route=route, direction=direction.split('_')[0])
+    if should_log_payload():
+        logger.info("API Response content: %s", result.content)
+
+
+_pipeline_lock = threading.Lock()
+
+
+class DiagnosisPipeline:
+    """故障诊断流程：检索知识 -> 构建提示词 -> 查询诊断缓存 -> 调用大模型 -> 保存诊断结果"""
+
+    def __init__(self, vector_db=None, diagnosis_cache=None, llm=None):
+        self.vector_db = vector_db or get_vector_db()
+        self.diagnosis_cache = diagnosis_cache or get_diagnosis_cache()
+        self.llm = llm or get_llm_backend()
+
+    def analyze_metrics(self, metrics_info: str, metrics_series=None) -> str:
+        """从结构化指标序列中提取异常特征，附加在指标信息之后；原始序列不进入提示词"""
+        if not metrics_series:
+            return metrics_info
+        with stage_timer('metrics_analyze'):
+            try:
+                findings = summarize_metrics(
+                    metrics_series,
+                    z_threshold=settings.METRICS_ANALYSIS_Z_THRESHOLD,
+                    mad_threshold=settings.METRICS_ANALYSIS_MAD_THRESHOLD,
+                    correlation_threshold=settings.METRICS_ANALYSIS_CORRELATION,
+                    max_points=settings.METRICS_SERIES_MAX_POINTS,
+                )
+            except ValueError as e:
+                raise DiagnosisError(f'指标序列格式不正确: {str(e)}', 400)
+        return f'{metrics_info}\n{findings}' if metrics_info else findings
+
+    def reduce_log(self, log_info: str, keep_raw_log: Optional[bool] = None) -> Tuple[str, str]:
+        """按模板压缩日志，返回 (压缩后的日志, 需要单独保存的原始日志)"""
+        if not settings.LOG_REDUCTION_ENABLED or not log_info:
+            return log_info, ''
+        with stage_timer('log_reduce'):
+            reduced = reduce_log(
+                log_info,
+                min_lines=settings.LOG_REDUCTION_MIN_LINES,
+                max_templates=settings.LOG_REDUCTION_MAX_TEMPLATES,
+                similarity=settings.LOG_REDUCTION_SIMILARITY,
+                max_clusters=settings.LOG_REDUCTION_MAX_CLUSTERS,
+            )
+        if keep_raw_log is None:
+            keep_raw_log = settings.LOG_REDUCTION_KEEP_RAW
+        if reduced == log_info or not keep_raw_log:
+            return reduced, ''
+        return reduced, log_info
+
+    def retrieve(self, alert_info: str, top_k: int = 3, categories: Optional[List[str]] = None) -> List[Dict]:
+        """从知识库中检索相关的知识条目，只使用告警信息进行检索，避免其他信息干扰；可限定分类"""
+        with stage_timer('retrieve'):
+            matched_knowledge_list = self.vector_db.search_knowledge(alert_info, top_k=top_k, categories=categories)
+        logger.info("Found %d matching knowledge entries", len(matched_knowledge_list))
+        return matched_knowledge_list
+
+    def call_llm(self, prompt: str, route: str = 'analyze') -> str:
+        """调用大模型，返回响应文本"""
+        try:
+            with stage_timer('llm'):
+                result = self.llm.generate(prompt, RouteOptions.for_route(route))
+        except LLMError as e:
+            LLM_REQUESTS.inc(route=route, outcome='error')
+            logger.error("API call failed: %s", e.message)
+            raise _diagnosis_error(e)
+        _record_llm_result(route, result)
+        return result.content
+
+    def stream_llm(self, prompt: str, route: str = 'analyze_stream') -> Iterator[str]:
+        """以增量输出方式调用大模型，逐段返回新生成的文本
+
+        llm_stream 阶段只累计等待上游产出的时间，不包含调用方（客户端）读取每段输出的时间；
+        输出完成后与非流式调用一样记录请求数、token 用量和响应内容。
+        """
+        options = RouteOptions.for_route(route)
+        usage: Dict[str, int] = {}
+        chunks = []
+        elapsed = 0.0
+        stream = self.llm.stream(prompt, options, usage)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    chunk = next(stream)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                chunks.append(chunk)
+                yield chunk
+        except LLMError as e:
+            ERRORS.inc(stage='llm_stream')
+            LLM_REQUESTS.inc(route=route, outcome='error')
+            logger.error("API call failed: %s", e.message)
+            raise _diagnosis_error(e)
+        finally:
+            stream.close()
+            observe_stage('llm_stream', elapsed)
+        _record_llm_result(route, LLMResult(content=''.join(chunks), model=options.model, usage=usage))
+
+    async def acall_llm(self, prompt: str, route: str = 'analyze') -> str:
+        """异步调用大模型，等待期间不阻塞事件循环"""
+        try:
+            with stage_timer('llm'):
+                result = await self.llm.agenerate(prompt, RouteOptions.for_route(route))
+        except LLMError as e:
+            LLM_REQUESTS.inc(route=route, outcome='error')
+            logger.error("API call failed: %s", e.message)
+            raise _diagnosis_error(e)
+        _record_llm_result(route, result)
+        return result.content
+
+    def embed_similarity_parts(self, inputs: List[Tuple[str, str, str]]) -> List[List[Optional[List[float]]]]:
+        """一次批量编码多条输入的各部分，空的部分不编码"""
+        texts = [part for parts in inputs for part in parts if part]
+        vectors = iter(self.vector_db.embed_queries(texts) if texts else [])
+        return [[next(vectors) if part else None for part in parts] for parts in inputs]
+
+    def lookup_cache(self, context: DiagnosisContext) -> Optional[Dict]:
+        """按提示词哈希、再在相同复用范围内按输入向量相似度查找近期的诊断结果"""
+        if not settings.DIAGNOSIS_CACHE_ENABLED:
+            return None
+        with stage_timer('cache_lookup'):
+            return (self.diagnosis_cache.lookup_exact(context.prompt_hash, context.reference_cases)
+                    or self.diagnosis_cache.lookup_similar(context.query_vectors, context.cache_scope))
+
+    def prepare(self, alert_info: str, metrics_info: str = '', log_info: str = '',
+                categories: Optional[List[str]] = None, keep_raw_log: Optional[bool] = None,
+                metrics_series=None) -> DiagnosisContext:
+        """检索知识、构建提示词并查询诊断缓存（包含向量计算与数据库查询，属于阻塞操作）"""
+        metrics_info = self.analyze_metrics(metrics_info, metrics_series)
+        log_info, raw_log_info = self.reduce_log(log_info, keep_raw_log)
+        matched_knowledge_list = self.retrieve(alert_info, categories=categories)
+
+        # 构建提示词
+        with stage_timer('prompt_build'):
+            built = get_prompt_builder().build(alert_info, metrics_info, log_info, matched_knowledge_list)
+            prompt = built.text
+            context = DiagnosisContext(
+                alert_info=alert_info,
+                metrics_info=metrics_info,
+                log_info=log_info,
+                matched_knowledge_list=matched_knowledge_list,
+                reference_cases=build_reference_cases(matched_knowledge_list),
+                prompt=prompt,
+                prompt_hash=hash_prompt(prompt),
+                raw_log_info=raw_log_info,
+                prompt_tokens=built.tokens,
+            )
+
+        # 完整的 prompt 按采样率记录
+        if should_log_payload():
+            logger.info("Final prompt for LLM:\n%s", prompt)
+
+        # 近期已诊断过相同或近似的告警时直接复用结果
+        if settings.DIAGNOSIS_CACHE_ENABLED:
+            with stage_timer('cache_embed'):
+                context.query_vectors = self.embed_similarity_parts(
+                    [similarity_parts(alert_info, metrics_info, log_info)]
+                )[0]
+            context.cache_scope = cache_scope(categories, metrics_series, context.reference_cases)
+            context.cached = self.lookup_cache(context)
+        return context
+
+    def _new_case(self, context: DiagnosisContext, result: Dict) -> FaultCase:
+        """构建诊断记录，所有字段（包括最匹配的知识条目）一次设置好，保存时只需一次 INSERT"""
+        return FaultCase(
+            alert_info=context.alert_info,
+            metrics_info=context.metrics_info,
+            log_info=context.log_info,
+            raw_log_info=context.raw_log_info,
+            analysis_result=json.dumps(result),
+            prompt_hash=context.prompt_hash,
+            prompt_tokens=context.prompt_tokens,
+            matched_knowledge_id=self._best_match_id(context),
+        )
+
+    def _best_match_id(self, context: DiagnosisContext) -> Optional[int]:
+        """返回最匹配且相似度高于阈值的知识条目 ID"""
+        if not context.matched_knowledge_list:
+            return None
+        best_match = context.matched_knowledge_list[0]
+        # 降低相似度阈值到 5%，因为我们现在使用百分比
+        if best_match['score'] > REFERENCE_SCORE_THRESHOLD:  # 相似度阈值
+            logger.info(f"Matched knowledge with score: {best_match['score']:.2f}%")
+            return best_match['id']
+        logger.info(f"No knowledge matched, best score: {best_match['score']:.2f}%")
+        return None
+
+    def save_case(self, context: DiagnosisContext, result: Dict) -> FaultCase:
+        """保存诊断结果（启用 FAULT_CASE_WRITE_BEHIND 时只入队，由后台批量写入）"""
+        with stage_timer('db_write'):
+            case = self._new_case(context, result)
+            save_cases([case])
+        return case
+
+    async def asave_case(self, context: DiagnosisContext, result: Dict) -> FaultCase:
+        """异步保存诊断结果：启用 FAULT_CASE_WRITE_BEHIND 时在线程中入队，否则直接使用 ORM 的异步保存"""
+        with stage_timer('db_write'):
+            case = self._new_case(context, result)
+            if settings.FAULT_CASE_WRITE_BEHIND:
+                await sync_to_async(save_cases)([case])
+            else:
+                await case.asave(force_insert=True)
+                CASE_WRITES.inc(mode='sync', outcome='success')
+        return case
+
+    def complete(self, context: DiagnosisContext, case: FaultCase, result: Dict) -> Dict:
+        """构建响应数据并写入诊断缓存"""
+        payload = {
+            # 后台批量写入时记录尚未入库，id 为 None，使用 uid 查询
+            'id': case.id,
+            'uid': case.uid,
+            'category': result['category'],
+            'analysis': result['analysis'],
+            'solution': result['solution'],
+            'matched_knowledge_id': case.matched_knowledge_id,
+            'reference_cases': context.reference_cases,  # 添加参考案例
+            'prompt_tokens': context.prompt_tokens,
+            'cached': False,
+            'cache_type': None,
+        }
+        if settings.DIAGNOSIS_CACHE_ENABLED:
+            self.diagnosis_cache.store(context.prompt_hash, context.query_vectors, payload, context.cache_scope)
+        return payload
+
+    def run(self, alert_info: str, metrics_info: str = '', log_info: str = '',
+            categories: Optional[List[str]] = None, keep_raw_log: Optional[bool] = None,
+            metrics_series=None) -> Dict:
+        """执行一次完整诊断，返回响应数据；可预期的失败抛出 DiagnosisError"""
+        context = self.prepare(alert_info, metrics_info, log_info, categories, keep_raw_log, metrics_series)
+        if context.cached is not None:
+            return context.cached
+
+        content = self.call_llm(context.prompt)
+        result = parse_diagnosis(content)
+        case = self.save_case(context, result)
+        return self.complete(context, case, result)
+
+    def run_batch(self, items: List[Dict]) -> List[Dict]:
+        """批量诊断
+
+        所有告警一次批量编码并执行一次多查询检索；相同提示词只调用一次大模型，
+        大模型调用按 DIAGNOSIS_BATCH_CONCURRENCY 并发执行；诊断记录使用 bulk_create 一次写入，
+        整批写入失败时逐条重试。
+        返回与输入顺序一致的结果列表，单条失败只影响该条。
+        """
+        results: List[Optional[Dict]] = [None] * len(items)
+        valid = []
+        item_categories: Dict[int, Optional[List[str]]] = {}
+        raw_logs: Dict[int, str] = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not item.get('alert_info'):
+                results[index] = {'index': index, 'error': '告警信息不能为空'}
+            else:
+                try:
+                    metrics_info = self.analyze_metrics(item.get('metrics_info', ''), item.get('metrics_series'))
+                except DiagnosisError as e:
+                    results[index] = {'index': index, 'error': e.message}
+                    continue
+                log_info, raw_logs[index] = self.reduce_log(item.get('log_info', ''), item.get('keep_raw_log'))
+                valid.append((index, item.get('alert_info', ''), metrics_info, log_info))
+                item_categories[index] = normalize_categories(item.get('categories'))
+        if not valid:
+            return results
+
+        # 一次批量编码 + 每组分类一次多查询检索
+        groups: Dict[Optional[Tuple[str, ...]], List[int]] = {}
+        for position, (index, _, _, _) in enumerate(valid):
+            key = tuple(item_categories[index]) if item_categories[index] else None
+            groups.setdefault(key, []).append(position)
+        matched_lists: List[List[Dict]] = [[] for _ in valid]
+        with stage_timer('retrieve'):
+            for key, positions in groups.items():
+                group_results = self.vector_db.search_knowledge_batch(
+                    [valid[position][1] for position in positions], categories=list(key) if key else None
+                )
+                for position, matched in zip(positions, group_results):
+                    matched_lists[position] = matched
+        query_vectors = [None] * len(valid)
+        if settings.DIAGNOSIS_CACHE_ENABLED:
+            with stage_timer('cache_embed'):
+                query_vectors = self.embed_similarity_parts([similarity_parts(a, m, l) for _, a, m, l in valid])
+
+        contexts: Dict[int, DiagnosisContext] = {}
+        pending: Dict[str, List[int]] = {}  # prompt_hash -> 待调用大模型的条目
+        for (index, alert_info, metrics_info, log_info), matched, part_vectors in zip(valid, matched_lists, query_vectors):
+            built = get_prompt_builder().build(alert_info, metrics_info, log_info, matched)
+            prompt = built.text
+            context = DiagnosisContext(
+                alert_info=alert_info,
+                metrics_info=metrics_info,
+                log_info=log_info,
+                matched_knowledge_list=matched,
+                reference_cases=build_reference_cases(matched),
+                prompt=prompt,
+                prompt_hash=hash_prompt(prompt),
+                query_vectors=part_vectors,
+                raw_log_info=raw_logs[index],
+                prompt_tokens=built.tokens,
+            )
+            if settings.DIAGNOSIS_CACHE_ENABLED:
+                context.cache_scope = cache_scope(item_categories[index], items[index].get('metrics_series'),
+                                                  context.reference_cases)
+            contexts[index] = context
+            if context.prompt_hash not in pending:
+                context.cached = self.lookup_cache(context)
+            if context.cached is not None:
+                results[index] = {'index': index, 'result': context.cached}
+            else:
+                pending.setdefault(context.prompt_hash, []).append(index)
+
+        # 有界并发调用大模型
+        diagnoses: Dict[str, Dict] = {}
+        errors: Dict[str, str] = {}
+        if pending:
+            workers = max(1, min(settings.DIAGNOSIS_BATCH_CONCURRENCY, len(pending)))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='diagnosis-batch-llm') as executor:
+                futures = {
+                    prompt_hash: executor.submit(self.call_llm, contexts[indexes[0]].prompt, 'analyze_batch')
+                    for prompt_hash, indexes in pending.items()
+                }
+                for prompt_hash, future in futures.items():
+                    try:
+                        diagnoses[prompt_hash] = parse_diagnosis(future.result())
+                    except DiagnosisError as e:
+                        errors[prompt_hash] = e.message
+                    except Exception as e:
+                        logger.error("Batch LLM call failed: %s", str(e))
+                        errors[prompt_hash] = f'服务器内部错误: {str(e)}'
+
+        # 一次写入全部诊断记录
+        cases = []
+        for prompt_hash, indexes in pending.items():
+            if prompt_hash in errors:
+                for index in indexes:
+                    results[index] = {'index': index, 'error': errors[prompt_hash]}
+                continue
+            for index in indexes:
+                cases.append((index, self._new_case(contexts[index], diagnoses[prompt_hash])))
+        failed: Dict[str, str] = {}
+        if cases:
+            with stage_timer('db_write'):
+                failed = save_cases_with_fallback([case for _, case in cases])
+        for index, case in cases:
+            if case.uid in failed:
+                results[index] = {'index': index, 'error': f'保存诊断记录失败: {failed[case.uid]}'}
+                continue
+            payload = self.complete(contexts[index], case, diagnoses[contexts[index].prompt_hash])
+            results[index] = {'index': index, 'result': payload}
+        return results
+
+    def run_stream(self, alert_info: str, metrics_info: str = '', log_info: str = '',
+                   categories: Optional[List[str]] = None, keep_raw_log: Optional[bool] = None,
+                   metrics_series=None) -> Iterator[Tuple[str, Dict]]:
+        """流式诊断，依次产出 (事件名, 数据)
+
+        - references: 检索完成后立即返回参考案例
+        - token: 大模型新生成的文本片段
+        - field: category / analysis / solution 的值一旦完整输出即推送
+        - done: 诊断结果已保存，携带 FaultCase ID 及完整结果
+        - error: 诊断失败
+        """
+        try:
+            context = self.prepare(alert_info, metrics_info, log_info, categories, keep_raw_log, metrics_series)
+            yield 'references', {'reference_cases': context.reference_cases}
+            if context.cached is not None:
+                yield 'done', context.cached
+                return
+
+            parser = IncrementalJSONFieldParser(['category', 'analysis', 'solution'])
+            chunks = []
+            for chunk in self.stream_llm(context.prompt):
+                chunks.append(chunk)
+                yield 'token', {'text': chunk}
+                for name, value in parser.feed(chunk).items():
+                    yield 'field', {'name': name, 'value': value}
+
+            result = parse_diagnosis(''.join(chunks))
+            case = self.save_case(context, result)
+            yield 'done', self.complete(context, case, result)
+        except DiagnosisError as e:
+            yield 'error', {'error': e.message}
+        except Exception as e:
+            logger.error("Unexpected error in streaming diagnosis: %s", str(e))
+            yield 'error', {'error': f'服务器内部错误: {str(e)}'}
+
+    async def arun(self, alert_info: str, metrics_info: str = '', log_info: str = '',
+                   categories: Optional[List[str]] = None, keep_raw_log: Optional[bool] = None,
+                   metrics_series=None) -> Dict:
+        """异步执行一次完整诊断
+
+        向量计算、Chroma 查询和缓存查询在有界线程池中执行，大模型调用使用异步接口，
+        诊断结果通过异步 ORM 写入，整个过程不阻塞事件循环。
+        """
+        loop = asyncio.get_running_loop()
+        context = await loop.run_in_executor(
+            get_executor(), with_db_cleanup(self.prepare), alert_info, metrics_info, log_info, categories,
+            keep_raw_log, metrics_series
+        )
+        if context.cached is not None:
+            return context.cached
+
+        content = await self.acall_llm(context.prompt)
+        result = parse_diagnosis(content)
+        case = await self.asave_case(context, result)
+        return self.complete(context, case, result)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """获取执行阻塞操作（向量计算、Chroma 查询）的有界线程池"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.DIAGNOSIS_EXECUTOR_WORKERS,
+                    thread_name_prefix='diagnosis-executor'
+                )
+    return _executor
+
+
+def with_db_cleanup(func):
+    """线程池中的任务结束后按 CONN_MAX_AGE 关闭过期的数据库连接"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+_pipeline: Optional[DiagnosisPipeline] = None
+
+
+def get_pipeline() -> DiagnosisPipeline:
+    """获取进程内共享的诊断流程实例"""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = DiagnosisPipeline()
+    return _pipeline
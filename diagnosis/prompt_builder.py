@@ -0,0 +1,248 @@
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TOKENS = registry.histogram(
+    'diagnosis_prompt_tokens', 'Prompt tokens per section after budgeting', ['section'],
+    buckets=(16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+)
+
+TRUNCATION_MARK = '…（已截断）'
+
+PROMPT_HEADER = """作为一个故障诊断专家，请分析以下故障信息，并提供诊断结果。
+请以JSON格式返回，包含以下字段：
+- category: 故障分类（请根据故障特征给出最合适的分类）
+- analysis: 分析结果
+- solution: 解决方案
+
+故障信息：
+"""
+REFERENCES_HEADER = "\n参考知识库中的相关案例：\n"
+PROMPT_FOOTER = "\n请基于以上信息，特别是参考知识库中的相关案例，给出准确的诊断结果。请确保返回的是合法的JSON格式。"
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+
+class TokenCounter:
+    """按字符估算 token 数：中日韩字符各计 1 个，其余字符约 4 个计 1 个"""
+
+    name = 'approximate'
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        cjk = len(_CJK_PATTERN.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """返回不超过 max_tokens 的最长前缀"""
+        if self.count(text) <= max_tokens:
+            return text
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+
+class QwenTokenCounter(TokenCounter):
+    """使用 dashscope 自带的通义千问分词器精确计数（依赖 tiktoken）"""
+
+    name = 'qwen'
+
+    def __init__(self, model: str):
+        from dashscope import get_tokenizer
+
+        self.tokenizer = get_tokenizer(model)
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text)) if text else 0
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.tokenizer.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.tokenizer.decode(tokens[:max(0, max_tokens)])
+
+
+_fallback_warned = set()  # 已提示过退回估算的模型，每个进程只提示一次
+
+
+def create_token_counter(model: str) -> TokenCounter:
+    """优先使用模型的分词器，不可用时（例如未安装 tiktoken）退回按字符估算并提示一次"""
+    try:
+        counter = QwenTokenCounter(model)
+        counter.count('warm up')
+        return counter
+    except Exception as e:
+        if model not in _fallback_warned:
+            _fallback_warned.add(model)
+            logger.warning(f"Tokenizer for {model} unavailable, using approximate token counts "
+                           f"(install tiktoken for exact counts): {str(e)}")
+        return TokenCounter()
+
+
+@dataclass
+class PromptBudget:
+    """各部分的 token 预算；reference 为每个参考案例的预算，total 为整个提示词的上限"""
+    alert: int = 1000
+    metrics: int = 1500
+    logs: int = 2500
+    reference: int = 600
+    total: int = 6000
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    tokens: Dict = field(default_factory=dict)
+
+
+class PromptBuilder:
+    """按 token 预算组装诊断提示词
+
+    告警、指标、日志和每个参考案例先各自截断到自身预算；总数仍超出 total 时，
+    按优先级从低到高继续处理：先丢弃相似度最低的参考案例，再截断日志，最后截断指标，告警信息不再压缩。
+    未超出预算时生成的提示词与逐段拼接的结果完全一致。
+    """
+
+    def __init__(self, counter: TokenCounter, budget: PromptBudget):
+        self.counter = counter
+        self.budget = budget
+
+    def _clip(self, text: str, max_tokens: int, by_line: bool = False) -> str:
+        if self.counter.count(text) <= max_tokens:
+            return text
+        mark_tokens = self.counter.count(TRUNCATION_MARK)
+        clipped = self.counter.truncate(text, max(0, max_tokens - mark_tokens))
+        # 日志按整行截断，避免留下半个模板
+        if by_line and '\n' in clipped:
+            clipped = clipped[:clipped.rindex('\n')]
+        return clipped + TRUNCATION_MARK
+
+    @staticmethod
+    def _render_reference(knowledge: Dict, symptoms: str, solution: str) -> str:
+        return f"""
+案例标题：{knowledge['title']}
+故障分类：{knowledge['category']}
+症状描述：{symptoms}
+解决方案：{solution}
+相似度：{knowledge['score']:.2f}
+---"""
+
+    def _reference(self, knowledge: Dict) -> Tuple[str, bool]:
+        """渲染一个参考案例，超出预算时先截断解决方案，再截断症状描述"""
+        symptoms, solution = knowledge['symptoms'], knowledge['solution']
+        text = self._render_reference(knowledge, symptoms, solution)
+        overflow = self.counter.count(text) - self.budget.reference
+        if overflow <= 0:
+            return text, False
+        solution_tokens = self.counter.count(solution)
+        solution = self._clip(solution, max(0, solution_tokens - overflow))
+        text = self._render_reference(knowledge, symptoms, solution)
+        overflow = self.counter.count(text) - self.budget.reference
+        if overflow > 0:
+            symptoms = self._clip(symptoms, max(0, self.counter.count(symptoms) - overflow))
+            text = self._render_reference(knowledge, symptoms, solution)
+        return text, True
+
+    def build(self, alert_info: str, metrics_info: str, log_info: str,
+              matched_knowledge_list: List[Dict]) -> BuiltPrompt:
+        count = self.counter.count
+        truncated = []
+
+        sections: Dict[str, str] = {}
+        for name, value, budget in (('alert', alert_info, self.budget.alert),
+                                    ('metrics', metrics_info, self.budget.metrics),
+                                    ('logs', log_info, self.budget.logs)):
+            clipped = self._clip(value, budget, by_line=name == 'logs') if value else value
+            if clipped != value:
+                truncated.append(name)
+            sections[name] = clipped
+
+        references = []
+        for index, knowledge in enumerate(matched_knowledge_list):
+            text, clipped = self._reference(knowledge)
+            if clipped:
+                truncated.append(f'reference:{index}')
+            references.append(text)
+
+        def render() -> str:
+            prompt = PROMPT_HEADER + f"告警信息：{sections['alert']}\n"
+            if sections['metrics']:
+                prompt += f"指标信息：{sections['metrics']}\n"
+            if sections['logs']:
+                prompt += f"日志信息：{sections['logs']}\n"
+            if references:
+                prompt += REFERENCES_HEADER + ''.join(references)
+            return prompt + PROMPT_FOOTER
+
+        prompt = render()
+        total = count(prompt)
+        dropped = 0
+        # 超出总预算：丢弃相似度最低的参考案例（检索结果按相似度降序）
+        while total > self.budget.total and references:
+            references.pop()
+            dropped += 1
+            prompt = render()
+            total = count(prompt)
+        # 再依次压缩日志和指标
+        for name in ('logs', 'metrics'):
+            if total <= self.budget.total or not sections[name]:
+                continue
+            keep = max(0, count(sections[name]) - (total - self.budget.total))
+            sections[name] = self._clip(sections[name], keep, by_line=name == 'logs') if keep else ''
+            if name not in truncated:
+                truncated.append(name)
+            prompt = render()
+            total = count(prompt)
+
+        breakdown = {
+            'alert': count(sections['alert']),
+            'metrics': count(sections['metrics']),
+            'logs': count(sections['logs']),
+            'references': [count(text) for text in references],
+        }
+        breakdown['instructions'] = total - sum(breakdown['references']) - sum(
+            breakdown[name] for name in ('alert', 'metrics', 'logs')
+        )
+        for name in ('alert', 'metrics', 'logs', 'instructions'):
+            PROMPT_TOKENS.observe(breakdown[name], section=name)
+        PROMPT_TOKENS.observe(sum(breakdown['references']), section='references')
+        PROMPT_TOKENS.observe(total, section='total')
+        return BuiltPrompt(prompt, {
+            'total': total,
+            'budget': self.budget.total,
+            'sections': breakdown,
+            'truncated': truncated,
+            'dropped_references': dropped,
+            'tokenizer': self.counter.name,
+        })
+
+
+_prompt_builder: Optional[PromptBuilder] = None
+_prompt_builder_lock = threading.Lock()
+
+
+def get_prompt_builder() -> PromptBuilder:
+    """获取进程内共享的提示词构建器（首次调用时加载分词器）"""
+    global _prompt_builder
+    if _prompt_builder is None:
+        with _prompt_builder_lock:
+            if _prompt_builder is None:
+                _prompt_builder = PromptBuilder(
+                    create_token_counter(settings.PROMPT_TOKENIZER_MODEL),
+                    PromptBudget(**settings.PROMPT_TOKEN_BUDGETS),
+                )
+    return _prompt_builder
@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryRouter:
+    """按知识分类的向量质心路由查询
+
+    质心为各分类下全部知识向量（归一化后）的均值，检索前先与查询向量比较，
+    只在最相近的 top_n 个分类内检索，知识库分类很多时检索范围不随总条目数线性增长。
+    索引变化或质心超过 refresh_interval 秒后在后台重建，重建期间继续使用旧质心。
+    """
+
+    def __init__(self, top_n: int = 3, refresh_interval: float = 300.0, page_size: int = 10000):
+        self.top_n = top_n
+        self.refresh_interval = refresh_interval
+        self.page_size = page_size
+        self._names: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._built_at = 0.0
+        self._stale = True
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def mark_stale(self) -> None:
+        self._stale = True
+
+    def build(self, collection) -> int:
+        """分页读取向量库中的全部向量，重新计算各分类质心，返回分类数"""
+        self._stale = False
+        sums: Dict[str, np.ndarray] = {}
+        offset = 0
+        while True:
+            page = collection.get(include=['embeddings', 'metadatas'], limit=self.page_size, offset=offset)
+            ids = page.get('ids') or []
+            if ids:
+                vectors = np.asarray(page['embeddings'], dtype=np.float32)
+                vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+                categories = [(metadata or {}).get('category') for metadata in page['metadatas']]
+                for category in set(categories):
+                    if category is None:
+                        continue
+                    rows = [i for i, c in enumerate(categories) if c == category]
+                    total = vectors[rows].sum(axis=0)
+                    sums[category] = sums[category] + total if category in sums else total
+            if len(ids) < self.page_size:
+                break
+            offset += self.page_size
+
+        names = sorted(sums)
+        centroids = np.stack([sums[name] for name in names]) if names else None
+        if centroids is not None:
+            centroids /= np.clip(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12, None)
+        with self._lock:
+            self._names, self._centroids = names, centroids
+            self._built_at = time.time()
+        logger.info(f"Built category centroids for {len(names)} categories")
+        return len(names)
+
+    def _rebuild_in_background(self, collection) -> None:
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def run():
+            try:
+                self.build(collection)
+            except Exception as e:
+                self._stale = True
+                logger.error(f"Failed to rebuild category centroids: {str(e)}")
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, name='category-router', daemon=True).start()
+
+    def route(self, query_vectors, collection) -> Optional[List[str]]:
+        """返回与查询最相近的分类；分类数不超过 top_n 时返回 None（无需过滤）
+
+        传入多个查询向量时返回各查询所选分类的并集。
+        """
+        if not self._built_at:
+            self.build(collection)
+        elif self._stale or time.time() - self._built_at > self.refresh_interval:
+            self._rebuild_in_background(collection)
+
+        with self._lock:
+            names, centroids = self._names, self._centroids
+        if centroids is None or len(names) <= self.top_n:
+            return None
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        scores = queries @ centroids.T
+        top = np.argpartition(-scores, self.top_n - 1, axis=1)[:, :self.top_n]
+        return sorted({names[i] for i in top.ravel()})
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'categories': len(self._names),
+                'top_n': self.top_n,
+                'built_at': self._built_at or None,
+                'stale': self._stale,
+            }
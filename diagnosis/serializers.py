@@ -8,6 +8,31 @@ class FaultCaseSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = FaultCase
-        fields = ['id', 'alert_info', 'metrics_info', 'log_info', 'category', 'category_details',
+        fields = ['id', 'uid', 'alert_info', 'metrics_info', 'log_info', 'raw_log_info', 'category', 'category_details',
                  'matched_knowledge', 'matched_knowledge_details', 'analysis_result', 'solution',
-                 'created_at', 'updated_at'] 
\ No newline at end of file
+                 'prompt_tokens', 'coalesced_alerts', 'created_at', 'updated_at']
+
+
+# 列表中默认不返回、可通过 include 参数按需返回的大字段
+HEAVY_FIELDS = ('alert_info', 'metrics_info', 'log_info', 'raw_log_info', 'analysis_result', 'solution',
+                'prompt_tokens', 'coalesced_alerts')
+
+
+class FaultCaseListSerializer(serializers.ModelSerializer):
+    """列表使用的精简表示，大字段只在 ?include=alert_info,log_info 等显式要求时返回"""
+
+    alert_preview = serializers.CharField(read_only=True)
+    category_name = serializers.CharField(source='category.name', read_only=True, default=None)
+    matched_knowledge_title = serializers.CharField(source='matched_knowledge.title', read_only=True, default=None)
+
+    class Meta:
+        model = FaultCase
+        fields = ['id', 'uid', 'alert_preview', 'category', 'category_name', 'matched_knowledge',
+                  'matched_knowledge_title', 'created_at', 'updated_at', *HEAVY_FIELDS]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        include = self.context.get('include', ())
+        for name in HEAVY_FIELDS:
+            if name not in include:
+                self.fields.pop(name)
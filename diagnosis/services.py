@@ -1,38 +1,168 @@
 import os
+import json
+import time
 import logging
-from typing import List, Dict, Optional
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Set, Iterable
 
-# 设置环境变量以禁用 tokenizers 并行处理
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
+from django.conf import settings
+
+from .batching import EmbeddingBatcher
+from .embedding import Encoder, create_encoder
+from .embedding_cache import EmbeddingCache
+from .metrics import stage_timer, timed
+from .routing import CategoryRouter
+from .vector_store import create_vector_store
+
+# 未显式配置时禁用 tokenizers 并行处理，避免分词线程与请求线程争用 CPU
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
 
 logger = logging.getLogger(__name__)
 
+# 各启动阶段耗时（秒），chromadb / sentence_transformers 等重量级依赖在首次使用时才导入
+startup_timings: Dict[str, float] = {}
+
+
+@contextmanager
+def _timed(stage: str):
+    """记录启动阶段耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[stage] = time.perf_counter() - start
+        logger.info(f"Startup stage {stage} took {startup_timings[stage]:.3f}s")
+
+
+def knowledge_to_dict(knowledge) -> Dict:
+    """将 FaultKnowledge 实例转换为向量库所需的数据格式（需预先 select_related('category')）"""
+    return {
+        'id': knowledge.id,
+        'category': knowledge.category.name,
+        'title': knowledge.title,
+        'symptoms': knowledge.symptoms,
+        'solution': knowledge.solution
+    }
+
+
+def normalize_categories(value) -> Optional[List[str]]:
+    """将请求中的分类（字符串、逗号分隔的字符串或列表）转换为分类名列表，未指定时返回 None"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    categories = sorted({str(category).strip() for category in value if str(category).strip()})
+    return categories or None
+
+
 class VectorDBService:
-    def __init__(self):
-        self.collection_name = "fault_knowledge"
-        self.dim = 768  # 向量维度
-        self.model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-        self._init_client()
-        self._init_collection()
+    # 批量编码时单次前向计算的文本数
+    encode_batch_size = 64
+    # 分页读取已索引 ID 时的页大小
+    id_page_size = 10000
+    model_name = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+    def __init__(self, persist_directory: Optional[str] = None, collection_name: str = 'fault_knowledge'):
+        self.collection_name = collection_name
+        self.persist_directory = persist_directory or os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), 'data', 'chroma'
+        )
+        self.sync_state_path = os.path.join(self.persist_directory, f'{self.collection_name}_sync_state.json')
+        # 模型与 Chroma 客户端均在首次访问时才加载
+        self._model = None
+        self._client = None
+        self._collection = None
+        self._batcher = None
+        self._init_lock = threading.RLock()
+        # 未指定分类时按分类质心路由检索范围
+        self.router = CategoryRouter(
+            top_n=settings.VECTOR_CATEGORY_ROUTING_TOP_N,
+            refresh_interval=settings.VECTOR_CATEGORY_ROUTING_REFRESH,
+            page_size=self.id_page_size,
+        )
+        # 查询向量缓存，重复的告警文本无需再次前向计算；不同推理后端的向量略有差异，分开缓存
+        self.embedding_cache = EmbeddingCache.from_settings(self.embedding_key)
+
+    @property
+    def embedding_key(self) -> str:
+        """标识模型与推理后端，用作查询向量缓存的命名空间"""
+        if settings.EMBEDDING_BACKEND == 'torch':
+            return self.model_name
+        quantized = '-int8' if settings.EMBEDDING_ONNX_QUANTIZED else ''
+        return f'{self.model_name}@{settings.EMBEDDING_BACKEND}{quantized}'
+
+    @property
+    def model(self) -> Encoder:
+        """首次访问时按 EMBEDDING_BACKEND 加载句向量编码器"""
+        if self._model is None:
+            with self._init_lock:
+                if self._model is None:
+                    with _timed('load_model'):
+                        self._model = create_encoder(
+                            settings.EMBEDDING_BACKEND,
+                            self.model_name,
+                            model_dir=settings.EMBEDDING_ONNX_DIR,
+                            quantized=settings.EMBEDDING_ONNX_QUANTIZED,
+                            num_threads=settings.EMBEDDING_NUM_THREADS,
+                            max_length=settings.EMBEDDING_MAX_LENGTH,
+                        )
+        return self._model
+
+    @property
+    def batcher(self) -> EmbeddingBatcher:
+        """合并并发单条编码请求的微批处理器"""
+        if self._batcher is None:
+            with self._init_lock:
+                if self._batcher is None:
+                    self._batcher = EmbeddingBatcher(
+                        lambda texts: self.model.encode(texts, batch_size=len(texts)),
+                        max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+                        max_wait=settings.EMBEDDING_BATCH_MAX_WAIT,
+                        timeout=settings.EMBEDDING_BATCH_TIMEOUT,
+                    )
+        return self._batcher
+
+    @property
+    def dim(self) -> int:
+        """向量维度，取自实际加载的模型"""
+        return self.model.dimension
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._init_lock:
+                if self._client is None:
+                    self._init_client()
+        return self._client
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            with self._init_lock:
+                if self._collection is None:
+                    self._init_collection()
+        return self._collection
 
     def _init_client(self):
         """初始化 Chroma 客户端"""
         try:
+            with _timed('import_chromadb'):
+                import chromadb
+                from chromadb.config import Settings
+
             # 设置持久化存储路径
-            persist_directory = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'chroma')
-            os.makedirs(persist_directory, exist_ok=True)
+            os.makedirs(self.persist_directory, exist_ok=True)
             
             # 初始化客户端
-            self.client = chromadb.PersistentClient(
-                path=persist_directory,
-                settings=Settings(
-                    anonymized_telemetry=False,
-                    allow_reset=True
+            with _timed('init_chroma_client'):
+                self._client = chromadb.PersistentClient(
+                    path=self.persist_directory,
+                    settings=Settings(
+                        anonymized_telemetry=False,
+                        allow_reset=True
+                    )
                 )
-            )
             logger.info("Successfully initialized Chroma client")
         except Exception as e:
             logger.error(f"Failed to initialize Chroma client: {str(e)}")
@@ -40,85 +170,220 @@ class VectorDBService:
 
     def _init_collection(self):
         """初始化或获取集合"""
+        backend = settings.VECTOR_STORE_BACKEND
+        if backend != 'chroma':
+            # 进程内向量存储，提供与 Chroma Collection 相同的 upsert/delete/get/query 接口
+            with _timed('init_collection'):
+                self._collection = create_vector_store(
+                    backend, self.persist_directory, self.collection_name,
+                    dtype=settings.VECTOR_STORE_DTYPE, rescore_factor=settings.VECTOR_STORE_RESCORE_FACTOR
+                )
+            logger.info(f"Successfully initialized {backend} vector store: {self.collection_name}")
+            return
         try:
             # 获取或创建集合
-            self.collection = self.client.get_or_create_collection(
-                name=self.collection_name,
-                metadata={"hnsw:space": "cosine"}  # 使用余弦相似度
-            )
+            with _timed('init_collection'):
+                self._collection = self.client.get_or_create_collection(
+                    name=self.collection_name,
+                    metadata={"hnsw:space": "cosine"}  # 使用余弦相似度
+                )
             logger.info(f"Successfully initialized collection: {self.collection_name}")
         except Exception as e:
             logger.error(f"Failed to initialize collection: {str(e)}")
             raise
 
+    def warm_up(self) -> Dict[str, float]:
+        """预加载模型、打开集合并执行一次空编码，返回各阶段耗时"""
+        self.model
+        self.collection
+        with _timed('warmup_encode'):
+            self._generate_vector('warm up')
+        if settings.VECTOR_CATEGORY_ROUTING:
+            with _timed('build_category_centroids'):
+                self.router.build(self.collection)
+        return dict(startup_timings)
+
+    @timed('vector_db.embed')
     def _generate_vector(self, text: str) -> List[float]:
-        """生成文本的向量表示"""
+        """生成文本的向量表示，优先从查询向量缓存中读取"""
         try:
-            return self.model.encode(text).tolist()
+            vector = self.embedding_cache.get(text)
+            if vector is None:
+                if settings.EMBEDDING_BATCHING_ENABLED:
+                    vector = self.batcher.encode(text)
+                else:
+                    vector = self.model.encode([text])[0]
+                self.embedding_cache.put(text, vector)
+            return vector.tolist()
         except Exception as e:
             logger.error(f"Failed to generate vector: {str(e)}")
             raise
 
+    def embed_query(self, text: str) -> List[float]:
+        """生成查询文本的向量（走查询向量缓存）"""
+        return self._generate_vector(text)
+
+    @timed('vector_db.embed_queries')
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量生成查询向量：缓存命中的直接复用，其余文本合并为一次 encode 调用"""
+        cached = [self.embedding_cache.get(text) for text in texts]
+        missing = sorted({text for text, vector in zip(texts, cached) if vector is None})
+        if missing:
+            encoded = dict(zip(missing, self._generate_vectors(missing)))
+            for text, vector in encoded.items():
+                self.embedding_cache.put(text, vector)
+        return [vector.tolist() if vector is not None else encoded[text] for text, vector in zip(texts, cached)]
+
+    @timed('vector_db.embed_batch')
+    def _generate_vectors(self, texts: List[str]) -> List[List[float]]:
+        """批量生成文本的向量表示，一次 encode 调用完成整批前向计算"""
+        if not texts:
+            return []
+        try:
+            return self.model.encode(texts, batch_size=self.encode_batch_size).tolist()
+        except Exception as e:
+            logger.error(f"Failed to generate vectors for {len(texts)} texts: {str(e)}")
+            raise
+
+    @staticmethod
+    def _build_metadata(knowledge_data: Dict) -> Dict:
+        """构建知识条目的元数据"""
+        return {
+            'knowledge_id': str(knowledge_data['id']),
+            'category': knowledge_data['category'],
+            'title': knowledge_data['title'],
+            'solution': knowledge_data['solution']
+        }
+
+    @timed('vector_db.add_knowledge')
     def add_knowledge(self, knowledge_data: Dict) -> bool:
-        """添加知识条目到向量数据库"""
+        """添加知识条目到向量数据库（已存在的 ID 会被覆盖）"""
         try:
             # 生成症状描述的向量
             symptoms_vector = self._generate_vector(knowledge_data['symptoms'])
             
             # 准备元数据
-            metadata = {
-                'knowledge_id': str(knowledge_data['id']),
-                'category': knowledge_data['category'],
-                'title': knowledge_data['title'],
-                'solution': knowledge_data['solution']
-            }
+            metadata = self._build_metadata(knowledge_data)
             
-            # 插入数据
-            self.collection.add(
+            # 写入数据，使用 upsert 避免重复 ID 导致失败
+            self.collection.upsert(
                 embeddings=[symptoms_vector],
                 documents=[knowledge_data['symptoms']],
                 metadatas=[metadata],
                 ids=[str(knowledge_data['id'])]
             )
             
+            self.router.mark_stale()
             logger.info(f"Successfully added knowledge: {knowledge_data['title']}")
             return True
         except Exception as e:
             logger.error(f"Failed to add knowledge: {str(e)}")
             return False
 
-    def search_knowledge(self, query: str, top_k: int = 3) -> List[Dict]:
-        """搜索相似的知识条目"""
+    @timed('vector_db.upsert_knowledge_batch')
+    def upsert_knowledge_batch(self, knowledge_list: List[Dict]) -> int:
+        """批量写入知识条目：一次批量编码 + 一次 upsert，返回写入的条目数"""
+        if not knowledge_list:
+            return 0
+        try:
+            vectors = self._generate_vectors([k['symptoms'] for k in knowledge_list])
+            self.collection.upsert(
+                embeddings=vectors,
+                documents=[k['symptoms'] for k in knowledge_list],
+                metadatas=[self._build_metadata(k) for k in knowledge_list],
+                ids=[str(k['id']) for k in knowledge_list]
+            )
+            self.router.mark_stale()
+            logger.info(f"Successfully upserted {len(knowledge_list)} knowledge entries")
+            return len(knowledge_list)
+        except Exception as e:
+            logger.error(f"Failed to upsert knowledge batch: {str(e)}")
+            raise
+
+    @timed('vector_db.delete_knowledge_batch')
+    def delete_knowledge_batch(self, knowledge_ids: Iterable[int]) -> int:
+        """批量删除知识条目，返回删除的条目数"""
+        ids = [str(knowledge_id) for knowledge_id in knowledge_ids]
+        if not ids:
+            return 0
+        try:
+            self.collection.delete(ids=ids)
+            self.router.mark_stale()
+            logger.info(f"Successfully deleted {len(ids)} knowledge entries")
+            return len(ids)
+        except Exception as e:
+            logger.error(f"Failed to delete knowledge batch: {str(e)}")
+            raise
+
+    @timed('vector_db.get_indexed_ids')
+    def get_indexed_ids(self) -> Set[int]:
+        """分页读取向量库中已索引的全部知识条目 ID"""
+        indexed_ids = set()
+        offset = 0
+        while True:
+            page = self.collection.get(include=[], limit=self.id_page_size, offset=offset)
+            ids = page.get('ids') or []
+            indexed_ids.update(int(knowledge_id) for knowledge_id in ids)
+            if len(ids) < self.id_page_size:
+                break
+            offset += self.id_page_size
+        return indexed_ids
+
+    def get_sync_watermark(self) -> Optional[str]:
+        """读取上次同步完成时的 updated_at 水位线（ISO 格式字符串）"""
+        try:
+            with open(self.sync_state_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('watermark')
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read sync watermark, falling back to full sync: {str(e)}")
+            return None
+
+    def set_sync_watermark(self, watermark: Optional[str]) -> None:
+        """保存同步水位线，先写临时文件再原子替换"""
+        os.makedirs(self.persist_directory, exist_ok=True)
+        tmp_path = f'{self.sync_state_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'watermark': watermark}, f)
+        os.replace(tmp_path, self.sync_state_path)
+
+    def _where(self, query_vectors: List[List[float]], categories: Optional[List[str]]) -> Optional[Dict]:
+        """构建在索引内部执行的分类过滤条件：优先使用指定的分类，其次按质心路由"""
+        if not categories and settings.VECTOR_CATEGORY_ROUTING:
+            try:
+                with stage_timer('vector_db.route'):
+                    categories = self.router.route(query_vectors, self.collection)
+            except Exception as e:
+                # 路由失败时退回全库检索
+                logger.error(f"Category routing failed, searching all categories: {str(e)}")
+        if not categories:
+            return None
+        if len(categories) == 1:
+            return {'category': categories[0]}
+        return {'category': {'$in': list(categories)}}
+
+    @timed('vector_db.search_knowledge')
+    def search_knowledge(self, query: str, top_k: int = 3, categories: Optional[List[str]] = None) -> List[Dict]:
+        """搜索相似的知识条目，可限定在指定分类内检索"""
         try:
             # 生成查询向量
             query_vector = self._generate_vector(query)
             
             # 执行向量搜索
-            results = self.collection.query(
-                query_embeddings=[query_vector],
-                n_results=top_k,
-                include=['metadatas', 'distances', 'documents']
-            )
+            with stage_timer('vector_db.query'):
+                results = self.collection.query(
+                    query_embeddings=[query_vector],
+                    n_results=top_k,
+                    where=self._where([query_vector], categories),
+                    include=['metadatas', 'distances', 'documents']
+                )
             
-            # 检查结果是否为空
-            if not results or not results.get('metadatas') or not results['metadatas'][0]:
+            matched_knowledge = self._format_results(results, 0)
+            if not matched_knowledge:
                 logger.info("No results found in vector search")
                 return []
             
-            # 处理搜索结果
-            matched_knowledge = []
-            for i, (metadata, distance) in enumerate(zip(results['metadatas'][0], results['distances'][0])):
-                # 将距离转换为相似度分数 (0-1之间，1表示最相似)
-                similarity_score = (1 - distance) * 100  # 转换为百分比
-                matched_knowledge.append({
-                    'id': int(metadata['knowledge_id']),
-                    'category': metadata['category'],
-                    'title': metadata['title'],
-                    'symptoms': results['documents'][0][i],
-                    'solution': metadata['solution'],
-                    'score': similarity_score
-                })
-            
             logger.info(f"Found {len(matched_knowledge)} matches with scores: {[k['score'] for k in matched_knowledge]}")
             return matched_knowledge
         except Exception as e:
@@ -127,16 +392,67 @@ class VectorDBService:
             logger.error(f"Query vector shape: {len(query_vector) if 'query_vector' in locals() else 'Not generated'}")
             return []
 
+    @timed('vector_db.search_knowledge_batch')
+    def search_knowledge_batch(self, queries: List[str], top_k: int = 3,
+                               categories: Optional[List[str]] = None) -> List[List[Dict]]:
+        """批量搜索：一次批量编码 + 一次多查询向量检索，按输入顺序返回每个查询的结果
+
+        按质心路由时使用各查询所选分类的并集。
+        """
+        if not queries:
+            return []
+        try:
+            query_vectors = self.embed_queries(queries)
+            with stage_timer('vector_db.query'):
+                results = self.collection.query(
+                    query_embeddings=query_vectors,
+                    n_results=top_k,
+                    where=self._where(query_vectors, categories),
+                    include=['metadatas', 'distances', 'documents']
+                )
+            matched = [self._format_results(results, i) for i in range(len(queries))]
+            logger.info(f"Batch search of {len(queries)} queries found {sum(len(m) for m in matched)} matches")
+            return matched
+        except Exception as e:
+            logger.error(f"Failed to search knowledge batch of {len(queries)} queries: {str(e)}")
+            return [[] for _ in queries]
+
+    @staticmethod
+    def _format_results(results: Dict, index: int) -> List[Dict]:
+        """将第 index 个查询的检索结果转换为知识条目列表"""
+        # 检查结果是否为空
+        if not results or not results.get('metadatas') or len(results['metadatas']) <= index:
+            return []
+
+        # 处理搜索结果
+        matched_knowledge = []
+        metadatas = results['metadatas'][index] or []
+        for i, (metadata, distance) in enumerate(zip(metadatas, results['distances'][index])):
+            # 将距离转换为相似度分数 (0-1之间，1表示最相似)
+            similarity_score = (1 - distance) * 100  # 转换为百分比
+            matched_knowledge.append({
+                'id': int(metadata['knowledge_id']),
+                'category': metadata['category'],
+                'title': metadata['title'],
+                'symptoms': results['documents'][index][i],
+                'solution': metadata['solution'],
+                'score': similarity_score
+            })
+        return matched_knowledge
+
+    @timed('vector_db.delete_knowledge')
     def delete_knowledge(self, knowledge_id: int) -> bool:
         """删除知识条目"""
         try:
             self.collection.delete(ids=[str(knowledge_id)])
+            self.router.mark_stale()
             logger.info(f"Successfully deleted knowledge with ID: {knowledge_id}")
             return True
         except Exception as e:
             logger.error(f"Failed to delete knowledge: {str(e)}")
             return False
 
+    @timed('vector_db.update_knowledge')
     def update_knowledge(self, knowledge_data: Dict) -> bool:
         """更新知识条目"""
         try:
@@ -148,4 +464,26 @@ class VectorDBService:
             return self.add_knowledge(knowledge_data)
         except Exception as e:
             logger.error(f"Failed to update knowledge: {str(e)}")
-            return False 
\ No newline at end of file
+            return False 
+
+
+_vector_db: Optional[VectorDBService] = None
+_vector_db_lock = threading.Lock()
+
+
+def get_vector_db() -> VectorDBService:
+    """获取进程内共享的 VectorDBService 实例（延迟创建）；配置了 VECTOR_SIDECAR_SOCKET 时返回边车客户端"""
+    global _vector_db
+    if _vector_db is None:
+        with _vector_db_lock:
+            if _vector_db is None:
+                if settings.VECTOR_SIDECAR_SOCKET:
+                    from .vector_sidecar import VectorSidecarClient
+                    _vector_db = VectorSidecarClient(
+                        settings.VECTOR_SIDECAR_SOCKET,
+                        timeout=settings.VECTOR_SIDECAR_TIMEOUT,
+                        pool_size=settings.VECTOR_SIDECAR_POOL_SIZE,
+                    )
+                else:
+                    _vector_db = VectorDBService()
+    return _vector_db
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from knowledge_base.models import FaultCategory, FaultKnowledge
+from .indexing import schedule_index
+
+
+@receiver(post_save, sender=FaultKnowledge, dispatch_uid='diagnosis_index_knowledge_save')
+def index_knowledge_on_save(sender, instance, **kwargs):
+    """知识条目保存后加入后台索引队列"""
+    schedule_index(instance.id)
+
+
+@receiver(post_delete, sender=FaultKnowledge, dispatch_uid='diagnosis_index_knowledge_delete')
+def index_knowledge_on_delete(sender, instance, **kwargs):
+    """知识条目删除后加入后台索引队列，刷新时会从向量库中移除"""
+    schedule_index(instance.id)
+
+
+@receiver(post_save, sender=FaultCategory, dispatch_uid='diagnosis_index_category_save')
+def index_category_on_save(sender, instance, created, **kwargs):
+    """分类名称会写入向量元数据，分类修改后重新索引其下的知识条目"""
+    if created:
+        return
+    for knowledge_id in instance.faults.values_list('id', flat=True):
+        schedule_index(knowledge_id)
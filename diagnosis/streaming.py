@@ -0,0 +1,40 @@
+import json
+import re
+from typing import Dict, Iterable
+
+# 匹配完整的 "字段": "字符串值"（值中允许转义字符）
+_STRING_FIELD_PATTERN = re.compile(r'"(?P<name>[A-Za-z_]+)"\s*:\s*"(?P<value>(?:[^"\\]|\\.)*)"', re.S)
+
+
+class IncrementalJSONFieldParser:
+    """从流式输出的 JSON 文本中增量提取字段
+
+    每次 feed 一段新文本，返回本次新出现的、值已完整输出的字符串字段，
+    无需等待整个 JSON 结束即可把 category 等字段推送给前端。
+    """
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = set(fields)
+        self.buffer = ''
+        self.emitted: Dict[str, str] = {}
+        self._scan_from = 0
+
+    def feed(self, chunk: str) -> Dict[str, str]:
+        self.buffer += chunk
+        found = {}
+        for match in _STRING_FIELD_PATTERN.finditer(self.buffer, self._scan_from):
+            name = match.group('name')
+            if name in self.fields and name not in self.emitted:
+                try:
+                    value = json.loads(f'"{match.group("value")}"')
+                except ValueError:
+                    value = match.group('value')
+                self.emitted[name] = value
+                found[name] = value
+            self._scan_from = match.end()
+        return found
+
+
+def sse_event(event: str, data: Dict) -> str:
+    """编码一条 Server-Sent Events 消息"""
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
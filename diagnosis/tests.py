@@ -1,3 +1,1001 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import requests
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from knowledge_base.models import FaultCategory, FaultKnowledge
+
+from .coalescing import AlertCoalescer, input_fingerprint
+from .apps import is_server_process
+from .batching import EmbeddingBatcher
+from .diagnosis_cache import DiagnosisCache
+from .embedding_cache import EmbeddingCache
+from .indexing import IndexingQueue
+from .log_reduction import WILDCARD, LogReducer, reduce_log
+from .llm import DashScopeBackend, LLMBackend, LLMError, LLMResult, RouteOptions, StubBackend
+from .persistence import CASE_WRITES, CaseWriter, save_cases_with_fallback
+from .routing import CategoryRouter
+from .prompt_builder import TRUNCATION_MARK, PromptBudget, PromptBuilder, TokenCounter, create_token_counter
+from .timeseries import analyze_series, parse_series, summarize_metrics
+from .vector_sidecar import OPS, read_frame, write_frame
+from .metrics import LLM_TOKENS, collect_samples
+from .models import FaultCase
+from .pipeline import DiagnosisContext, DiagnosisPipeline
+from .vector_store import NumpyVectorStore
+
+
+class _Crash(BaseException):
+    """模拟写入过程中进程退出（不是 Exception，不会触发写入失败时的恢复）"""
+
+
+def _vectors(count, dim=8, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class NumpyVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, ignore_errors=True)
+
+    def assertStoreMatches(self, store, expected):
+        result = store.get(include=('embeddings',))
+        self.assertEqual(sorted(result['ids']), sorted(expected))
+        for record_id, embedding in zip(result['ids'], result['embeddings']):
+            np.testing.assert_allclose(embedding, expected[record_id], atol=1e-6)
+
+    def test_upsert_query_and_delete(self):
+        store = NumpyVectorStore(self.path)
+        vectors = _vectors(3)
+        store.upsert(['a', 'b', 'c'], vectors, documents=['A', 'B', 'C'],
+                     metadatas=[{'category': 'x'}, {'category': 'y'}, {'category': 'x'}])
+        result = store.query(vectors[1:2], n_results=1)
+        self.assertEqual(result['ids'], [['b']])
+        result = store.query(vectors[1:2], n_results=3, where={'category': 'x'})
+        self.assertEqual(sorted(result['ids'][0]), ['a', 'c'])
+
+        store.delete(['a'])
+        self.assertStoreMatches(NumpyVectorStore(self.path), {'b': vectors[1], 'c': vectors[2]})
+
+    def test_concurrent_writers_keep_every_vector(self):
+        # 两个实例分别持有自己的锁文件句柄，相当于两个进程写同一目录
+        stores = [NumpyVectorStore(self.path), NumpyVectorStore(self.path)]
+        vectors = _vectors(400)
+        expected = {}
+        errors = []
+
+        def write(worker):
+            try:
+                for start in range(worker * 200, worker * 200 + 200, 10):
+                    ids = [f'id-{i}' for i in range(start, start + 10)]
+                    stores[worker].upsert(ids, vectors[start:start + 10])
+            except Exception as e:
+                errors.append(e)
+
+        for i in range(400):
+            expected[f'id-{i}'] = vectors[i]
+        threads = [threading.Thread(target=write, args=(worker,)) for worker in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        reloaded = NumpyVectorStore(self.path)
+        self.assertEqual(reloaded.count(), 400)
+        self.assertStoreMatches(reloaded, expected)
+        self.assertEqual(sorted(reloaded._rows.values()), list(range(400)))
+        for store in stores:
+            self.assertEqual(store.count(), 400)
+
+    def test_reload_after_interrupted_delete(self):
+        vectors = _vectors(5)
+        ids = ['a', 'b', 'c', 'd', 'e']
+        expected = {record_id: vectors[i] for i, record_id in enumerate(ids[1:], start=1)}
+
+        def crash_before_move(store):
+            def move_row(dst, src):
+                raise _Crash()
+            store._move_row = move_row
+
+        def crash_before_commit(store):
+            def flush():
+                raise _Crash()
+            store._flush = flush
+
+        for interrupt in (crash_before_move, crash_before_commit):
+            with self.subTest(interrupt=interrupt.__name__):
+                shutil.rmtree(self.path)
+                store = NumpyVectorStore(self.path)
+                store.upsert(ids, vectors)
+                interrupt(store)
+                with self.assertRaises(_Crash):
+                    store.delete(['a'])
+                # 模拟进程退出：释放锁文件句柄
+                store._lock_file.close()
+
+                reloaded = NumpyVectorStore(self.path)
+                self.assertEqual(reloaded.count(), 4)
+                self.assertStoreMatches(reloaded, expected)
+                self.assertEqual(reloaded.query(vectors[4:5], n_results=1)['ids'], [['e']])
+
+    def test_interrupted_upsert_is_redone_from_log(self):
+        vectors = _vectors(3)
+        store = NumpyVectorStore(self.path)
+        store.upsert(['a', 'b'], vectors[:2])
+
+        def flush():
+            raise _Crash()
+        store._flush = flush
+        with self.assertRaises(_Crash):
+            store.upsert(['a', 'c'], vectors[1:3])
+        store._lock_file.close()
+
+        self.assertStoreMatches(NumpyVectorStore(self.path), {'a': vectors[1], 'b': vectors[1], 'c': vectors[2]})
+
+    def test_reader_ignores_uncommitted_records(self):
+        vectors = _vectors(2)
+        writer = NumpyVectorStore(self.path)
+        writer.upsert(['a'], vectors[:1])
+        reader = NumpyVectorStore(self.path)
+        writer._append_log([{'op': 'put', 'row': 1, 'id': 'b', 'document': None, 'metadata': None}])
+        with writer._write_lock():
+            # 写入者仍持有锁时读者不回放也不恢复未提交的记录
+            reader._refresh()
+            self.assertEqual(reader._count, 1)
+            writer._commit()
+        self.assertEqual(reader.count(), 2)
+
+    def test_reader_waits_for_writer_to_finish(self):
+        vectors = _vectors(3)
+        writer = NumpyVectorStore(self.path)
+        writer.upsert(['a', 'b', 'c'], vectors, metadatas=[{'category': c} for c in 'xyz'])
+        reader = NumpyVectorStore(self.path)
+        results = []
+        with writer._write_lock():
+            thread = threading.Thread(target=lambda: results.append(reader.query(vectors[2:3], n_results=1)))
+            thread.start()
+            thread.join(timeout=0.2)
+            # 删除 a 会把最后一行 c 移到第 0 行，读者在写入期间等待
+            self.assertTrue(thread.is_alive())
+            writer.delete(['a'])
+        thread.join(timeout=5)
+        self.assertEqual(results[0]['ids'], [['c']])
+        self.assertEqual(results[0]['metadatas'], [[{'category': 'z'}]])
+
+    def test_readers_share_the_lock(self):
+        vectors = _vectors(2)
+        NumpyVectorStore(self.path).upsert(['a', 'b'], vectors)
+        first, second = NumpyVectorStore(self.path), NumpyVectorStore(self.path)
+        with first._read_lock():
+            self.assertEqual(second.count(), 2)
+
+
+    def test_quantized_recall_against_float32(self):
+        rng = np.random.default_rng(7)
+        centers = rng.normal(size=(20, 32))
+        vectors = centers[rng.integers(0, 20, 2000)] + 0.3 * rng.normal(size=(2000, 32))
+        queries = centers[rng.integers(0, 20, 40)] + 0.3 * rng.normal(size=(40, 32))
+        ids = [str(i) for i in range(2000)]
+        # c9 只占约 5%，按选中的行单独打分；其余过滤条件对整个矩阵打分后屏蔽
+        metadatas = [{'category': 'c9' if i % 20 == 0 else f'c{i % 4}'} for i in range(2000)]
+
+        def build(dtype, rescore_factor):
+            path = tempfile.mkdtemp(dir=self.path)
+            store = NumpyVectorStore(path, dtype=dtype, rescore_factor=rescore_factor)
+            store.upsert(ids, vectors, metadatas=metadatas)
+            store.delete(ids[100:200])
+            return store
+
+        reference = build('float32', 0)
+        for where in (None, {'category': 'c1'}, {'category': {'$in': ['c1', 'c2']}}, {'category': 'c9'}):
+            expected = reference.query(queries, n_results=3, where=where)['ids']
+            for dtype in ('int8', 'float16'):
+                for rescore_factor, min_recall in ((4, 1.0), (0, 0.8)):
+                    with self.subTest(where=where, dtype=dtype, rescore_factor=rescore_factor):
+                        store = build(dtype, rescore_factor)
+                        result = store.query(queries, n_results=3, where=where)['ids']
+                        recall = np.mean([len(set(a) & set(b)) / 3 for a, b in zip(expected, result)])
+                        self.assertGreaterEqual(recall, min_recall)
+                        if rescore_factor:
+                            self.assertEqual(result, expected)
+
+    def test_equal_scores_are_ordered_by_row(self):
+        vector = _vectors(1)
+        for dtype, rescore_factor in (('float32', 0), ('int8', 4)):
+            with self.subTest(dtype=dtype):
+                store = NumpyVectorStore(tempfile.mkdtemp(dir=self.path), dtype=dtype, rescore_factor=rescore_factor)
+                store.upsert([f'dup{i}' for i in range(6)], np.repeat(vector, 6, axis=0),
+                             metadatas=[{'category': 'x'}] * 6)
+                result = store.query(vector, n_results=3, where={'category': 'x'})
+                self.assertEqual(result['ids'], [['dup0', 'dup1', 'dup2']])
+
+
+class AlertCoalescerTests(TestCase):
+    def test_same_template_and_inputs_are_grouped(self):
+        coalescer = AlertCoalescer(window=30)
+        fingerprint = input_fingerprint('cpu 95%', 'OOM killed', ['内存'])
+        leader, is_leader = coalescer._admit('web-01 内存使用率 95%', fingerprint)
+        follower, is_follower_leader = coalescer._admit('web-02 内存使用率 97%', fingerprint)
+        self.assertTrue(is_leader)
+        self.assertFalse(is_follower_leader)
+        self.assertIs(follower, leader)
+
+    def test_different_metrics_logs_or_categories_are_not_grouped(self):
+        coalescer = AlertCoalescer(window=30)
+        fingerprints = [
+            input_fingerprint('cpu 95%', 'OOM killed', ['内存']),
+            input_fingerprint('cpu 20%', 'OOM killed', ['内存']),
+            input_fingerprint('cpu 95%', 'disk full', ['内存']),
+            input_fingerprint('cpu 95%', 'OOM killed', ['磁盘']),
+            input_fingerprint('cpu 95%', 'OOM killed', ['内存'], {'cpu': [1, 2, 3]}),
+        ]
+        self.assertEqual(len(set(fingerprints)), len(fingerprints))
+        for fingerprint in fingerprints:
+            _, is_leader = coalescer._admit('web-01 内存使用率 95%', fingerprint)
+            self.assertTrue(is_leader)
+
+    def test_cached_leader_appends_to_existing_case(self):
+        case = FaultCase.objects.create(alert_info='a', metrics_info='', log_info='', analysis_result='{}',
+                                        solution='', coalesced_alerts=[{'alert_info': 'earlier'}])
+        coalescer = AlertCoalescer(window=30)
+        group, _ = coalescer._admit('web-01 down')
+        coalescer._admit('web-02 down')
+        coalescer.window = 0  # 窗口已结束，不再安排第二次写入
+        coalescer._complete(group, {'uid': case.uid, 'cached': True}, None)
+
+        case.refresh_from_db()
+        self.assertEqual([alert['alert_info'] for alert in case.coalesced_alerts], ['earlier', 'web-02 down'])
+        # 再次写入时没有新告警，不重复追加
+        coalescer._flush_members(group)
+        case.refresh_from_db()
+        self.assertEqual(len(case.coalesced_alerts), 2)
+
+    def test_fresh_leader_records_members(self):
+        case = FaultCase.objects.create(alert_info='a', metrics_info='', log_info='', analysis_result='{}',
+                                        solution='')
+        coalescer = AlertCoalescer(window=30)
+        group, _ = coalescer._admit('web-01 down')
+        coalescer._admit('web-02 down')
+        coalescer.window = 0  # 窗口已结束，不再安排第二次写入
+        coalescer._complete(group, {'uid': case.uid, 'cached': False}, None)
+
+        case.refresh_from_db()
+        self.assertEqual([alert['alert_info'] for alert in case.coalesced_alerts], ['web-02 down'])
+
+
+class DiagnosisCacheTests(TestCase):
+    def test_exact_hit_from_database_has_response_shape(self):
+        cache = DiagnosisCache(version_interval=0)
+        FaultCase.objects.create(
+            alert_info='a', metrics_info='', log_info='', solution='重启',
+            analysis_result='{"category": "内存", "analysis": "泄漏", "solution": "重启"}',
+            prompt_hash='h', prompt_tokens={'total': 42},
+        )
+        payload = cache.lookup_exact('h', [])
+        self.assertEqual(payload['prompt_tokens'], {'total': 42})
+        self.assertEqual(set(payload), {'id', 'uid', 'category', 'analysis', 'solution', 'matched_knowledge_id',
+                                        'reference_cases', 'prompt_tokens', 'cached', 'cache_type'})
+
+    def test_knowledge_change_in_another_process_invalidates(self):
+        category = FaultCategory.objects.create(name='内存')
+        cache = DiagnosisCache(version_interval=0)
+        cache.store('h', [1.0, 0.0], {'id': 1})
+        self.assertIsNotNone(cache.lookup_similar([1.0, 0.0]))
+
+        # 不经过本进程的 invalidate()，只修改数据库
+        FaultKnowledge.objects.create(category=category, title='t', symptoms='s', solution='x')
+        self.assertIsNone(cache.lookup_similar([1.0, 0.0]))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_similar_hit_requires_same_scope(self):
+        cache = DiagnosisCache(version_interval=3600)
+        cache.store('h', [[1.0, 0.0], [0.0, 1.0], None], {'id': 1}, scope='cpu|refs-1')
+        self.assertIsNotNone(cache.lookup_similar([[1.0, 0.01], [0.0, 1.0], None], scope='cpu|refs-1'))
+        self.assertIsNone(cache.lookup_similar([[1.0, 0.0], [0.0, 1.0], None], scope='cpu|refs-2'))
+
+    def test_every_part_must_be_similar(self):
+        cache = DiagnosisCache(version_interval=3600)
+        cache.store('h', [[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]], {'id': 1})
+        # 告警相同但日志不同、或一边缺少日志时都不复用
+        self.assertIsNone(cache.lookup_similar([[1.0, 0.0], [0.0, 1.0], [1.0, -1.0]]))
+        self.assertIsNone(cache.lookup_similar([[1.0, 0.0], [0.0, 1.0], None]))
+        self.assertIsNotNone(cache.lookup_similar([[2.0, 0.0], [0.0, 3.0], [1.0, 1.0]]))
+
+
+class EmbeddingBatcherTests(SimpleTestCase):
+    def test_concurrent_requests_share_a_batch(self):
+        calls = []
+
+        def encode(texts):
+            calls.append(list(texts))
+            return np.array([[len(text), 1.0] for text in texts])
+
+        batcher = EmbeddingBatcher(encode, max_batch_size=8, max_wait=0.2)
+        results = {}
+        threads = [threading.Thread(target=lambda t=text: results.__setitem__(t, batcher.encode(t)))
+                   for text in ('a', 'bb', 'a', 'ccc')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results['ccc'].tolist(), [3.0, 1.0])
+        self.assertLess(len(calls), 4)
+        # 同一批内相同文本只编码一次
+        self.assertTrue(all(len(call) == len(set(call)) for call in calls))
+
+    def test_timeout_falls_back_to_direct_encode(self):
+        release = threading.Event()
+        worker_texts = []
+
+        def encode(texts):
+            if threading.current_thread().name == 'embedding-batcher':
+                worker_texts.extend(texts)
+                release.wait(5)
+            return np.array([[float(len(text))] for text in texts])
+
+        batcher = EmbeddingBatcher(encode, max_batch_size=1, max_wait=0, timeout=0.1)
+        self.assertEqual(batcher.encode('slow').tolist(), [4.0])
+        # 后台线程仍卡在第一批，排队中的请求超时后被取消，不再交给后台线程
+        self.assertEqual(batcher.encode('queued').tolist(), [6.0])
+        release.set()
+        batcher.timeout = 5
+        self.assertEqual(batcher.encode('after').tolist(), [5.0])
+        self.assertEqual(worker_texts, ['slow', 'after'])
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = f'{directory}/embeddings.sqlite3'
+
+    def _rows(self, cache):
+        return cache._db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def test_persistent_tier_evicts_oldest_rows(self):
+        cache = EmbeddingCache('m', persist_path=self.path, persist_max_rows=20)
+        for i in range(50):
+            cache.put(f'text {i}', [float(i), 1.0])
+        # 每写入 max_rows // 10 条检查一次
+        self.assertLessEqual(self._rows(cache), 22)
+        cache.clear()
+        self.assertIsNone(cache.get('text 0'))
+        np.testing.assert_array_equal(cache.get('text 49'), [49.0, 1.0])
+
+    def test_rewritten_entry_counts_as_new(self):
+        cache = EmbeddingCache('m', persist_path=self.path, persist_max_rows=10)
+        for i in range(10):
+            cache.put(f'text {i}', [float(i)])
+        cache.put('text 0', [0.0])
+        cache.put('text 10', [10.0])
+        cache.clear()
+        self.assertIsNotNone(cache.get('text 0'))
+        self.assertIsNone(cache.get('text 1'))
+
+    def test_limit_applied_when_reopened(self):
+        cache = EmbeddingCache('m', persist_path=self.path, persist_max_rows=0)
+        for i in range(30):
+            cache.put(f'text {i}', [float(i)])
+        self.assertEqual(self._rows(cache), 30)
+        self.assertEqual(self._rows(EmbeddingCache('m', persist_path=self.path, persist_max_rows=5)), 5)
+
+
+def _case(alert_info='alert', **fields):
+    return FaultCase(alert_info=alert_info, metrics_info='', log_info='', analysis_result='{}', solution='',
+                     **fields)
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class CaseWriterBackgroundTests(TransactionTestCase):
+    """后台线程使用独立的数据库连接，需要真正提交的事务；等待期间只查询写入状态，避免与写入线程争用测试库的表锁"""
+
+    @staticmethod
+    def _written(writer, count):
+        status = writer.status()
+        return status['written_total'] == count and status['queue_depth'] == 0
+
+    def test_flushes_when_batch_is_full(self):
+        writer = CaseWriter(batch_size=3, flush_interval=60)
+        writer.submit([_case(f'a{i}') for i in range(2)])
+        time.sleep(0.1)
+        self.assertEqual(writer.status()['written_total'], 0)
+        writer.submit([_case('a2')])
+        self.assertTrue(_wait_for(lambda: self._written(writer, 3)))
+        self.assertEqual(FaultCase.objects.count(), 3)
+
+    def test_flushes_oldest_case_after_interval(self):
+        writer = CaseWriter(batch_size=100, flush_interval=0.2)
+        writer.submit([_case()])
+        self.assertEqual(writer.status()['written_total'], 0)
+        self.assertTrue(_wait_for(lambda: self._written(writer, 1)))
+        self.assertEqual(FaultCase.objects.count(), 1)
+
+
+class CaseWriterTests(TestCase):
+    def test_should_flush_by_size_and_age(self):
+        writer = CaseWriter(batch_size=2, flush_interval=10)
+        self.assertFalse(writer._should_flush())
+        writer._pending = [_case()]
+        writer._oldest = time.time()
+        self.assertFalse(writer._should_flush())
+        writer._oldest = time.time() - 11
+        self.assertTrue(writer._should_flush())
+        writer._pending.append(_case())
+        writer._oldest = time.time()
+        self.assertTrue(writer._should_flush())
+
+    def _idle_writer(self, **options):
+        # 不启动后台线程，由测试调用 flush() / _write() 控制写入时机
+        writer = CaseWriter(**options)
+        writer._ensure_worker = lambda: None
+        return writer
+
+    def test_update_while_pending_changes_queued_object(self):
+        writer = self._idle_writer()
+        case = _case()
+        writer.submit([case])
+        writer.update(case.uid, solution='重启')
+        self.assertEqual(case.solution, '重启')
+        writer.flush()
+        self.assertEqual(FaultCase.objects.get(uid=case.uid).solution, '重启')
+
+    def test_update_while_in_flight_is_applied_after_write(self):
+        writer = self._idle_writer()
+        case = _case()
+        writer.submit([case])
+        with writer._cond:
+            batch = writer._take_batch()
+        writer.update(case.uid, coalesced_alerts=[{'alert_info': 'b'}])
+        self.assertEqual(case.coalesced_alerts, [])
+        writer._write(batch)
+        self.assertEqual(FaultCase.objects.get(uid=case.uid).coalesced_alerts, [{'alert_info': 'b'}])
+        self.assertEqual(writer.status()['queue_depth'], 0)
+
+    def test_remaining_cases_keep_their_enqueue_time(self):
+        writer = self._idle_writer(batch_size=1, flush_interval=10)
+        writer.submit([_case('a')])
+        first = writer._oldest
+        time.sleep(0.05)
+        writer.submit([_case('b')])
+        second = writer._enqueued_at[-1]
+        with writer._cond:
+            writer._take_batch()
+        self.assertEqual(writer._oldest, second)
+        self.assertLess(first, second)
+        with writer._cond:
+            writer._take_batch()
+        self.assertIsNone(writer._oldest)
+
+    def test_bulk_failure_falls_back_to_single_rows(self):
+        existing = _case('existing')
+        existing.save()
+        writer = self._idle_writer()
+        duplicate = _case('duplicate', uid=existing.uid)
+        writer.submit([_case('a'), duplicate, _case('b')])
+        writer.flush()
+        self.assertEqual(sorted(FaultCase.objects.values_list('alert_info', flat=True)), ['a', 'b', 'existing'])
+        status = writer.status()
+        self.assertEqual((status['written_total'], status['failed_total']), (2, 1))
+        self.assertIsNotNone(status['last_error'])
+
+    def test_overflow_writes_synchronously(self):
+        writer = self._idle_writer(max_queue=2)
+        writer.submit([_case('queued')])
+        writer.submit([_case('a'), _case('b')])
+        self.assertEqual(sorted(FaultCase.objects.values_list('alert_info', flat=True)), ['a', 'b'])
+        self.assertEqual(writer.status()['queue_depth'], 1)
+
+
+class SaveCasesWithFallbackTests(TestCase):
+    def test_only_failing_rows_are_reported(self):
+        existing = _case('old')
+        existing.save()
+        cases = [_case('a'), _case('b'), _case('c')]
+        cases[1].uid = existing.uid
+        failed = save_cases_with_fallback(cases)
+        self.assertEqual(list(failed), [existing.uid])
+        self.assertEqual(set(FaultCase.objects.values_list('alert_info', flat=True)), {'old', 'a', 'c'})
+
+    def test_successful_batch_reports_nothing(self):
+        self.assertEqual(save_cases_with_fallback([_case('a'), _case('b')]), {})
+        self.assertEqual(FaultCase.objects.count(), 2)
+
+
+class AsyncSaveCaseTests(TestCase):
+    def _context(self):
+        return DiagnosisContext(alert_info='告警', metrics_info='', log_info='', matched_knowledge_list=[],
+                                reference_cases=[], prompt='提示词', prompt_hash='hash')
+
+    @override_settings(FAULT_CASE_WRITE_BEHIND=False)
+    async def test_saves_directly_without_write_behind(self):
+        pipeline = DiagnosisPipeline(vector_db=object(), diagnosis_cache=object(), llm=object())
+        before = CASE_WRITES.value(mode='sync', outcome='success')
+        case = await pipeline.asave_case(self._context(), {'result': 'ok'})
+        self.assertIsNotNone(case.id)
+        self.assertTrue(await FaultCase.objects.filter(uid=case.uid).aexists())
+        self.assertEqual(CASE_WRITES.value(mode='sync', outcome='success') - before, 1)
+
+    @override_settings(FAULT_CASE_WRITE_BEHIND=True)
+    async def test_enqueues_with_write_behind(self):
+        pipeline = DiagnosisPipeline(vector_db=object(), diagnosis_cache=object(), llm=object())
+        with mock.patch('diagnosis.persistence.get_case_writer') as get_writer:
+            case = await pipeline.asave_case(self._context(), {'result': 'ok'})
+        get_writer.return_value.submit.assert_called_once_with([case])
+        self.assertIsNone(case.id)
+
+
+def _reference(index, symptoms='症状', solution='方案'):
+    return {'title': f'案例{index}', 'category': '内存', 'symptoms': symptoms, 'solution': solution,
+            'score': 0.9 - index * 0.1}
+
+
+class PromptBuilderTests(SimpleTestCase):
+    def setUp(self):
+        self.counter = TokenCounter()
+
+    def test_tokenizer_fallback_warns_once(self):
+        with mock.patch('diagnosis.prompt_builder.QwenTokenCounter', side_effect=ImportError('tiktoken')), \
+                mock.patch('diagnosis.prompt_builder._fallback_warned', set()):
+            with self.assertLogs('diagnosis.prompt_builder', 'WARNING') as logs:
+                counters = [create_token_counter('qwen-max') for _ in range(3)]
+        self.assertEqual(len(logs.output), 1)
+        self.assertTrue(all(type(counter) is TokenCounter for counter in counters))
+
+    def test_within_budget_is_untouched(self):
+        built = PromptBuilder(self.counter, PromptBudget()).build('告警', '指标', '日志', [_reference(0)])
+        self.assertIn('告警信息：告警', built.text)
+        self.assertIn('案例标题：案例0', built.text)
+        self.assertEqual(built.tokens['truncated'], [])
+        self.assertEqual(built.tokens['dropped_references'], 0)
+        self.assertEqual(built.tokens['total'], self.counter.count(built.text))
+
+    def test_sections_are_clipped_to_their_budget(self):
+        budget = PromptBudget(alert=20, metrics=20, logs=20, reference=60, total=100000)
+        logs = '\n'.join(f'第{i}行日志' for i in range(100))
+        built = PromptBuilder(self.counter, budget).build('告' * 100, '指' * 100, logs,
+                                                           [_reference(0, solution='解' * 200)])
+        sections = built.tokens['sections']
+        self.assertLessEqual(sections['alert'], 20)
+        self.assertLessEqual(sections['metrics'], 20)
+        self.assertLessEqual(sections['logs'], 20)
+        self.assertLessEqual(sections['references'][0], 60)
+        self.assertEqual(built.tokens['truncated'], ['alert', 'metrics', 'logs', 'reference:0'])
+        self.assertIn(TRUNCATION_MARK, built.text)
+        # 日志按整行截断
+        logs_section = built.text.split('日志信息：')[1].split(TRUNCATION_MARK)[0]
+        self.assertTrue(logs_section.endswith('日志'))
+
+    def test_total_budget_drops_lowest_references_first(self):
+        references = [_reference(i, symptoms='症' * 100) for i in range(3)]
+        full = PromptBuilder(self.counter, PromptBudget()).build('告警', '', '', references)
+        per_reference = full.tokens['sections']['references'][0]
+        budget = PromptBudget(total=full.tokens['total'] - per_reference)
+        built = PromptBuilder(self.counter, budget).build('告警', '', '', references)
+        self.assertEqual(built.tokens['dropped_references'], 1)
+        self.assertIn('案例1', built.text)
+        self.assertNotIn('案例2', built.text)
+        self.assertLessEqual(built.tokens['total'], budget.total)
+
+    def test_total_budget_then_trims_logs_before_metrics(self):
+        budget = PromptBudget(total=400)
+        built = PromptBuilder(self.counter, budget).build('告警', '指' * 100, '日' * 1000, [_reference(0)])
+        self.assertLessEqual(built.tokens['total'], 400)
+        self.assertEqual(built.tokens['dropped_references'], 1)
+        self.assertIn('logs', built.tokens['truncated'])
+        self.assertNotIn('metrics', built.tokens['truncated'])
+        self.assertEqual(built.tokens['sections']['metrics'], 100)
+
+
+class TimeseriesTests(SimpleTestCase):
+    def test_parse_formats(self):
+        by_name = parse_series({'cpu': [1, 2, 3], 'mem': [[1700000000, 5], [1700000060, 6]]})
+        self.assertEqual([series.name for series in by_name], ['cpu', 'mem'])
+        self.assertIsNone(by_name[0].timestamps)
+        np.testing.assert_array_equal(by_name[1].timestamps, [1700000000, 1700000060])
+
+        prometheus = parse_series([{'metric': {'__name__': 'up', 'job': 'api'},
+                                    'values': [[1700000000000, '1'], [1700000060000, '0']]}])
+        self.assertEqual(prometheus[0].name, 'up{job="api"}')
+        np.testing.assert_array_equal(prometheus[0].values, [1, 0])
+        # 毫秒时间戳转换为秒
+        np.testing.assert_array_equal(prometheus[0].timestamps, [1700000000, 1700000060])
+
+        csv = parse_series('timestamp,cpu,mem\n2024-01-01T00:00:00Z,1,\n2024-01-01T00:01:00Z,2,4\n')
+        self.assertEqual([series.name for series in csv], ['cpu', 'mem'])
+        self.assertEqual(csv[0].timestamps[1] - csv[0].timestamps[0], 60)
+        self.assertTrue(np.isnan(csv[1].values[0]))
+
+    def test_parse_errors(self):
+        for data in ('cpu\n', 'a,b\n1\n', {'cpu': [[1, 2], [3]]}, {'cpu': ['high']},
+                     {'cpu': {'values': [1, 2], 'timestamps': [1]}}, 42):
+            with self.subTest(data=data), self.assertRaises(ValueError):
+                parse_series(data)
+
+    def test_spike_is_detected(self):
+        features = analyze_series(parse_series({'cpu': [10.0] * 50 + [100.0] + [10.0] * 9})[0])
+        self.assertEqual(features['zscore']['count'], 1)
+        self.assertEqual(features['zscore']['at'], 50)
+        self.assertEqual(features['max_rate']['value'], 90.0)
+        self.assertNotIn('change_point', features)
+
+    def test_level_shift_is_detected(self):
+        features = analyze_series(parse_series({'cpu': [10.0] * 20 + [50.0] * 20})[0])
+        self.assertEqual(features['change_point'], {'at': 20, 'before': 10.0, 'after': 50.0})
+        self.assertNotIn('zscore', features)
+        self.assertGreater(features['trend'], 0)
+
+    def test_summary_text_and_limits(self):
+        text = summarize_metrics({'cpu': list(range(10)), 'load': [v * 2 for v in range(10)]})
+        self.assertTrue(text.startswith('[指标预分析：2 条序列，共 20 个点]'))
+        self.assertIn('强相关：cpu ~ load r=+1.00', text)
+        with self.assertRaises(ValueError):
+            summarize_metrics({})
+        with self.assertRaises(ValueError):
+            summarize_metrics({'cpu': list(range(10))}, max_points=5)
+
+
+class SidecarFrameTests(SimpleTestCase):
+    def setUp(self):
+        self.left, self.right = socket.socketpair()
+        self.addCleanup(self.left.close)
+        self.addCleanup(self.right.close)
+
+    def test_round_trip_with_array(self):
+        vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+        write_frame(self.left, OPS['upsert'], {'ids': ['a', 'b', 'c'], 'note': '中文'}, vectors)
+        code, payload, array = read_frame(self.right)
+        self.assertEqual(code, OPS['upsert'])
+        self.assertEqual(payload['ids'], ['a', 'b', 'c'])
+        self.assertEqual(payload['note'], '中文')
+        np.testing.assert_array_equal(array, vectors)
+        self.assertEqual(array.dtype, np.float32)
+
+    def test_round_trip_without_array_and_consecutive_frames(self):
+        write_frame(self.left, OPS['ping'], {})
+        write_frame(self.left, OPS['stats'], {'x': 1}, np.array([1, 2], dtype=np.int64))
+        self.assertEqual(read_frame(self.right), (OPS['ping'], {}, None))
+        code, payload, array = read_frame(self.right)
+        self.assertEqual((code, payload['x']), (OPS['stats'], 1))
+        np.testing.assert_array_equal(array, [1, 2])
+
+    def test_rejects_bad_magic(self):
+        self.left.sendall(b'XX' + bytes(10))
+        with self.assertRaises(ValueError):
+            read_frame(self.right)
+
+
+class _ScriptedBackend(LLMBackend):
+    """按顺序返回预设内容或抛出预设错误的后端"""
+
+    def __init__(self, outcomes, **options):
+        super().__init__(**{'backoff': 0.001, **options})
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def _generate_once(self, prompt, options, timeout):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return LLMResult(content=outcome, model=options.model)
+
+
+class LLMBackendTests(SimpleTestCase):
+    def test_retryable_error_is_retried(self):
+        backend = _ScriptedBackend([LLMError('限流', retryable=True), 'ok'])
+        result = backend.generate('p', RouteOptions())
+        self.assertEqual((result.content, result.attempts, backend.calls), ('ok', 2, 2))
+
+    def test_non_retryable_error_is_raised_immediately(self):
+        backend = _ScriptedBackend([LLMError('参数错误'), 'ok'])
+        with self.assertRaises(LLMError):
+            backend.generate('p', RouteOptions())
+        self.assertEqual(backend.calls, 1)
+
+    def test_retries_stop_at_max_retries(self):
+        backend = _ScriptedBackend([LLMError('限流', retryable=True)] * 3, max_retries=1)
+        with self.assertRaises(LLMError):
+            backend.generate('p', RouteOptions())
+        self.assertEqual(backend.calls, 2)
+
+    def test_no_retry_when_backoff_would_pass_deadline(self):
+        backend = _ScriptedBackend([LLMError('限流', retryable=True), 'ok'])
+        backend._backoff_delay = lambda attempt: 1.0
+        with self.assertRaises(LLMError):
+            backend.generate('p', RouteOptions(timeout=0.2))
+        self.assertEqual(backend.calls, 1)
+
+    def test_stub_backend_times_out_within_budget(self):
+        backend = StubBackend(latency=0.5, max_retries=0)
+        started = time.monotonic()
+        with self.assertRaises(LLMError) as raised:
+            backend.generate('p', RouteOptions(timeout=0.05))
+        self.assertTrue(raised.exception.retryable)
+        self.assertLess(time.monotonic() - started, 0.4)
+
+    def test_stream_is_not_retried_after_output(self):
+        class Backend(_ScriptedBackend):
+            def _stream_once(self, prompt, options, deadline, usage):
+                self.calls += 1
+                if self.calls == 1:
+                    raise LLMError('连接中断', retryable=True)
+                yield '部分'
+                raise LLMError('连接中断', retryable=True)
+
+        backend = Backend([])
+        chunks = []
+        with self.assertRaises(LLMError):
+            for chunk in backend.stream('p', RouteOptions()):
+                chunks.append(chunk)
+        self.assertEqual((chunks, backend.calls), (['部分'], 2))
+
+
+def _sse_response(body: bytes) -> requests.Response:
+    # 与 requests 的处理一致：text/* 响应头不带 charset 时编码为 ISO-8859-1
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = 'text/event-stream'
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.raw = io.BytesIO(body)
+    return response
+
+
+class DashScopeStreamTests(SimpleTestCase):
+    def _stream(self, body: bytes):
+        backend = DashScopeBackend(api_key='key', max_retries=0)
+        backend._session.post = lambda *args, **kwargs: _sse_response(body)
+        return list(backend.stream('p', RouteOptions()))
+
+    def test_frames_are_decoded_as_utf8(self):
+        frame = json.dumps({'output': {'choices': [{'message': {'content': '内存泄漏'}}]}}, ensure_ascii=False)
+        self.assertEqual(self._stream(f'data:{frame}\n\n'.encode('utf-8')), ['内存泄漏'])
+
+    def test_malformed_frame_raises_llm_error(self):
+        with self.assertRaises(LLMError):
+            self._stream(b'data:{not json\n\n')
+
+
+class StreamLLMTests(SimpleTestCase):
+    def test_usage_is_recorded_and_reader_time_is_excluded(self):
+        backend = StubBackend(latency=0.0, stream_chunk_size=16)
+        pipeline = DiagnosisPipeline(vector_db=object(), diagnosis_cache=object(), llm=backend)
+        before = LLM_TOKENS.value(route='analyze_stream_test', direction='output')
+        with collect_samples() as samples:
+            chunks = []
+            for chunk in pipeline.stream_llm('提示词', route='analyze_stream_test'):
+                chunks.append(chunk)
+                time.sleep(0.05)  # 模拟客户端读取缓慢
+        self.assertEqual(''.join(chunks), backend._content('提示词'))
+        self.assertEqual(LLM_TOKENS.value(route='analyze_stream_test', direction='output') - before,
+                         len(''.join(chunks)))
+        self.assertEqual(len(samples['llm_stream']), 1)
+        self.assertLess(samples['llm_stream'][0], 0.05)
+
+
+class _RecordingIndexService:
+    """记录索引调用的向量库服务，fail=True 时写入失败"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.upserted = []
+        self.deleted = []
+
+    def upsert_knowledge_batch(self, items):
+        if self.fail:
+            raise RuntimeError('向量库不可用')
+        self.upserted.append(sorted(item['id'] for item in items))
+        return len(items)
+
+    def delete_knowledge_batch(self, ids):
+        self.deleted.append(list(ids))
+        return len(ids)
+
+
+class IndexingQueueTests(TestCase):
+    def _queue(self, service):
+        # 不启动后台线程，由测试取出批次并处理
+        queue = IndexingQueue(service_factory=lambda: service, batch_size=10, flush_interval=0)
+        queue._ensure_worker = lambda: None
+        return queue
+
+    def test_repeated_ids_are_indexed_once(self):
+        category = FaultCategory.objects.create(name='内存')
+        knowledge = FaultKnowledge.objects.create(category=category, title='t', symptoms='s', solution='x')
+        service = _RecordingIndexService()
+        queue = self._queue(service)
+        queue.enqueue(knowledge.id)
+        first_enqueued_at = queue._pending[knowledge.id]
+        queue.enqueue(knowledge.id)
+        queue.enqueue(99999)
+        queue.enqueue(knowledge.id)
+        self.assertEqual(queue.status()['queue_depth'], 2)
+        self.assertEqual(queue._pending[knowledge.id], first_enqueued_at)
+
+        with queue._cond:
+            batch = queue._take_batch()
+        queue._process(batch)
+        self.assertEqual(service.upserted, [[knowledge.id]])
+        self.assertEqual(service.deleted, [[99999]])
+        self.assertEqual((queue.indexed_total, queue.deleted_total), (1, 1))
+
+    def test_failed_batch_is_requeued_with_original_times(self):
+        queue = self._queue(_RecordingIndexService(fail=True))
+        queue.enqueue(1)
+        queue.enqueue(2)
+        with queue._cond:
+            batch = queue._take_batch()
+        queue._process(batch)
+        self.assertEqual(queue._pending, batch)
+        self.assertEqual(queue.failed_total, 2)
+        self.assertEqual(queue.last_error, '向量库不可用')
+
+
+class _PagedCollection:
+    """按 limit/offset 分页返回向量与元数据的集合"""
+
+    def __init__(self, embeddings, categories):
+        self.embeddings = embeddings
+        self.categories = categories
+        self.pages = 0
+
+    def get(self, include, limit, offset):
+        self.pages += 1
+        rows = range(offset, min(offset + limit, len(self.embeddings)))
+        return {
+            'ids': [str(row) for row in rows],
+            'embeddings': [self.embeddings[row] for row in rows],
+            'metadatas': [{'category': self.categories[row]} for row in rows],
+        }
+
+
+class CategoryRouterTests(SimpleTestCase):
+    def _collection(self, count_per_category=5, categories=('c0', 'c1', 'c2', 'c3', 'c4')):
+        rng = np.random.default_rng(0)
+        embeddings, names = [], []
+        for axis, name in enumerate(categories):
+            for _ in range(count_per_category):
+                vector = 0.1 * rng.normal(size=8)
+                vector[axis] += 1
+                embeddings.append(vector.tolist())
+                names.append(name)
+        return _PagedCollection(embeddings, names)
+
+    def test_routes_to_nearest_categories(self):
+        collection = self._collection()
+        router = CategoryRouter(top_n=2, page_size=4)
+        query = np.zeros(8)
+        query[1], query[3] = 1.0, 0.9
+        self.assertEqual(router.route([query.tolist()], collection), ['c1', 'c3'])
+        # 多个查询返回各自所选分类的并集
+        other = np.zeros(8)
+        other[4] = 1.0
+        self.assertEqual(set(router.route([query.tolist(), other.tolist()], collection)), {'c1', 'c3', 'c4'})
+        self.assertEqual(collection.pages, 7)
+
+    def test_few_categories_are_not_filtered(self):
+        router = CategoryRouter(top_n=3)
+        self.assertIsNone(router.route([[1.0] + [0.0] * 7], self._collection(categories=('c0', 'c1'))))
+
+    def test_stale_centroids_are_rebuilt_in_background(self):
+        collection = self._collection()
+        router = CategoryRouter(top_n=2)
+        router.route([[1.0] + [0.0] * 7], collection)
+        built_at = router.stats()['built_at']
+        self.assertFalse(router.stats()['stale'])
+
+        router.mark_stale()
+        collection.categories = ['c5' if name == 'c0' else name for name in collection.categories]
+        router.route([[1.0] + [0.0] * 7], collection)
+        self.assertTrue(_wait_for(lambda: router.stats()['built_at'] != built_at and not router._rebuilding))
+        self.assertIn('c5', router.route([[1.0] + [0.0] * 7], collection))
+
+
+class LogReducerTests(SimpleTestCase):
+    def _lines(self):
+        lines = []
+        for second in range(30):
+            lines.append(f'2024-05-01 10:00:{second:02d},120 INFO heartbeat ok from node-{second % 3}')
+            if second % 10 == 0:
+                lines.append(f'2024-05-01T10:00:{second:02d}Z ERROR connection to 10.0.0.{second} refused')
+        return lines
+
+    def test_lines_fold_into_templates_with_time_span(self):
+        reducer = LogReducer().feed(self._lines())
+        self.assertEqual(reducer.lines, 33)
+        self.assertEqual([cluster.count for cluster in reducer.clusters], [30, 3])
+        heartbeat, error = reducer.clusters
+        self.assertEqual(heartbeat.template, ['INFO', 'heartbeat', 'ok', 'from', WILDCARD])
+        self.assertEqual((heartbeat.first_ts, heartbeat.last_ts), ('2024-05-01 10:00:00,120', '2024-05-01 10:00:29,120'))
+        self.assertTrue(error.has_error)
+        self.assertEqual(error.samples[3], ['10.0.0.0', '10.0.0.10', '10.0.0.20'])
+
+        text = reducer.render()
+        self.assertIn('[日志已压缩：原始 33 行，2 个模板]', text)
+        self.assertIn('[x30] 2024-05-01 10:00:00,120 ~ 2024-05-01 10:00:29,120 INFO heartbeat ok from <*>', text)
+        self.assertIn('[x3] 2024-05-01T10:00:00Z ~ 2024-05-01T10:00:20Z ERROR connection to <*> refused', text)
+
+    def test_error_templates_are_kept_first(self):
+        text = LogReducer().feed(self._lines()).render(max_templates=1)
+        self.assertIn('ERROR connection to <*> refused', text)
+        self.assertIn('[另有 1 个模板共 30 行未列出]', text)
+
+    def test_cluster_limit_counts_unclustered_lines(self):
+        reducer = LogReducer(max_clusters=1).feed(['alpha one', 'beta two three', 'gamma'])
+        self.assertEqual((len(reducer.clusters), reducer.unclustered), (1, 2))
+
+    def test_short_logs_are_returned_unchanged(self):
+        self.assertEqual(reduce_log('a\nb', min_lines=20), 'a\nb')
+
+
+class FaultCaseListTests(TestCase):
+    url = '/api/diagnosis/cases/'
+
+    def setUp(self):
+        for i in range(5):
+            FaultCase.objects.create(alert_info=f'告警{i} ' + 'x' * 200, metrics_info='', log_info=f'日志{i}',
+                                     analysis_result='{}', solution='')
+        self.client = APIClient()
+
+    def test_cursor_pages_cover_every_case_newest_first(self):
+        ids, url, pages = [], f'{self.url}?page_size=2', 0
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            ids.extend(case['id'] for case in data['results'])
+            url = data['next']
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertEqual(ids, list(FaultCase.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_new_case_does_not_shift_the_next_page(self):
+        first = self.client.get(f'{self.url}?page_size=2').json()
+        _case('新告警').save()
+        second = self.client.get(first['next']).json()
+        seen = {case['id'] for case in first['results']}
+        self.assertFalse(seen & {case['id'] for case in second['results']})
+        self.assertEqual(len(second['results']), 2)
+
+    @override_settings(FAULT_CASE_PREVIEW_LENGTH=10)
+    def test_list_is_lightweight_unless_fields_are_included(self):
+        case = self.client.get(self.url).json()['results'][0]
+        self.assertNotIn('alert_info', case)
+        self.assertNotIn('log_info', case)
+        self.assertEqual(len(case['alert_preview']), 10)
+
+        case = self.client.get(f'{self.url}?include=log_info,unknown,id').json()['results'][0]
+        self.assertTrue(case['log_info'].startswith('日志'))
+        self.assertNotIn('alert_info', case)
+        self.assertNotIn('unknown', case)
+
+
+class WarmUpGateTests(SimpleTestCase):
+    @override_settings(VECTOR_DB_WARMUP_COMMANDS=['runserver'])
+    def test_only_server_processes_warm_up(self):
+        self.assertFalse(is_server_process(['manage.py', 'migrate']))
+        self.assertFalse(is_server_process(['/srv/app/manage.py', 'shell']))
+        self.assertFalse(is_server_process(['manage.py']))
+        self.assertTrue(is_server_process(['manage.py', 'runserver', '--noreload']))
+        self.assertTrue(is_server_process(['/usr/bin/gunicorn', 'fault_diagnosis.wsgi']))
+        with mock.patch.dict('os.environ', {'RUN_MAIN': 'true'}):
+            self.assertTrue(is_server_process(['manage.py', 'runserver']))
+        with mock.patch.dict('os.environ', {'RUN_MAIN': ''}):
+            # 自动重载的监视进程不处理请求
+            self.assertFalse(is_server_process(['manage.py', 'runserver']))
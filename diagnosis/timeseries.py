@@ -0,0 +1,278 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# CSV 中被识别为时间戳的列名
+TIMESTAMP_COLUMNS = {'timestamp', 'time', 'ts', 'date', 'datetime'}
+# 变点两侧的最少点数
+MIN_SEGMENT = 5
+
+
+@dataclass
+class Series:
+    name: str
+    values: np.ndarray
+    timestamps: Optional[np.ndarray] = None  # Unix 秒
+
+
+def _to_seconds(raw) -> np.ndarray:
+    """时间戳转换为 Unix 秒：支持数值（秒或毫秒）和 ISO 8601 字符串"""
+    try:
+        timestamps = np.asarray(raw, dtype=np.float64)
+    except (TypeError, ValueError):
+        parsed = np.asarray([str(t).rstrip('Z') for t in raw], dtype='datetime64[ms]')
+        return parsed.astype(np.int64) / 1000.0
+    # 数值过大时视为毫秒
+    return timestamps / 1000.0 if timestamps.size and np.nanmax(timestamps) > 1e11 else timestamps
+
+
+def _from_points(name: str, points, timestamps=None) -> Series:
+    """由数值列表或 [时间戳, 值] 列表构造序列"""
+    if points and isinstance(points[0], (list, tuple)):
+        try:
+            pairs = np.asarray(points, dtype=np.float64)
+        except ValueError:
+            # 时间戳为字符串时逐点拆分
+            pairs = None
+        if pairs is not None and pairs.ndim == 2 and pairs.shape[1] == 2:
+            timestamps, points = pairs[:, 0], pairs[:, 1]
+        else:
+            timestamps = [point[0] for point in points]
+            points = [point[1] for point in points]
+    values = np.asarray(points, dtype=np.float64)
+    if values.ndim != 1:
+        raise ValueError(f'{name}: values must be a flat list of numbers')
+    if timestamps is not None:
+        if len(timestamps) != len(values):
+            raise ValueError(f'{name}: timestamps and values differ in length')
+        timestamps = _to_seconds(timestamps)
+    return Series(name, values, timestamps)
+
+
+def _parse_csv(text: str) -> List[Series]:
+    lines = [line for line in text.strip().splitlines() if line.strip()]
+    if len(lines) < 2:
+        raise ValueError('CSV needs a header row and at least one data row')
+    header = [column.strip() for column in lines[0].split(',')]
+    rows = np.asarray([line.split(',') for line in lines[1:]], dtype=object)
+    if rows.ndim != 2 or rows.shape[1] != len(header):
+        raise ValueError('CSV rows must have the same number of columns as the header')
+    rows = np.char.strip(rows.astype(str))
+    timestamps = None
+    columns = list(range(len(header)))
+    if header[0].lower() in TIMESTAMP_COLUMNS:
+        timestamps = _to_seconds(rows[:, 0])
+        columns = columns[1:]
+    values = np.where(rows[:, columns] == '', 'nan', rows[:, columns]).astype(np.float64)
+    return [Series(header[column], values[:, i], timestamps) for i, column in enumerate(columns)]
+
+
+def parse_series(data) -> List[Series]:
+    """解析结构化指标序列
+
+    支持：
+    - {"cpu": [1, 2, ...]} 或 {"cpu": [[时间戳, 值], ...]} 或 {"cpu": {"timestamps": [...], "values": [...]}}
+    - [{"name": "cpu", "values": [...], "timestamps": [...]}, ...]（也接受 Prometheus 区间查询结果的 metric/values 格式）
+    - 首行为列名的 CSV 文本，首列名为 timestamp/time 等时作为时间戳
+    """
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return _parse_csv(data)
+
+    series = []
+    try:
+        if isinstance(data, dict):
+            for name, points in data.items():
+                if isinstance(points, dict):
+                    series.append(_from_points(name, points.get('values') or [], points.get('timestamps')))
+                else:
+                    series.append(_from_points(name, points))
+        elif isinstance(data, list):
+            for index, item in enumerate(data):
+                name = item.get('name')
+                if not name and isinstance(item.get('metric'), dict):
+                    labels = dict(item['metric'])
+                    metric_name = labels.pop('__name__', '')
+                    name = metric_name + ('{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+                                          if labels else '')
+                series.append(_from_points(name or f'series_{index}', item.get('values') or [],
+                                           item.get('timestamps')))
+        else:
+            raise ValueError('expected an object, a list or CSV text')
+    except (TypeError, AttributeError, KeyError, IndexError) as e:
+        raise ValueError(str(e))
+    return series
+
+
+def _change_point(values: np.ndarray) -> Optional[Tuple[int, float, float]]:
+    """单变点检测（CUSUM 均值漂移）：返回 (变点下标, 之前均值, 之后均值)，不显著时返回 None"""
+    n = len(values)
+    if n < 2 * MIN_SEGMENT:
+        return None
+    cumulative = np.cumsum(values)
+    k = np.arange(1, n)
+    left = cumulative[:-1] / k
+    right = (cumulative[-1] - cumulative[:-1]) / (n - k)
+    statistic = np.abs(right - left) * np.sqrt(k * (n - k) / n)
+    statistic[:MIN_SEGMENT - 1] = 0
+    statistic[n - MIN_SEGMENT:] = 0
+    split = int(np.argmax(statistic)) + 1
+    before, after = values[:split], values[split:]
+    shift = abs(after.mean() - before.mean())
+    pooled = np.sqrt((before.var() * len(before) + after.var() * len(after)) / n)
+    # 漂移至少为段内标准差的 1 倍，且统计量足够大
+    if shift == 0 or (pooled > 0 and (shift < pooled or statistic[split - 1] < 5 * pooled)):
+        return None
+    return split, float(before.mean()), float(after.mean())
+
+
+def analyze_series(series: Series, z_threshold: float = 3.0, mad_threshold: float = 3.5) -> Dict:
+    """提取单条序列的统计量、z-score/MAD 异常点、变点、变化率与趋势"""
+    finite = np.isfinite(series.values)
+    values = series.values[finite]
+    timestamps = series.timestamps[finite] if series.timestamps is not None else None
+    features: Dict = {'name': series.name, 'points': int(len(values))}
+    if not len(values):
+        return features
+
+    mean, std = float(values.mean()), float(values.std())
+    features.update({
+        'mean': mean,
+        'last': float(values[-1]),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'p95': float(np.percentile(values, 95)),
+    })
+    if timestamps is not None:
+        features['start'], features['end'] = float(timestamps[0]), float(timestamps[-1])
+
+    def position(index: int):
+        return float(timestamps[index]) if timestamps is not None else int(index)
+
+    if std > 0:
+        z = np.abs(values - mean) / std
+        anomalies = z > z_threshold
+        if anomalies.any():
+            peak = int(np.argmax(z))
+            features['zscore'] = {'count': int(anomalies.sum()), 'max': float(z[peak]), 'at': position(peak),
+                                  'value': float(values[peak])}
+    median = np.median(values)
+    mad = float(np.median(np.abs(values - median)))
+    if mad > 0:
+        robust = 0.6745 * np.abs(values - median) / mad
+        anomalies = robust > mad_threshold
+        if anomalies.any():
+            features['mad'] = {'count': int(anomalies.sum()), 'max': float(robust.max())}
+
+    change = _change_point(values)
+    if change is not None:
+        split, before, after = change
+        features['change_point'] = {'at': position(split), 'before': before, 'after': after}
+
+    if len(values) > 1:
+        deltas = np.diff(values)
+        if timestamps is not None:
+            elapsed = np.diff(timestamps)
+            valid = elapsed > 0
+            rates = np.zeros_like(deltas)
+            rates[valid] = deltas[valid] / elapsed[valid]
+        else:
+            rates = deltas
+        peak = int(np.argmax(np.abs(rates)))
+        features['max_rate'] = {'value': float(rates[peak]), 'at': position(peak + 1),
+                                'unit': '/s' if timestamps is not None else '/点'}
+        x = timestamps if timestamps is not None else np.arange(len(values), dtype=np.float64)
+        if np.ptp(x) > 0:
+            slope = np.polyfit(x - x[0], values, 1)[0]
+            features['trend'] = float(slope * np.ptp(x))
+    return features
+
+
+def correlations(series_list: List[Series], threshold: float = 0.8, limit: int = 5) -> List[Tuple[str, str, float]]:
+    """点数相同的序列两两计算皮尔逊相关系数，返回 |r| 不低于阈值的前 limit 对"""
+    by_length: Dict[int, List[Series]] = {}
+    for series in series_list:
+        if len(series.values) >= 3:
+            by_length.setdefault(len(series.values), []).append(series)
+    pairs = []
+    for group in by_length.values():
+        if len(group) < 2:
+            continue
+        matrix = np.stack([series.values for series in group])
+        rows = np.isfinite(matrix).all(axis=0)
+        matrix = matrix[:, rows]
+        usable = matrix.std(axis=1) > 0
+        if matrix.shape[1] < 3 or usable.sum() < 2:
+            continue
+        names = [series.name for series, ok in zip(group, usable) if ok]
+        coefficients = np.corrcoef(matrix[usable])
+        upper = np.triu_indices(len(names), k=1)
+        for i, j, r in zip(*upper, coefficients[upper]):
+            if abs(r) >= threshold:
+                pairs.append((names[i], names[j], float(r)))
+    pairs.sort(key=lambda pair: -abs(pair[2]))
+    return pairs[:limit]
+
+
+def _format_number(value: float) -> str:
+    return f'{value:.4g}'
+
+
+def _format_position(value) -> str:
+    if isinstance(value, float):
+        return datetime.fromtimestamp(value, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return f'#{value}'
+
+
+def render_findings(features_list: List[Dict], pairs: List[Tuple[str, str, float]]) -> str:
+    total = sum(features['points'] for features in features_list)
+    lines = [f'[指标预分析：{len(features_list)} 条序列，共 {total} 个点]']
+    for features in features_list:
+        if not features['points']:
+            lines.append(f"- {features['name']}：无有效数据")
+            continue
+        head = f"- {features['name']}（{features['points']} 点"
+        if 'start' in features:
+            head += f"，{_format_position(features['start'])} ~ {_format_position(features['end'])}"
+        parts = [
+            f"{head}）：均值 {_format_number(features['mean'])}，最新 {_format_number(features['last'])}，"
+            f"范围 {_format_number(features['min'])} ~ {_format_number(features['max'])}，"
+            f"p95 {_format_number(features['p95'])}"
+        ]
+        if 'zscore' in features:
+            z = features['zscore']
+            parts.append(f"z-score 异常 {z['count']} 点（最大 |z|={z['max']:.1f}，"
+                         f"值 {_format_number(z['value'])} @ {_format_position(z['at'])}）")
+        if 'mad' in features:
+            parts.append(f"MAD 异常 {features['mad']['count']} 点")
+        if 'change_point' in features:
+            change = features['change_point']
+            parts.append(f"变点 @ {_format_position(change['at'])}：均值 {_format_number(change['before'])} → "
+                         f"{_format_number(change['after'])}")
+        if 'max_rate' in features:
+            rate = features['max_rate']
+            parts.append(f"最大变化率 {rate['value']:+.4g}{rate['unit']} @ {_format_position(rate['at'])}")
+        if 'trend' in features:
+            parts.append(f"窗口内拟合趋势 {features['trend']:+.4g}")
+        lines.append('；'.join(parts))
+    if pairs:
+        lines.append('强相关：' + '；'.join(f'{a} ~ {b} r={r:+.2f}' for a, b, r in pairs))
+    return '\n'.join(lines)
+
+
+def summarize_metrics(data, z_threshold: float = 3.0, mad_threshold: float = 3.5,
+                      correlation_threshold: float = 0.8, max_points: int = 500000) -> str:
+    """将结构化指标序列转换为紧凑的异常特征文本；格式错误或点数超限时抛出 ValueError"""
+    series_list = parse_series(data)
+    if not series_list:
+        raise ValueError('no series found')
+    total = sum(len(series.values) for series in series_list)
+    if total > max_points:
+        raise ValueError(f'{total} points exceed the limit of {max_points}')
+    features_list = [analyze_series(series, z_threshold, mad_threshold) for series in series_list]
+    return render_findings(features_list, correlations(series_list, correlation_threshold))
@@ -0,0 +1,15 @@
+import os
+import time
+
+# Crockford Base32 字母表（不含 I、L、O、U）
+_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+
+def new_ulid() -> str:
+    """生成 26 位 ULID：48 位毫秒时间戳 + 80 位随机数，按字典序大致随时间递增，可在写入数据库前分配"""
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), 'big')
+    chars = []
+    for _ in range(26):
+        value, index = divmod(value, 32)
+        chars.append(_ALPHABET[index])
+    return ''.join(reversed(chars))
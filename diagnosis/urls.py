@@ -1,10 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import FaultCaseViewSet
+from .views import FaultCaseViewSet, analyze_async
 
 router = DefaultRouter()
 router.register(r'cases', FaultCaseViewSet)
 
 urlpatterns = [
+    # 原生异步诊断接口（ASGI），需放在路由器之前以免被 cases/{pk}/ 匹配
+    path('cases/analyze-async/', analyze_async, name='faultcase-analyze-async'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
@@ -0,0 +1,357 @@
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .metrics import stage_timer, timed
+
+logger = logging.getLogger(__name__)
+
+# 帧格式：定长头部 + JSON + 原始数组字节
+#   头部：魔数 b'VS'、协议版本、操作码（请求）或状态码（响应）、JSON 长度、数组字节长度（网络字节序）
+#   数组（向量、ID 列表）不经 JSON 编码，按 JSON 中的 dtype/shape 以小端原始字节传输
+HEADER = struct.Struct('!2sBBII')
+MAGIC = b'VS'
+VERSION = 1
+# 单帧上限，防止错误的长度字段导致巨量内存分配
+MAX_FRAME_BYTES = 512 * 1024 * 1024
+
+OPS = {
+    'ping': 0,
+    'encode': 1,
+    'search': 2,
+    'search_batch': 3,
+    'upsert': 4,
+    'delete': 5,
+    'indexed_ids': 6,
+    'get_watermark': 7,
+    'set_watermark': 8,
+    'stats': 9,
+    'clear_cache': 10,
+    'warm_up': 11,
+}
+OP_NAMES = {code: name for name, code in OPS.items()}
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+class VectorSidecarError(RuntimeError):
+    """边车进程返回的错误"""
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise EOFError('connection closed')
+        received += count
+    return buffer
+
+
+def write_frame(sock: socket.socket, code: int, payload: Dict, array: Optional[np.ndarray] = None) -> None:
+    if array is not None:
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+        payload = {**payload, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        blob = array.tobytes()
+    else:
+        blob = b''
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    sock.sendall(HEADER.pack(MAGIC, VERSION, code, len(body), len(blob)) + body + blob)
+
+
+def read_frame(sock: socket.socket) -> Tuple[int, Dict, Optional[np.ndarray]]:
+    magic, version, code, body_length, blob_length = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'unsupported frame (magic={bytes(magic)!r}, version={version})')
+    if body_length + blob_length > MAX_FRAME_BYTES:
+        raise ValueError(f'frame of {body_length + blob_length} bytes exceeds {MAX_FRAME_BYTES}')
+    payload = json.loads(_recv_exact(sock, body_length)) if body_length else {}
+    blob = _recv_exact(sock, blob_length) if blob_length else b''
+    array = None
+    if 'dtype' in payload:
+        array = np.frombuffer(blob, dtype=payload.pop('dtype')).reshape(payload.pop('shape'))
+    return code, payload, array
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def setup(self):
+        with self.server.connections_lock:
+            self.server.connections.add(self.request)
+
+    def finish(self):
+        with self.server.connections_lock:
+            self.server.connections.discard(self.request)
+
+    def handle(self):
+        # 每个连接按顺序处理多个请求，客户端复用连接
+        while True:
+            try:
+                code, payload, array = read_frame(self.request)
+            except (EOFError, ConnectionError):
+                return
+            except ValueError as e:
+                logger.error(f"Dropping sidecar connection: {str(e)}")
+                return
+            try:
+                payload, array = self.server.dispatch(OP_NAMES.get(code), payload, array)
+                code = STATUS_OK
+            except Exception as e:
+                logger.error(f"Vector sidecar request {OP_NAMES.get(code, code)} failed: {str(e)}")
+                code, payload, array = STATUS_ERROR, {'error': f'{type(e).__name__}: {str(e)}'}, None
+            try:
+                write_frame(self.request, code, payload, array)
+            except (BrokenPipeError, ConnectionError):
+                return
+
+
+class VectorSidecarServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """向量服务边车：独占句向量模型与向量索引，通过 Unix 域套接字为各 worker 提供编码、检索与写入
+
+    每个连接一个线程；不同 worker 的并发单条编码在 VectorDBService 的微批处理器中合并为一次前向计算，
+    向量库只由本进程写入。
+    """
+
+    daemon_threads = True
+    # 默认 backlog 为 5，大量 worker 同时建立连接时 Unix 域套接字的 connect 会直接失败（EAGAIN）
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, path: str, service):
+        self.path = path
+        self.service = service
+        self.connections: Set[socket.socket] = set()
+        self.connections_lock = threading.Lock()
+        self._remove_stale_socket()
+        super().__init__(path, _Handler)
+        # 仅允许同一用户/用户组的进程连接
+        os.chmod(path, 0o660)
+
+    def _remove_stale_socket(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f'Another vector sidecar is listening on {self.path}')
+
+    def server_close(self):
+        super().server_close()
+        # 断开已建立的连接，客户端随后重连到新的边车进程
+        with self.connections_lock:
+            for sock in self.connections:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def dispatch(self, op: Optional[str], payload: Dict, array) -> Tuple[Dict, Optional[np.ndarray]]:
+        service = self.service
+        if op == 'ping':
+            return {'pid': os.getpid(), 'embedding_key': service.embedding_key}, None
+        if op == 'encode':
+            texts = payload['texts']
+            # 单条编码走微批处理器，与其他 worker 的并发请求合并
+            vectors = [service.embed_query(texts[0])] if len(texts) == 1 else service.embed_queries(texts)
+            return {}, np.asarray(vectors, dtype=np.float32)
+        if op == 'search':
+            return {'results': service.search_knowledge(payload['query'], payload['top_k'],
+                                                        payload.get('categories'))}, None
+        if op == 'search_batch':
+            return {'results': service.search_knowledge_batch(payload['queries'], payload['top_k'],
+                                                              payload.get('categories'))}, None
+        if op == 'upsert':
+            return {'count': service.upsert_knowledge_batch(payload['knowledge'])}, None
+        if op == 'delete':
+            return {'count': service.delete_knowledge_batch(payload['ids'])}, None
+        if op == 'indexed_ids':
+            return {}, np.asarray(sorted(service.get_indexed_ids()), dtype=np.int64)
+        if op == 'get_watermark':
+            return {'watermark': service.get_sync_watermark()}, None
+        if op == 'set_watermark':
+            service.set_sync_watermark(payload['watermark'])
+            return {}, None
+        if op == 'stats':
+            return {'embedding_cache': service.embedding_cache.stats(),
+                    'category_routing': service.router.stats()}, None
+        if op == 'clear_cache':
+            service.embedding_cache.clear()
+            return {}, None
+        if op == 'warm_up':
+            return {'timings': service.warm_up()}, None
+        raise ValueError(f'unknown operation {op}')
+
+
+class _RemoteStats:
+    """客户端上的 embedding_cache / router 替身，统计数据来自边车进程"""
+
+    def __init__(self, client: 'VectorSidecarClient', key: str):
+        self.client = client
+        self.key = key
+
+    def stats(self) -> Dict:
+        return self.client.call('stats')[0][self.key]
+
+    def clear(self) -> None:
+        self.client.call('clear_cache')
+
+
+class VectorSidecarClient:
+    """通过 Unix 域套接字调用向量服务边车，接口与 VectorDBService 一致
+
+    空闲连接放回连接池复用；连接断开（边车重启）时换新连接重试一次，所有操作均可安全重试。
+    检索失败时与 VectorDBService 一样返回空结果，其余操作抛出异常。
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0, pool_size: int = 8):
+        self.path = path
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=max(1, pool_size))
+        self.embedding_cache = _RemoteStats(self, 'embedding_cache')
+        self.router = _RemoteStats(self, 'category_routing')
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _acquire(self) -> Tuple[socket.socket, bool]:
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _release(self, sock: socket.socket) -> None:
+        try:
+            self._idle.put_nowait(sock)
+        except queue.Full:
+            sock.close()
+
+    def call(self, op: str, payload: Optional[Dict] = None,
+             array: Optional[np.ndarray] = None) -> Tuple[Dict, Optional[np.ndarray]]:
+        """发送一个请求并等待响应"""
+        with stage_timer(f'vector_sidecar.{op}'):
+            for attempt in range(2):
+                sock, reused = self._acquire()
+                try:
+                    write_frame(sock, OPS[op], payload or {}, array)
+                    status, response, result = read_frame(sock)
+                except (EOFError, ConnectionError) as e:
+                    sock.close()
+                    # 复用的连接可能已被边车关闭（例如边车重启），此时池中其他空闲连接同样失效，清空后换新连接重试一次
+                    if reused and attempt == 0:
+                        self.close()
+                        continue
+                    raise ConnectionError(f'Vector sidecar at {self.path} unavailable: {str(e)}')
+                except BaseException:
+                    sock.close()
+                    raise
+                self._release(sock)
+                if status != STATUS_OK:
+                    raise VectorSidecarError(response.get('error', 'unknown error'))
+                return response, result
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def warm_up(self) -> Dict[str, float]:
+        """在边车中预热；边车尚未启动时只记录警告，不阻止 worker 启动"""
+        try:
+            return self.call('warm_up')[0]['timings']
+        except OSError as e:
+            logger.warning(f"Vector sidecar warm-up skipped: {str(e)}")
+            return {}
+
+    @timed('vector_db.embed')
+    def embed_query(self, text: str) -> List[float]:
+        return self.call('encode', {'texts': [text]})[1][0].tolist()
+
+    @timed('vector_db.embed_queries')
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.call('encode', {'texts': list(texts)})[1].tolist()
+
+    @timed('vector_db.search_knowledge')
+    def search_knowledge(self, query: str, top_k: int = 3, categories: Optional[List[str]] = None) -> List[Dict]:
+        try:
+            return self.call('search', {'query': query, 'top_k': top_k, 'categories': categories})[0]['results']
+        except Exception as e:
+            logger.error(f"Failed to search knowledge through sidecar: {str(e)}")
+            return []
+
+    @timed('vector_db.search_knowledge_batch')
+    def search_knowledge_batch(self, queries: List[str], top_k: int = 3,
+                               categories: Optional[List[str]] = None) -> List[List[Dict]]:
+        if not queries:
+            return []
+        try:
+            return self.call('search_batch', {'queries': list(queries), 'top_k': top_k,
+                                              'categories': categories})[0]['results']
+        except Exception as e:
+            logger.error(f"Failed to search knowledge batch through sidecar: {str(e)}")
+            return [[] for _ in queries]
+
+    @timed('vector_db.upsert_knowledge_batch')
+    def upsert_knowledge_batch(self, knowledge_list: List[Dict]) -> int:
+        if not knowledge_list:
+            return 0
+        return self.call('upsert', {'knowledge': knowledge_list})[0]['count']
+
+    @timed('vector_db.delete_knowledge_batch')
+    def delete_knowledge_batch(self, knowledge_ids: Iterable[int]) -> int:
+        ids = [int(knowledge_id) for knowledge_id in knowledge_ids]
+        if not ids:
+            return 0
+        return self.call('delete', {'ids': ids})[0]['count']
+
+    def add_knowledge(self, knowledge_data: Dict) -> bool:
+        try:
+            return self.upsert_knowledge_batch([knowledge_data]) == 1
+        except Exception as e:
+            logger.error(f"Failed to add knowledge through sidecar: {str(e)}")
+            return False
+
+    update_knowledge = add_knowledge
+
+    def delete_knowledge(self, knowledge_id: int) -> bool:
+        try:
+            return self.delete_knowledge_batch([knowledge_id]) == 1
+        except Exception as e:
+            logger.error(f"Failed to delete knowledge through sidecar: {str(e)}")
+            return False
+
+    @timed('vector_db.get_indexed_ids')
+    def get_indexed_ids(self) -> Set[int]:
+        ids = self.call('indexed_ids')[1]
+        return set(ids.tolist()) if ids is not None else set()
+
+    def get_sync_watermark(self) -> Optional[str]:
+        return self.call('get_watermark')[0]['watermark']
+
+    def set_sync_watermark(self, watermark: Optional[str]) -> None:
+        self.call('set_watermark', {'watermark': watermark})
@@ -0,0 +1,541 @@
+import base64
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class NumpyVectorStore:
+    """进程内精确向量检索，接口与 VectorDBService 用到的 Chroma Collection 方法一致
+
+    - 归一化后的向量保存在一个连续矩阵中（float32、float16 或带逐向量缩放系数的 int8），
+      通过内存映射从磁盘加载，多个 worker 进程共享同一份页缓存
+    - 量化存储时可另存一份全精度向量（rescore_factor > 0），检索先用量化矩阵取出
+      top_k × rescore_factor 个候选，再按全精度向量重新打分，全精度文件只读取候选行
+    - 余弦 top-k：一次矩阵-向量乘法 + argpartition；多查询：一次矩阵-矩阵乘法
+    - 按分类过滤使用预先计算的行掩码
+    - 元数据常驻内存，变更以追加日志（records.jsonl）的形式持久化，日志过长时压缩；
+      其他进程写入的变更在下次访问时从日志尾部增量加载
+    - 写入在文件锁（write.lock）下串行执行：先追加带向量的意图记录，再修改向量文件，最后追加提交标记；
+      只回放已提交的记录组，写入者中途退出时由下一个访问者按意图记录重做
+    - 读取（count/get/query）持有同一文件的共享锁，写入期间等待写入完成
+    """
+
+    # float16/int8 矩阵分块（块大小适配 CPU 缓存）转换为 float32 后再做乘法，numpy 的低精度乘法没有 BLAS 加速
+    block_rows = 4096
+    # 过滤后行数低于该比例时只对选中的行做乘法
+    gather_ratio = 0.25
+
+    def __init__(self, path: str, dtype: str = 'float32', rescore_factor: int = 0):
+        if dtype not in ('float32', 'float16', 'int8'):
+            raise ValueError(f'Unsupported vector store dtype: {dtype}')
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.rescore_factor = rescore_factor
+        self.full_precision = self.dtype != np.float32 and rescore_factor > 0
+        self.state_path = os.path.join(path, 'state.json')
+        self.log_path = os.path.join(path, 'records.jsonl')
+        self.lock_path = os.path.join(path, 'write.lock')
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+        self._shared = False
+        os.makedirs(path, exist_ok=True)
+        self._reset()
+        self._load()
+
+    # ---- 持久化 ----
+
+    def _reset(self) -> None:
+        self.dim: Optional[int] = None
+        self.capacity = 0
+        self._count = 0
+        self._matrix: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None  # int8 存储的逐向量缩放系数
+        self._full: Optional[np.memmap] = None  # 用于重新打分的全精度向量
+        self._row_ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[Dict]] = []
+        self._category_masks: Dict[str, np.ndarray] = {}
+        self._log_offset = 0
+        self._log_inode = None
+        self._log_records = 0
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.path, f'vectors.{self.dtype.name}')
+
+    def _load(self) -> None:
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        if state['dtype'] != self.dtype.name or state.get('full_precision', False) != self.full_precision:
+            raise ValueError(
+                f"Vector store at {self.path} was built with dtype={state['dtype']}, "
+                f"full_precision={state.get('full_precision', False)}; remove it and run sync_vector_db --full"
+            )
+        self.dim = state['dim']
+        self._replay()
+
+    @staticmethod
+    def _map(path: str, dtype, shape) -> np.memmap:
+        """映射文件，文件不足时补零扩展（已有的内容保持不变）"""
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode='r+', shape=shape)
+
+    def _open_matrix(self, capacity: int) -> None:
+        self._matrix = self._map(self.vectors_path, self.dtype, (capacity, self.dim))
+        if self.dtype == np.int8:
+            self._scales = self._map(os.path.join(self.path, 'scales.float32'), np.float32, (capacity,))
+        if self.full_precision:
+            self._full = self._map(os.path.join(self.path, 'vectors.full.float32'), np.float32, (capacity, self.dim))
+        self.capacity = capacity
+        for category, mask in self._category_masks.items():
+            self._category_masks[category] = np.resize(mask, capacity)
+            self._category_masks[category][len(mask):] = False
+
+    def _apply_log(self) -> List[Dict]:
+        """从上次读取的位置继续回放已提交的记录组，返回末尾尚未提交的记录"""
+        try:
+            with open(self.log_path, 'rb') as f:
+                self._log_inode = os.fstat(f.fileno()).st_ino
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        end = data.rfind(b'\n') + 1  # 只回放完整写入的行
+        pending = []
+        committed = 0
+        position = 0
+        for line in data[:end].split(b'\n'):
+            position += len(line) + 1
+            if not line:
+                continue
+            record = json.loads(line)
+            if record['op'] != 'commit':
+                pending.append(record)
+                continue
+            for committed_record in pending:
+                self._apply(committed_record)
+            self._log_records += len(pending) + 1
+            pending = []
+            committed = position
+        self._log_offset += committed
+        return pending
+
+    def _replay(self) -> None:
+        """回放日志；末尾有未提交的记录且没有其他写入者持有锁时，说明上次写入中途退出，按意图记录恢复"""
+        if not self._apply_log() or not self._acquire(blocking=False):
+            return
+        try:
+            # 拿到锁后重新读取，等锁期间写入者可能已经提交
+            pending = self._apply_log()
+            if pending:
+                for record in pending:
+                    self._apply(record)
+                    self._redo(record)
+                self._flush()
+                self._commit()
+                logger.warning(f"Recovered {len(pending)} uncommitted records in vector store at {self.path}")
+        finally:
+            self._release()
+
+    def _apply(self, record: Dict) -> None:
+        """把一条日志记录应用到内存状态（不修改向量文件）"""
+        op = record['op']
+        if op == 'resize':
+            self._open_matrix(record['capacity'])
+        elif op == 'put':
+            self._set_row(record['row'], record['id'], record['document'], record['metadata'])
+        elif op == 'pop':
+            self._pop_row(record['id'])
+
+    def _redo(self, record: Dict) -> None:
+        """按意图记录修改向量文件；重复执行结果相同（压缩后的快照记录不带向量，无需重做）"""
+        if record['op'] == 'put' and 'vector' in record:
+            self._write_row(record['row'], np.frombuffer(base64.b64decode(record['vector']), dtype='<f4'))
+        elif record['op'] == 'pop' and 'row' in record and record['row'] != record['last']:
+            # 最后一行在同一组后续操作中不会被覆盖，重复移动是安全的
+            self._move_row(record['row'], record['last'])
+
+    def _refresh(self) -> None:
+        """其他进程写入或压缩了日志时同步内存状态"""
+        try:
+            stat = os.stat(self.log_path)
+        except OSError:
+            return
+        if stat.st_ino != self._log_inode or stat.st_size < self._log_offset:
+            self._reset()
+            self._load()
+        elif stat.st_size > self._log_offset:
+            if self.dim is None:
+                self._load()
+            else:
+                self._replay()
+
+    def _lock_fd(self) -> int:
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a+b')
+        return self._lock_file.fileno()
+
+    def _acquire(self, blocking: bool = True) -> bool:
+        """获取跨进程写锁（同一实例可重入）；非阻塞模式下锁被占用时返回 False
+
+        持有读锁时（读取过程中发现需要恢复）会把共享锁转换为排他锁，释放时再转换回共享锁。
+        """
+        if self._lock_depth == 0:
+            try:
+                fcntl.flock(self._lock_fd(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                if self._shared:
+                    # flock 转换锁不是原子操作，失败时原来的共享锁可能已被释放
+                    fcntl.flock(self._lock_fd(), fcntl.LOCK_SH)
+                return False
+        self._lock_depth += 1
+        return True
+
+    def _release(self) -> None:
+        self._lock_depth -= 1
+        if self._lock_depth == 0:
+            fcntl.flock(self._lock_fd(), fcntl.LOCK_SH if self._shared else fcntl.LOCK_UN)
+
+    @contextmanager
+    def _read_lock(self):
+        """刷新 → 读取期间持有的共享锁：写入者移动行、修改向量文件期间读者等待，
+        不会把一行的向量与另一行的元数据配对；多个读者之间互不阻塞"""
+        with self._lock:
+            if self._lock_depth or self._shared:
+                yield
+                return
+            fcntl.flock(self._lock_fd(), fcntl.LOCK_SH)
+            self._shared = True
+            try:
+                yield
+            finally:
+                self._shared = False
+                fcntl.flock(self._lock_fd(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def _write_lock(self):
+        """刷新 → 写向量 → 追加日志期间持有的写锁，多个 worker、sync_vector_db 与导入命令写同一目录时串行执行"""
+        with self._lock:
+            self._acquire()
+            try:
+                yield
+            finally:
+                self._release()
+
+    def _append_log(self, records: List[Dict]) -> int:
+        with open(self.log_path, 'ab') as f:
+            self._log_inode = os.fstat(f.fileno()).st_ino
+            f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            end = f.tell()
+        self._log_records += len(records)
+        return end
+
+    def _commit(self) -> None:
+        """追加提交标记，之后其他进程才会回放这一组记录"""
+        self._log_offset = self._append_log([{'op': 'commit'}])
+        # 日志中的记录远多于现存条目时重写为快照
+        if self._log_records > 2 * self._count + 1000:
+            self._compact()
+
+    def _write(self, records: List[Dict]) -> None:
+        """已应用到内存的记录先作为意图写入日志，再修改向量文件并提交；失败时从日志重新加载并恢复"""
+        self._append_log(records)
+        try:
+            for record in records:
+                self._redo(record)
+            self._flush()
+            self._commit()
+        except Exception:
+            self._reset()
+            self._load()
+            raise
+
+    def _compact(self) -> None:
+        records = [{'op': 'resize', 'capacity': self.capacity}] + [
+            {'op': 'put', 'row': row, 'id': self._row_ids[row],
+             'document': self._documents[row], 'metadata': self._metadatas[row]}
+            for row in range(self._count)
+        ] + [{'op': 'commit'}]
+        tmp_path = f'{self.log_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            offset = f.tell()
+        os.replace(tmp_path, self.log_path)
+        self._log_inode = os.stat(self.log_path).st_ino
+        self._log_offset = offset
+        self._log_records = len(records)
+        logger.info(f"Compacted vector store log at {self.path} to {self._count} entries")
+
+    def _write_state(self) -> None:
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'dtype': self.dtype.name, 'full_precision': self.full_precision}, f)
+        os.replace(tmp_path, self.state_path)
+
+    # ---- 行管理 ----
+
+    def _set_row(self, row: int, record_id: str, document: Optional[str], metadata: Optional[Dict]) -> None:
+        if row == self._count:
+            self._row_ids.append(record_id)
+            self._documents.append(document)
+            self._metadatas.append(metadata)
+            self._count += 1
+        else:
+            old = self._metadatas[row]
+            if old is not None and old.get('category') in self._category_masks:
+                self._category_masks[old['category']][row] = False
+            self._row_ids[row] = record_id
+            self._documents[row] = document
+            self._metadatas[row] = metadata
+        self._rows[record_id] = row
+        category = (metadata or {}).get('category')
+        if category is not None:
+            mask = self._category_masks.get(category)
+            if mask is None:
+                mask = self._category_masks[category] = np.zeros(self.capacity, dtype=bool)
+            mask[row] = True
+
+    def _pop_row(self, record_id: str) -> None:
+        """删除一行：最后一行移到被删除的位置，保持矩阵前 count 行连续（向量由调用方移动）"""
+        row = self._rows.pop(record_id)
+        last = self._count - 1
+        for mask in self._category_masks.values():
+            mask[row] = mask[last]
+            mask[last] = False
+        if row != last:
+            self._row_ids[row] = self._row_ids[last]
+            self._documents[row] = self._documents[last]
+            self._metadatas[row] = self._metadatas[last]
+            self._rows[self._row_ids[row]] = row
+        self._row_ids.pop()
+        self._documents.pop()
+        self._metadatas.pop()
+        self._count -= 1
+
+    def _write_row(self, row: int, vector: np.ndarray) -> None:
+        if self.dtype == np.int8:
+            # 对称标量量化，每个向量单独保存缩放系数
+            scale = float(np.abs(vector).max()) / 127 or 1.0
+            self._matrix[row] = np.round(vector / scale).astype(np.int8)
+            self._scales[row] = scale
+        else:
+            self._matrix[row] = vector
+        if self._full is not None:
+            self._full[row] = vector
+
+    def _move_row(self, dst: int, src: int) -> None:
+        for array in (self._matrix, self._scales, self._full):
+            if array is not None:
+                array[dst] = array[src]
+
+    def _flush(self) -> None:
+        for array in (self._matrix, self._scales, self._full):
+            if array is not None:
+                array.flush()
+
+    def _decode(self, rows) -> np.ndarray:
+        """返回指定行的 float32 向量（量化存储且没有全精度副本时为反量化结果）"""
+        if self._full is not None:
+            return np.asarray(self._full[rows])
+        vectors = np.asarray(self._matrix[rows], dtype=np.float32)
+        if self._scales is not None:
+            vectors *= np.asarray(self._scales[rows])[:, None]
+        return vectors
+
+    def memory_usage(self) -> Dict[str, int]:
+        """检索矩阵（含缩放系数）常驻内存的字节数、全精度副本字节数与磁盘文件总大小"""
+        with self._lock:
+            index_bytes = self._count * (self.dim or 0) * self.dtype.itemsize
+            if self._scales is not None:
+                index_bytes += self._count * 4
+            rescore_bytes = self._count * (self.dim or 0) * 4 if self._full is not None else 0
+        disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+        return {'entries': self._count, 'index_bytes': index_bytes, 'rescore_bytes': rescore_bytes,
+                'disk_bytes': disk_bytes}
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    # ---- Collection 接口 ----
+
+    def upsert(self, ids: Sequence[str], embeddings, documents: Optional[Sequence[str]] = None,
+               metadatas: Optional[Sequence[Dict]] = None) -> None:
+        vectors = self._normalize(embeddings)
+        if len(vectors) != len(ids):
+            raise ValueError('ids and embeddings must have the same length')
+        with self._write_lock():
+            self._refresh()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._write_state()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f'Embedding dimension {vectors.shape[1]} does not match store dimension {self.dim}')
+
+            # 同一批内重复的 ID 以最后一次为准
+            latest = {str(record_id): index for index, record_id in enumerate(ids)}
+            new_ids = [record_id for record_id in latest if record_id not in self._rows]
+            records = []
+            needed = self._count + len(new_ids)
+            if needed > self.capacity:
+                records.append({'op': 'resize', 'capacity': max(1024, self.capacity * 2, needed)})
+                self._apply(records[-1])
+
+            for record_id, index in latest.items():
+                records.append({
+                    'op': 'put', 'row': self._rows.get(record_id, self._count), 'id': record_id,
+                    'document': documents[index] if documents is not None else None,
+                    'metadata': metadatas[index] if metadatas is not None else None,
+                    'vector': base64.b64encode(vectors[index].astype('<f4').tobytes()).decode('ascii'),
+                })
+                self._apply(records[-1])
+            self._write(records)
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._write_lock():
+            self._refresh()
+            records = []
+            for record_id in dict.fromkeys(str(i) for i in ids):
+                row = self._rows.get(record_id)
+                if row is None:
+                    continue
+                records.append({'op': 'pop', 'id': record_id, 'row': row, 'last': self._count - 1})
+                self._apply(records[-1])
+            if records:
+                self._write(records)
+
+    def count(self) -> int:
+        with self._read_lock():
+            self._refresh()
+            return self._count
+
+    def get(self, ids: Optional[Sequence[str]] = None, include: Sequence[str] = ('metadatas', 'documents'),
+            limit: Optional[int] = None, offset: int = 0) -> Dict:
+        with self._read_lock():
+            self._refresh()
+            if ids is not None:
+                rows = [self._rows[str(i)] for i in ids if str(i) in self._rows]
+            else:
+                end = self._count if limit is None else min(self._count, offset + limit)
+                rows = list(range(offset, end))
+            result = {'ids': [self._row_ids[row] for row in rows]}
+            if 'metadatas' in include:
+                result['metadatas'] = [self._metadatas[row] for row in rows]
+            if 'documents' in include:
+                result['documents'] = [self._documents[row] for row in rows]
+            if 'embeddings' in include:
+                result['embeddings'] = self._decode(rows).tolist()
+            return result
+
+    def _mask(self, where: Optional[Dict]) -> Optional[np.ndarray]:
+        """将 {'category': 名称} 或 {'category': {'$in': [...]}} 转换为行掩码"""
+        if not where:
+            return None
+        unsupported = set(where) - {'category'}
+        if unsupported:
+            raise ValueError(f'Unsupported filter fields: {sorted(unsupported)}')
+        condition = where['category']
+        categories = condition.get('$in', []) if isinstance(condition, dict) else [condition]
+        mask = np.zeros(self._count, dtype=bool)
+        for category in categories:
+            category_mask = self._category_masks.get(category)
+            if category_mask is not None:
+                mask |= category_mask[:self._count]
+        return mask
+
+    def _scores(self, queries: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """返回 (行数, 查询数) 的余弦相似度矩阵（量化存储时为近似值）"""
+        selector = slice(0, self._count) if rows is None else rows
+        matrix = self._matrix[selector]
+        if self.dtype == np.float32:
+            return matrix @ queries.T
+        scores = np.empty((len(matrix), len(queries)), dtype=np.float32)
+        for start in range(0, len(matrix), self.block_rows):
+            block = matrix[start:start + self.block_rows]
+            scores[start:start + len(block)] = block.astype(np.float32) @ queries.T
+        if self._scales is not None:
+            scores *= np.asarray(self._scales[selector])[:, None]
+        return scores
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict] = None,
+              include: Sequence[str] = ('metadatas', 'documents', 'distances')) -> Dict:
+        queries = self._normalize(query_embeddings)
+        with self._read_lock():
+            self._refresh()
+            result = {'ids': [], 'distances': [], 'metadatas': [], 'documents': []}
+            mask = self._mask(where) if self._count else None
+            selected = int(mask.sum()) if mask is not None else self._count
+            top_k = min(n_results, selected)
+            if top_k <= 0:
+                for key in result:
+                    result[key] = [[] for _ in queries]
+                return result
+
+            rows = None
+            if mask is not None and selected < self.gather_ratio * self._count:
+                rows = np.flatnonzero(mask)
+                scores = self._scores(queries, rows)
+            else:
+                scores = self._scores(queries, None)
+                if mask is not None:
+                    scores[~mask] = -np.inf
+
+            # 有全精度副本时多取候选，重新打分后再截取 top_k
+            pool = min(top_k * self.rescore_factor, selected) if self._full is not None else top_k
+            if pool < len(scores):
+                candidates = np.argpartition(-scores, pool - 1, axis=0)[:pool]
+            else:
+                candidates = np.broadcast_to(np.arange(len(scores))[:, None], scores.shape)
+            for column in range(len(queries)):
+                column_candidates = candidates[:, column]
+                if mask is not None and rows is None:
+                    column_candidates = column_candidates[mask[column_candidates]]
+                candidate_rows = rows[column_candidates] if rows is not None else column_candidates
+                if self._full is not None or self.dtype == np.float32:
+                    # 候选行按行号顺序（减少内存映射文件的随机访问）用 float32 向量重新打分：float32 存储与
+                    # 量化存储 + 全精度重打分对同一候选算出的分数完全相同，分数相同时都按行号排序，
+                    # 不会因为矩阵乘法的累加顺序不同而在近似并列的结果之间给出不同的 top_k
+                    candidate_rows = np.sort(candidate_rows)
+                    vectors = self._full if self._full is not None else self._matrix
+                    column_scores = np.asarray(vectors[candidate_rows]) @ queries[column]
+                else:
+                    column_scores = scores[column_candidates, column]
+                order = np.argsort(-column_scores, kind='stable')[:top_k]
+                matched_rows = candidate_rows[order]
+                result['ids'].append([self._row_ids[row] for row in matched_rows])
+                result['distances'].append([float(1 - column_scores[i]) for i in order])
+                result['metadatas'].append([self._metadatas[row] for row in matched_rows])
+                result['documents'].append([self._documents[row] for row in matched_rows])
+            return result
+
+
+def create_vector_store(backend: str, persist_directory: str, collection_name: str, **options):
+    """按配置创建进程内向量存储；chroma 后端由 VectorDBService 自行初始化"""
+    if backend == 'numpy':
+        return NumpyVectorStore(os.path.join(persist_directory, f'{collection_name}_numpy'),
+                                dtype=options.get('dtype', 'float32'),
+                                rescore_factor=options.get('rescore_factor', 0))
+    raise ValueError(f'Unknown vector store backend: {backend}')
@@ -1,20 +1,28 @@
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
+from django.db.models.functions import Substr
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from django.conf import settings
-from dashscope import Generation
 import logging
 import json
 import traceback
 import re
 from .models import FaultCase
-from .serializers import FaultCaseSerializer
+from .serializers import HEAVY_FIELDS, FaultCaseListSerializer, FaultCaseSerializer
+from .pagination import FaultCaseCursorPagination
 from knowledge_base.models import FaultCategory, FaultKnowledge
 import os
-import dashscope
-from .services import VectorDBService
+from .services import get_vector_db, normalize_categories
+from .pipeline import REFERENCE_SCORE_THRESHOLD, DiagnosisError, get_pipeline
+from .diagnosis_cache import get_diagnosis_cache
+from .metrics import registry, should_log_payload
+from .streaming import sse_event
+from .coalescing import get_coalescer, input_fingerprint
 
 logger = logging.getLogger(__name__)
 
@@ -32,44 +40,62 @@ class FaultCaseViewSet(viewsets.ModelViewSet):
     queryset = FaultCase.objects.all()
     serializer_class = FaultCaseSerializer
     permission_classes = [AllowAny]
-    vector_db = VectorDBService()
+    pagination_class = FaultCaseCursorPagination
 
-    def clean_json_string(self, json_str):
-        """清理JSON字符串，移除控制字符和多余空白"""
-        if not json_str:
-            return None
-            
-        # 移除 Markdown 代码块标记
-        json_str = json_str.replace('```json', '').replace('```', '')
-        
-        # 查找第一个 { 和最后一个 } 之间的内容
-        start = json_str.find('{')
-        end = json_str.rfind('}') + 1
-        if start >= 0 and end > start:
-            json_str = json_str[start:end]
-        else:
-            logger.error(f"Could not find JSON in response: {json_str}")
-            return None
-        
-        # 移除所有控制字符
-        json_str = ''.join(char for char in json_str if ord(char) >= 32)
-        
-        # 替换换行符为空格
-        json_str = json_str.replace('\n', ' ')
-        
-        # 替换多个空格为单个空格
-        json_str = re.sub(r'\s+', ' ', json_str)
-        
-        # 移除开头和结尾的空白字符
-        json_str = json_str.strip()
-        
-        return json_str
+    def included_fields(self):
+        """列表请求通过 ?include=alert_info,log_info 要求返回的大字段"""
+        include = self.request.query_params.get('include', '')
+        return [name for name in (part.strip() for part in include.split(',')) if name in HEAVY_FIELDS]
+
+    def get_queryset(self):
+        if self.action != 'list':
+            return FaultCase.objects.select_related('category', 'matched_knowledge__category')
+
+        # 列表只读取精简表示需要的列，告警信息在数据库中截取为摘要
+        queryset = FaultCase.objects.select_related('category', 'matched_knowledge').only(
+            'id', 'uid', 'created_at', 'updated_at', 'category__name', 'matched_knowledge__title',
+            *self.included_fields()
+        ).annotate(alert_preview=Substr('alert_info', 1, settings.FAULT_CASE_PREVIEW_LENGTH))
+        category_id = self.request.query_params.get('category_id')
+        if category_id is not None:
+            queryset = queryset.filter(category_id=category_id)
+        matched_knowledge_id = self.request.query_params.get('matched_knowledge_id')
+        if matched_knowledge_id is not None:
+            queryset = queryset.filter(matched_knowledge_id=matched_knowledge_id)
+        return queryset
+
+    def get_object(self):
+        """详情接口同时支持数据库 ID 和 ULID（后台批量写入时响应中只有 uid）"""
+        lookup = self.kwargs.get(self.lookup_field, '')
+        if len(lookup) == 26 and not lookup.isdigit():
+            case = get_object_or_404(self.get_queryset(), uid=lookup.upper())
+            self.check_object_permissions(self.request, case)
+            return case
+        return super().get_object()
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return FaultCaseListSerializer
+        return FaultCaseSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'list':
+            context['include'] = self.included_fields()
+        return context
+
+    @property
+    def vector_db(self):
+        """进程内共享的向量库服务，首次使用时才加载模型和 Chroma"""
+        return get_vector_db()
 
     def find_matching_knowledge(self, category_name, alert_info):
-        """使用向量数据库查找匹配的知识条目"""
+        """使用向量数据库在指定分类（为空时不限分类）中查找匹配的知识条目"""
         try:
-            # 使用向量数据库搜索相似的知识条目
-            matched_knowledge_list = self.vector_db.search_knowledge(alert_info, top_k=1)
+            # 使用向量数据库搜索相似的知识条目，分类过滤在索引内部执行
+            matched_knowledge_list = self.vector_db.search_knowledge(
+                alert_info, top_k=1, categories=normalize_categories(category_name)
+            )
             
             if not matched_knowledge_list:
                 logger.info("No matching knowledge found in vector database")
@@ -79,26 +105,43 @@ class FaultCaseViewSet(viewsets.ModelViewSet):
             matched_knowledge = matched_knowledge_list[0]
             logger.info(f"Found matching knowledge: {matched_knowledge['title']} with score: {matched_knowledge['score']}")
 
-            # 如果相似度分数太低，认为没有匹配的知识
-            if matched_knowledge['score'] > 0.8:  # 可以根据实际情况调整阈值
+            # 如果相似度分数（百分比）不高于诊断流程使用的阈值，认为没有匹配的知识
+            if matched_knowledge['score'] <= REFERENCE_SCORE_THRESHOLD:
                 logger.info("Similarity score too low, no matching knowledge")
                 return None
 
             # 返回匹配的知识条目
-            return FaultKnowledge.objects.get(id=matched_knowledge['id'])
+            return FaultKnowledge.objects.select_related('category').get(id=matched_knowledge['id'])
         except Exception as e:
             logger.error(f"Error finding matching knowledge: {str(e)}")
             return None
 
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """诊断链路各缓存的命中统计"""
+        return Response({
+            'embedding_cache': self.vector_db.embedding_cache.stats(),
+            'diagnosis_cache': get_diagnosis_cache().stats(),
+            'alert_coalescing': get_coalescer().stats(),
+            'category_routing': self.vector_db.router.stats(),
+        })
+
     @action(detail=False, methods=['post'])
     def analyze(self, request):
         try:
-            logger.info("Received request data: %s", request.data)
+            if should_log_payload():
+                logger.info("Received request data: %s", request.data)
             
             # 获取请求数据
             alert_info = request.data.get('alert_info', '')
             metrics_info = request.data.get('metrics_info', '')
             log_info = request.data.get('log_info', '')
+            # 可选：只在这些知识分类内检索参考案例
+            categories = normalize_categories(request.data.get('categories'))
+            # 可选：日志压缩后是否另外保存原始日志，未指定时使用 LOG_REDUCTION_KEEP_RAW
+            keep_raw_log = request.data.get('keep_raw_log')
+            # 可选：结构化指标序列（JSON 或 CSV），只把提取出的异常特征写入提示词和诊断记录
+            metrics_series = request.data.get('metrics_series')
 
             # 验证必填字段
             if not alert_info:
@@ -107,173 +150,134 @@ class FaultCaseViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # 先从知识库中检索相关的知识条目
-            # 只使用告警信息进行检索，避免其他信息干扰
-            alert_relate_info = alert_info
-            matched_knowledge_list = self.vector_db.search_knowledge(alert_relate_info, top_k=3)
-            logger.info("Found %d matching knowledge entries", len(matched_knowledge_list))
-
-            # 构建提示词
-            prompt = f"""作为一个故障诊断专家，请分析以下故障信息，并提供诊断结果。
-请以JSON格式返回，包含以下字段：
-- category: 故障分类（请根据故障特征给出最合适的分类）
-- analysis: 分析结果
-- solution: 解决方案
-
-故障信息：
-告警信息：{alert_info}
-"""
-
-            # 如果有指标信息，添加到提示词中
-            if metrics_info:
-                prompt += f"指标信息：{metrics_info}\n"
-
-            # 如果有日志信息，添加到提示词中
-            if log_info:
-                prompt += f"日志信息：{log_info}\n"
-
-            # 如果有匹配的知识条目，添加到提示词中作为参考
-            if matched_knowledge_list:
-                prompt += "\n参考知识库中的相关案例：\n"
-                for knowledge in matched_knowledge_list:
-                    prompt += f"""
-案例标题：{knowledge['title']}
-故障分类：{knowledge['category']}
-症状描述：{knowledge['symptoms']}
-解决方案：{knowledge['solution']}
-相似度：{knowledge['score']:.2f}
----"""
-
-            prompt += "\n请基于以上信息，特别是参考知识库中的相关案例，给出准确的诊断结果。请确保返回的是合法的JSON格式。"
-
-            # 记录完整的 prompt
-            logger.info("Final prompt for LLM:\n%s", prompt)
-
-            # 检查API密钥
-            api_key = os.getenv('DASHSCOPE_API_KEY')
-            if not api_key:
-                logger.error("DASHSCOPE_API_KEY not set")
-                return Response(
-                    {'error': 'API密钥未配置'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-
-            # 设置API密钥
-            dashscope.api_key = api_key
-
-            # 调用API
-            try:
-                response = Generation.call(
-                    model='qwen-max',
-                    prompt=prompt,
-                    result_format='message',
-                    max_tokens=1500,
-                    temperature=0.7,
-                    top_p=0.8,
+            pipeline = get_pipeline()
+            if settings.ALERT_COALESCING_ENABLED:
+                # 告警风暴时同组告警只诊断一次
+                payload = get_coalescer().submit(
+                    alert_info, lambda: pipeline.run(
+                        alert_info, metrics_info, log_info, categories, keep_raw_log, metrics_series
+                    ),
+                    fingerprint=input_fingerprint(metrics_info, log_info, categories, metrics_series)
                 )
-                logger.info("API Response: %s", response)
-            except Exception as e:
-                logger.error("API call failed: %s", str(e))
-                return Response(
-                    {'error': f'API调用失败: {str(e)}'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            else:
+                payload = pipeline.run(
+                    alert_info, metrics_info, log_info, categories, keep_raw_log, metrics_series
                 )
+            return Response(payload)
 
-            if response.status_code != 200:
-                logger.error("API returned error: %s", response)
-                return Response(
-                    {'error': f'API返回错误: {response.message}'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
+        except DiagnosisError as e:
+            return Response({'error': e.message}, status=e.status_code)
+        except Exception as e:
+            logger.error("Unexpected error in analyze endpoint: %s", str(e))
+            logger.error("Traceback: %s", traceback.format_exc())
+            return Response(
+                {'error': f'服务器内部错误: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
 
-            # 获取API响应内容
-            try:
-                content = response.output.choices[0].message.content
-                logger.info("API Response content: %s", content)
-            except (AttributeError, IndexError) as e:
-                logger.error("Failed to get API response content: %s", str(e))
-                return Response(
-                    {'error': '无法获取API响应内容'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
+    @action(detail=False, methods=['post'], url_path='analyze-stream')
+    def analyze_stream(self, request):
+        """流式诊断，以 Server-Sent Events 返回参考案例、生成过程和最终结果"""
+        alert_info = request.data.get('alert_info', '')
+        metrics_info = request.data.get('metrics_info', '')
+        log_info = request.data.get('log_info', '')
+        categories = normalize_categories(request.data.get('categories'))
+        keep_raw_log = request.data.get('keep_raw_log')
+        metrics_series = request.data.get('metrics_series')
+
+        if not alert_info:
+            return Response(
+                {'error': '告警信息不能为空'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-            # 清理并解析JSON
-            try:
-                # 清理JSON字符串
-                cleaned_content = self.clean_json_string(content)
-                if not cleaned_content:
-                    logger.error("Cleaned content is empty")
-                    return Response(
-                        {'error': 'API返回内容为空'},
-                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                    )
-
-                # 尝试解析JSON
-                result = json.loads(cleaned_content)
-                logger.info("Parsed JSON result: %s", result)
-            except json.JSONDecodeError as e:
-                logger.error("JSON parsing error: %s", str(e))
-                logger.error("Failed content: %s", cleaned_content)
+        events = get_pipeline().run_stream(
+            alert_info, metrics_info, log_info, categories, keep_raw_log, metrics_series
+        )
+        response = StreamingHttpResponse(
+            (sse_event(event, data) for event, data in events),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # 禁止 nginx 等反向代理缓冲，保证事件即时送达
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='analyze-batch')
+    def analyze_batch(self, request):
+        """批量诊断，请求体为 {"alerts": [{"alert_info": ..., "metrics_info": ..., "log_info": ...}, ...]}"""
+        try:
+            alerts = request.data.get('alerts') if isinstance(request.data, dict) else request.data
+            if not isinstance(alerts, list) or not alerts:
                 return Response(
-                    {'error': f'JSON解析错误: {str(e)}'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    {'error': 'alerts 必须是非空列表'},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-
-            # 验证返回的JSON格式
-            required_fields = ['category', 'analysis', 'solution']
-            if not all(field in result for field in required_fields):
-                logger.error("Missing required fields in JSON response")
+            if len(alerts) > settings.DIAGNOSIS_BATCH_MAX_ITEMS:
                 return Response(
-                    {'error': 'API返回的JSON格式不正确，缺少必要字段'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    {'error': f'单次最多诊断 {settings.DIAGNOSIS_BATCH_MAX_ITEMS} 条告警'},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # 保存诊断结果
-            case = FaultCase.objects.create(
-                alert_info=alert_info,
-                metrics_info=metrics_info,
-                log_info=log_info,
-                analysis_result=json.dumps(result)
-            )
-
-            # 如果找到匹配的知识条目，记录最匹配的一条
-            if matched_knowledge_list:
-                best_match = matched_knowledge_list[0]
-                # 降低相似度阈值到 5%，因为我们现在使用百分比
-                if best_match['score'] > 5:  # 相似度阈值
-                    case.matched_knowledge_id = best_match['id']
-                    case.save()
-                    logger.info(f"Matched knowledge with score: {best_match['score']:.2f}%")
-                else:
-                    logger.info(f"No knowledge matched, best score: {best_match['score']:.2f}%")
-
-            # 添加参考的知识库案例到返回结果中
-            reference_cases = []
-            if matched_knowledge_list:
-                for knowledge in matched_knowledge_list:
-                    if knowledge['score'] > 5:  # 只返回相似度大于5%的案例
-                        reference_cases.append({
-                            'id': knowledge['id'],
-                            'title': knowledge['title'],
-                            'category': knowledge['category'],
-                            'symptoms': knowledge['symptoms'],
-                            'solution': knowledge['solution'],
-                            'similarity': f"{knowledge['score']:.2f}%"
-                        })
-
-            return Response({
-                'id': case.id,
-                'category': result['category'],
-                'analysis': result['analysis'],
-                'solution': result['solution'],
-                'matched_knowledge_id': case.matched_knowledge_id,
-                'reference_cases': reference_cases  # 添加参考案例
-            })
+            return Response({'results': get_pipeline().run_batch(alerts)})
 
         except Exception as e:
-            logger.error("Unexpected error in analyze endpoint: %s", str(e))
+            logger.error("Unexpected error in analyze_batch endpoint: %s", str(e))
             logger.error("Traceback: %s", traceback.format_exc())
             return Response(
                 {'error': f'服务器内部错误: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+@csrf_exempt
+@require_POST
+async def analyze_async(request):
+    """analyze 的原生异步版本，需以 ASGI 方式部署
+
+    等待大模型期间不占用 worker 线程，单个进程可同时处理大量诊断请求。
+    """
+    try:
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': '请求体不是合法的JSON'}, status=status.HTTP_400_BAD_REQUEST)
+
+        alert_info = data.get('alert_info', '')
+        metrics_info = data.get('metrics_info', '')
+        log_info = data.get('log_info', '')
+        categories = normalize_categories(data.get('categories'))
+        keep_raw_log = data.get('keep_raw_log')
+        metrics_series = data.get('metrics_series')
+
+        if not alert_info:
+            return JsonResponse({'error': '告警信息不能为空'}, status=status.HTTP_400_BAD_REQUEST)
+
+        pipeline = get_pipeline()
+        if settings.ALERT_COALESCING_ENABLED:
+            payload = await get_coalescer().asubmit(
+                alert_info, lambda: pipeline.arun(
+                    alert_info, metrics_info, log_info, categories, keep_raw_log, metrics_series
+                ),
+                fingerprint=input_fingerprint(metrics_info, log_info, categories, metrics_series)
+            )
+        else:
+            payload = await pipeline.arun(
+                alert_info, metrics_info, log_info, categories, keep_raw_log, metrics_series
+            )
+        return JsonResponse(payload, json_dumps_params={'ensure_ascii': False})
+
+    except DiagnosisError as e:
+        return JsonResponse({'error': e.message}, status=e.status_code)
+    except Exception as e:
+        logger.error("Unexpected error in analyze_async endpoint: %s", str(e))
+        logger.error("Traceback: %s", traceback.format_exc())
+        return JsonResponse(
+            {'error': f'服务器内部错误: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+def metrics_view(request):
+    """以 Prometheus 文本格式导出各阶段耗时、缓存命中、大模型 token 等指标"""
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 import os
 from pathlib import Path
+
+import django
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -83,12 +85,64 @@ WSGI_APPLICATION = "fault_diagnosis.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# 数据库配置：sqlite（默认，单机部署）或 postgres（多 worker / 多节点部署）
+DATABASE_PROFILE = os.getenv('DATABASE_PROFILE', 'sqlite').lower()
+# 持久连接的最长复用时间（秒），0 表示每个请求结束后关闭连接
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+
+if DATABASE_PROFILE == 'postgres':
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv('POSTGRES_DB', 'fault_diagnosis'),
+            "USER": os.getenv('POSTGRES_USER', 'postgres'),
+            "PASSWORD": os.getenv('POSTGRES_PASSWORD', ''),
+            "HOST": os.getenv('POSTGRES_HOST', '127.0.0.1'),
+            "PORT": os.getenv('POSTGRES_PORT', '5432'),
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            # 复用持久连接前先检查连接是否可用，避免数据库重启或连接被中间件断开后请求报错
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "connect_timeout": int(os.getenv('POSTGRES_CONNECT_TIMEOUT', '5')),
+            },
+        }
     }
-}
+    # 可选：使用 psycopg 连接池（需要 Django 5.1+ 和 psycopg[pool]），启用后由连接池管理连接复用
+    if os.getenv('POSTGRES_POOL', 'False') == 'True':
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv('POSTGRES_POOL_MIN_SIZE', '2')),
+            "max_size": int(os.getenv('POSTGRES_POOL_MAX_SIZE', '10')),
+            "timeout": float(os.getenv('POSTGRES_POOL_TIMEOUT', '10')),
+        }
+else:
+    # SQLite 等待写锁的最长时间（毫秒）
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv('SQLITE_PATH', str(BASE_DIR / "db.sqlite3")),
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            "OPTIONS": {
+                "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+            },
+            # 每个新连接建立后执行的 PRAGMA（见 diagnosis/db.py）：
+            # WAL 让读写互不阻塞，synchronous=NORMAL 在 WAL 下只在检查点时 fsync，mmap 减少读取时的系统调用
+            "PRAGMAS": {
+                "journal_mode": os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+                "synchronous": os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+                "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+                "mmap_size": int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+                # 负数表示以 KiB 为单位
+                "cache_size": -int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536')),
+                "temp_store": "MEMORY",
+            },
+        }
+    }
+    # Django 5.1+ 支持以 BEGIN IMMEDIATE 开启事务：写事务开始时即获取写锁并按 busy_timeout 等待，
+    # 避免读后写的事务在升级写锁时直接报 database is locked
+    if django.VERSION >= (5, 1):
+        DATABASES["default"]["OPTIONS"]["transaction_mode"] = "IMMEDIATE"
 
 
 # Password validation
@@ -145,11 +199,180 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Fault case listing settings
+# 诊断记录列表按创建时间游标分页：默认/最大每页条数，以及列表中告警摘要的字符数
+FAULT_CASE_PAGE_SIZE = int(os.getenv('FAULT_CASE_PAGE_SIZE', '50'))
+FAULT_CASE_MAX_PAGE_SIZE = int(os.getenv('FAULT_CASE_MAX_PAGE_SIZE', '500'))
+FAULT_CASE_PREVIEW_LENGTH = int(os.getenv('FAULT_CASE_PREVIEW_LENGTH', '120'))
+
+# Fault case persistence settings
+# 启用后诊断记录先入队，由后台线程按批（达到 BATCH_SIZE 条或最早一条等待超过 FLUSH_INTERVAL 秒）bulk_create 写入，
+# 响应中的 uid（ULID）在入队前分配；队列超过 MAX_QUEUE 条时退回同步写入
+FAULT_CASE_WRITE_BEHIND = os.getenv('FAULT_CASE_WRITE_BEHIND', 'False') == 'True'
+FAULT_CASE_WRITE_BATCH_SIZE = int(os.getenv('FAULT_CASE_WRITE_BATCH_SIZE', '100'))
+FAULT_CASE_WRITE_FLUSH_INTERVAL = float(os.getenv('FAULT_CASE_WRITE_FLUSH_INTERVAL', '0.5'))
+FAULT_CASE_WRITE_MAX_QUEUE = int(os.getenv('FAULT_CASE_WRITE_MAX_QUEUE', '10000'))
+
 # DashScope API settings
 DASHSCOPE_API_KEY = os.getenv('DASHSCOPE_API_KEY')
-if not DASHSCOPE_API_KEY:
+
+# LLM backend settings
+# 大模型后端：diagnosis.llm.DashScopeBackend（默认）或 diagnosis.llm.StubBackend（离线压测用的确定性桩）
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'diagnosis.llm.DashScopeBackend')
+LLM_OPTIONS = {
+    'api_key': DASHSCOPE_API_KEY,
+    # HTTP 连接池大小
+    'pool_maxsize': int(os.getenv('LLM_POOL_MAXSIZE', '32')),
+    # 只对限流、5xx、连接错误和超时做带抖动的指数退避重试
+    'max_retries': int(os.getenv('LLM_MAX_RETRIES', '2')),
+    'backoff': float(os.getenv('LLM_RETRY_BACKOFF', '0.5')),
+    # StubBackend 的固定延迟及随机抖动（秒）
+    'latency': float(os.getenv('LLM_STUB_LATENCY', '0.5')),
+    'jitter': float(os.getenv('LLM_STUB_JITTER', '0')),
+}
+# 各调用场景的模型、采样参数和总时间预算（秒，含重试），未配置的字段取 default
+LLM_ROUTES = {
+    'default': {
+        'model': os.getenv('LLM_MODEL', 'qwen-max'),
+        'temperature': 0.7,
+        'top_p': 0.8,
+        'max_tokens': 1500,
+        'timeout': float(os.getenv('LLM_TIMEOUT', '60')),
+    },
+    'analyze': {},
+    'analyze_batch': {},
+    'analyze_stream': {},
+}
+if LLM_BACKEND.endswith('DashScopeBackend') and not DASHSCOPE_API_KEY:
     raise ValueError("DASHSCOPE_API_KEY environment variable is not set")
 
+# Prompt budget settings
+# 提示词按 token 预算组装：各部分先截断到自身预算（reference 为每个参考案例），
+# 总数超出 total 时依次丢弃相似度最低的参考案例、截断日志、截断指标
+PROMPT_TOKENIZER_MODEL = os.getenv('PROMPT_TOKENIZER_MODEL', LLM_ROUTES['default']['model'])
+PROMPT_TOKEN_BUDGETS = {
+    'alert': int(os.getenv('PROMPT_BUDGET_ALERT', '1000')),
+    'metrics': int(os.getenv('PROMPT_BUDGET_METRICS', '1500')),
+    'logs': int(os.getenv('PROMPT_BUDGET_LOGS', '2500')),
+    'reference': int(os.getenv('PROMPT_BUDGET_REFERENCE', '600')),
+    'total': int(os.getenv('PROMPT_BUDGET_TOTAL', '6000')),
+}
+
+# Query embedding cache settings
+# 进程内 LRU 的条目数与字节数上限；EMBEDDING_CACHE_PATH 非空时启用 SQLite 持久化层（多 worker 共享、重启保留）
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '10000'))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '')
+# SQLite 持久化层的条目上限，超出时淘汰最早写入的条目；0 表示不限制
+EMBEDDING_CACHE_PERSIST_MAX_ROWS = int(os.getenv('EMBEDDING_CACHE_PERSIST_MAX_ROWS', '50000'))
+
+# Diagnosis cache settings
+# 近期诊断结果按提示词哈希或输入向量相似度（余弦，0-1）复用，超过 TTL（秒）或知识库变化后失效
+DIAGNOSIS_CACHE_ENABLED = os.getenv('DIAGNOSIS_CACHE_ENABLED', 'True') == 'True'
+DIAGNOSIS_CACHE_TTL = float(os.getenv('DIAGNOSIS_CACHE_TTL', '600'))
+DIAGNOSIS_CACHE_SIMILARITY = float(os.getenv('DIAGNOSIS_CACHE_SIMILARITY', '0.95'))
+DIAGNOSIS_CACHE_MAX_ENTRIES = int(os.getenv('DIAGNOSIS_CACHE_MAX_ENTRIES', '1000'))
+# 查询知识库版本（最近更新时间与条目数）的间隔（秒），发现其他进程修改了知识库时清空本进程缓存
+DIAGNOSIS_CACHE_VERSION_INTERVAL = float(os.getenv('DIAGNOSIS_CACHE_VERSION_INTERVAL', '5'))
+
+# Alert storm coalescing settings
+# 窗口（秒）内分类、指标与日志相同，且归一化告警文本相同或向量相似度（余弦，0-1）不低于阈值的告警只诊断一次
+ALERT_COALESCING_ENABLED = os.getenv('ALERT_COALESCING_ENABLED', 'False') == 'True'
+ALERT_COALESCING_WINDOW = float(os.getenv('ALERT_COALESCING_WINDOW', '30'))
+ALERT_COALESCING_SIMILARITY = float(os.getenv('ALERT_COALESCING_SIMILARITY', '0.97'))
+
+# Async diagnosis settings
+# 异步诊断接口中执行向量计算、Chroma 查询等阻塞操作的线程池大小
+DIAGNOSIS_EXECUTOR_WORKERS = int(os.getenv('DIAGNOSIS_EXECUTOR_WORKERS', '8'))
+
+# Batch diagnosis settings
+# 批量诊断接口单次请求的最大告警数，以及并发调用大模型的上限
+DIAGNOSIS_BATCH_MAX_ITEMS = int(os.getenv('DIAGNOSIS_BATCH_MAX_ITEMS', '100'))
+DIAGNOSIS_BATCH_CONCURRENCY = int(os.getenv('DIAGNOSIS_BATCH_CONCURRENCY', '8'))
+
+# Observability settings
+# 完整提示词、大模型响应和请求数据的日志采样率（0-1），默认不记录以减少热路径上的日志 I/O
+DIAGNOSIS_PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv('DIAGNOSIS_PAYLOAD_LOG_SAMPLE_RATE', '0.0'))
+
+# Metrics pre-analysis settings
+# 请求中的结构化指标序列（metrics_series）先提取异常特征：z-score / MAD 异常阈值、相关系数阈值（|r|）及单次请求的点数上限
+METRICS_ANALYSIS_Z_THRESHOLD = float(os.getenv('METRICS_ANALYSIS_Z_THRESHOLD', '3.0'))
+METRICS_ANALYSIS_MAD_THRESHOLD = float(os.getenv('METRICS_ANALYSIS_MAD_THRESHOLD', '3.5'))
+METRICS_ANALYSIS_CORRELATION = float(os.getenv('METRICS_ANALYSIS_CORRELATION', '0.8'))
+METRICS_SERIES_MAX_POINTS = int(os.getenv('METRICS_SERIES_MAX_POINTS', '500000'))
+
+# Log reduction settings
+# 日志按 Drain 风格模板压缩后再入库和发送给大模型：重复行合并为模板并记录次数、变量示例和首末时间戳
+LOG_REDUCTION_ENABLED = os.getenv('LOG_REDUCTION_ENABLED', 'True') == 'True'
+# 少于该行数的日志原样保留
+LOG_REDUCTION_MIN_LINES = int(os.getenv('LOG_REDUCTION_MIN_LINES', '20'))
+# 输出的模板数上限（优先保留含错误关键字和出现次数多的模板）
+LOG_REDUCTION_MAX_TEMPLATES = int(os.getenv('LOG_REDUCTION_MAX_TEMPLATES', '50'))
+# 行与模板逐 token 比较的相似度（0-1），不低于该值时归入同一模板
+LOG_REDUCTION_SIMILARITY = float(os.getenv('LOG_REDUCTION_SIMILARITY', '0.5'))
+# 单条日志提取的模板数上限，超出后新模式的行只计数，保证内存占用有界
+LOG_REDUCTION_MAX_CLUSTERS = int(os.getenv('LOG_REDUCTION_MAX_CLUSTERS', '1000'))
+# 是否另外保存原始日志（请求中的 keep_raw_log 可覆盖）
+LOG_REDUCTION_KEEP_RAW = os.getenv('LOG_REDUCTION_KEEP_RAW', 'False') == 'True'
+
+# Embedding model settings
+# 句向量推理后端：torch（sentence-transformers）或 onnx（ONNX Runtime，需先执行 export_embedding_model 导出模型）
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+EMBEDDING_ONNX_DIR = os.getenv('EMBEDDING_ONNX_DIR', os.path.join(BASE_DIR, 'data', 'onnx'))
+# 使用 int8 动态量化后的 ONNX 模型
+EMBEDDING_ONNX_QUANTIZED = os.getenv('EMBEDDING_ONNX_QUANTIZED', 'True') == 'True'
+# 推理线程数，0 表示使用运行时默认值；同一节点运行多个 worker 时建议设为 CPU 核数 / worker 数
+EMBEDDING_NUM_THREADS = int(os.getenv('EMBEDDING_NUM_THREADS', '0'))
+# ONNX 推理的最大序列长度（token 数），超出部分截断
+EMBEDDING_MAX_LENGTH = int(os.getenv('EMBEDDING_MAX_LENGTH', '128'))
+# 并发的单条查询编码合并为一批：凑满批大小或最早的请求等待超过 MAX_WAIT（秒）后执行
+EMBEDDING_BATCHING_ENABLED = os.getenv('EMBEDDING_BATCHING_ENABLED', 'True') == 'True'
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', '32'))
+EMBEDDING_BATCH_MAX_WAIT = float(os.getenv('EMBEDDING_BATCH_MAX_WAIT', '0.003'))
+# 等待批处理结果的上限（秒），超时后在请求线程中直接编码；首次请求包含模型加载时间
+EMBEDDING_BATCH_TIMEOUT = float(os.getenv('EMBEDDING_BATCH_TIMEOUT', '10'))
+
+# Vector store settings
+# 向量存储后端：chroma（默认）或 numpy（进程内精确检索，归一化向量矩阵通过内存映射从磁盘加载）
+VECTOR_STORE_BACKEND = os.getenv('VECTOR_STORE_BACKEND', 'chroma')
+# numpy 后端的向量精度：float32、float16（占用减半）或 int8（逐向量缩放的标量量化，占用约为 1/4）
+VECTOR_STORE_DTYPE = os.getenv('VECTOR_STORE_DTYPE', 'float32')
+# 量化存储时先取 top_k × 该倍数个候选，再用全精度向量重新打分；0 表示不保留全精度副本（磁盘占用最小）
+VECTOR_STORE_RESCORE_FACTOR = int(os.getenv('VECTOR_STORE_RESCORE_FACTOR', '4'))
+
+# 按分类质心路由：请求未指定分类时只在与查询最相近的 TOP_N 个分类内检索，
+# 质心在索引变化后或超过 REFRESH（秒）后于后台重建
+VECTOR_CATEGORY_ROUTING = os.getenv('VECTOR_CATEGORY_ROUTING', 'False') == 'True'
+VECTOR_CATEGORY_ROUTING_TOP_N = int(os.getenv('VECTOR_CATEGORY_ROUTING_TOP_N', '3'))
+VECTOR_CATEGORY_ROUTING_REFRESH = float(os.getenv('VECTOR_CATEGORY_ROUTING_REFRESH', '300'))
+
+# Vector sidecar settings
+# 设置后各 worker 不再自行加载向量模型和打开向量库，而是通过该 Unix 域套接字调用 run_vector_sidecar 启动的边车进程
+VECTOR_SIDECAR_SOCKET = os.getenv('VECTOR_SIDECAR_SOCKET', '')
+# 单次请求的超时时间（秒），以及每个 worker 保留的空闲连接数
+VECTOR_SIDECAR_TIMEOUT = float(os.getenv('VECTOR_SIDECAR_TIMEOUT', '30'))
+VECTOR_SIDECAR_POOL_SIZE = int(os.getenv('VECTOR_SIDECAR_POOL_SIZE', '8'))
+
+# Vector index settings
+# 在 DiagnosisConfig.ready() 中预加载向量模型并执行一次空编码，使 worker 接收流量前完成预热
+VECTOR_DB_WARMUP = os.getenv('VECTOR_DB_WARMUP', 'False') == 'True'
+# 通过 manage.py 启动时只有这些命令预热（migrate、shell 等管理命令不加载模型）；gunicorn/uvicorn 等进程总是预热
+VECTOR_DB_WARMUP_COMMANDS = [
+    command.strip() for command in os.getenv('VECTOR_DB_WARMUP_COMMANDS', 'runserver').split(',')
+    if command.strip()
+]
+# 通过 API/Admin 写入知识条目时自动更新向量索引
+VECTOR_INDEX_AUTO_SYNC = os.getenv('VECTOR_INDEX_AUTO_SYNC', 'True') == 'True'
+# 后台索引队列：待处理条目达到批大小或最早条目等待超过刷新间隔（秒）时批量写入
+VECTOR_INDEX_BATCH_SIZE = int(os.getenv('VECTOR_INDEX_BATCH_SIZE', '64'))
+VECTOR_INDEX_FLUSH_INTERVAL = float(os.getenv('VECTOR_INDEX_FLUSH_INTERVAL', '2.0'))
+
+# Knowledge import/export settings
+# NDJSON 导入每批写入数据库并编码入库的条目数（接口可用 batch_size 参数调整，不超过上限），导出时每次从数据库读取的行数
+KNOWLEDGE_IMPORT_BATCH_SIZE = int(os.getenv('KNOWLEDGE_IMPORT_BATCH_SIZE', '1000'))
+KNOWLEDGE_IMPORT_MAX_BATCH_SIZE = int(os.getenv('KNOWLEDGE_IMPORT_MAX_BATCH_SIZE', '10000'))
+KNOWLEDGE_EXPORT_CHUNK_SIZE = int(os.getenv('KNOWLEDGE_EXPORT_CHUNK_SIZE', '2000'))
+
 # Logging settings
 LOGGING = {
     'version': 1,
@@ -17,11 +17,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
+from diagnosis.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/knowledge/', include('knowledge_base.urls')),
     path('api/diagnosis/', include('diagnosis.urls')),
     path('api-auth/', include('rest_framework.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', TemplateView.as_view(template_name='index.html')),
 ]
@@ -0,0 +1,42 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge_base.models import FaultKnowledge
+from knowledge_base.ndjson import export_knowledge
+
+
+class Command(BaseCommand):
+    help = '将知识库流式导出为 NDJSON（分类为名称，可用 import_knowledge 再导入），输出路径以 .gz 结尾时 gzip 压缩'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help='输出文件路径，默认输出到标准输出')
+        parser.add_argument('--gzip', action='store_true', help='gzip 压缩输出')
+        parser.add_argument('--category-id', type=int, help='只导出该分类下的条目')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=settings.KNOWLEDGE_EXPORT_CHUNK_SIZE,
+            help=f'每次从数据库读取的行数（默认 {settings.KNOWLEDGE_EXPORT_CHUNK_SIZE}）'
+        )
+
+    def handle(self, *args, **options):
+        queryset = FaultKnowledge.objects.all()
+        if options['category_id'] is not None:
+            queryset = queryset.filter(category_id=options['category_id'])
+        compress = options['gzip'] or options['output'].endswith('.gz')
+        chunks = export_knowledge(queryset, compress=compress, chunk_size=max(1, options['chunk_size']))
+
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+        try:
+            with open(options['output'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except OSError as e:
+            raise CommandError(f"Cannot write {options['output']}: {str(e)}")
+        self.stdout.write(self.style.SUCCESS(f"知识库已导出到 {options['output']}"))
@@ -0,0 +1,53 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge_base.ndjson import KnowledgeImporter
+
+
+class Command(BaseCommand):
+    help = ('从 NDJSON 文件（可 gzip 压缩，每行一个知识条目）流式导入知识库：'
+            '分批 bulk_create/bulk_update，并批量编码写入向量库')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON 文件路径，- 表示标准输入')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.KNOWLEDGE_IMPORT_BATCH_SIZE,
+            help=f'每批写入并编码的条目数（默认 {settings.KNOWLEDGE_IMPORT_BATCH_SIZE}）'
+        )
+        parser.add_argument(
+            '--no-index',
+            action='store_true',
+            help='只写入数据库，不更新向量索引（之后运行 sync_vector_db）'
+        )
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            self.stdout.write(f"已导入 {stats['created'] + stats['updated']} 条"
+                              f"（新建 {stats['created']}，更新 {stats['updated']}，索引 {stats['indexed']}）")
+
+        importer = KnowledgeImporter(batch_size=options['batch_size'], index=not options['no_index'],
+                                     progress=progress)
+        if options['path'] == '-':
+            stats = importer.run(sys.stdin.buffer.read)
+        else:
+            try:
+                with open(options['path'], 'rb') as f:
+                    stats = importer.run(f.read)
+            except OSError as e:
+                raise CommandError(f"Cannot read {options['path']}: {str(e)}")
+
+        for sample in stats['error_samples']:
+            location = f"第 {sample['line']} 行" if sample['line'] else '输入流'
+            self.stdout.write(self.style.WARNING(f"{location}: {sample['error']}"))
+        summary = (f"导入完成，用时 {stats['seconds']}s：新建 {stats['created']} 条，更新 {stats['updated']} 条，"
+                   f"新建分类 {stats['categories_created']} 个，索引 {stats['indexed']} 条")
+        if stats['errors'] or stats['index_failed']:
+            self.stdout.write(self.style.ERROR(
+                f"{summary}；错误 {stats['errors']} 条，索引失败 {stats['index_failed']} 条"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,273 @@
+import json
+import logging
+import time
+import zlib
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import FaultCategory, FaultKnowledge
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+# zlib 的 wbits：31 表示带 gzip 头和校验
+GZIP_WBITS = 31
+CHUNK_SIZE = 64 * 1024
+# 单行上限，防止没有换行符的输入把整个请求体读入内存
+MAX_LINE_BYTES = 4 * 1024 * 1024
+# 导入结果中保留的错误明细条数
+MAX_ERROR_SAMPLES = 20
+
+EXPORT_FIELDS = ('id', 'category', 'title', 'symptoms', 'solution', 'created_at', 'updated_at')
+UPDATE_FIELDS = ['category', 'title', 'symptoms', 'solution', 'updated_at']
+
+
+def _iter_chunks(read: Callable[[int], bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """按块读取字节流，以 gzip 魔数开头时边读边解压（支持多个 gzip 成员拼接），每次产出不超过 chunk_size 字节"""
+    chunk = read(chunk_size)
+    if chunk[:2] != GZIP_MAGIC:
+        while chunk:
+            yield chunk
+            chunk = read(chunk_size)
+        return
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    while chunk:
+        data = chunk
+        while data:
+            output = decompressor.decompress(data, chunk_size)
+            if output:
+                yield output
+            if decompressor.eof:
+                data = decompressor.unused_data
+                if data:
+                    decompressor = zlib.decompressobj(GZIP_WBITS)
+            else:
+                data = decompressor.unconsumed_tail
+        chunk = read(chunk_size)
+    if not decompressor.eof:
+        raise ValueError('truncated gzip stream')
+
+
+def iter_lines(read: Callable[[int], bytes], chunk_size: int = CHUNK_SIZE,
+               max_line_bytes: int = MAX_LINE_BYTES) -> Iterator[Tuple[int, bytes]]:
+    """增量读取 NDJSON（可 gzip 压缩），产出 (行号, 行内容)，内存占用与文件大小无关"""
+    buffer = bytearray()
+    line_number = 0
+    for data in _iter_chunks(read, chunk_size):
+        buffer += data
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end < 0:
+                break
+            line_number += 1
+            yield line_number, bytes(buffer[start:end])
+            start = end + 1
+        del buffer[:start]
+        if len(buffer) > max_line_bytes:
+            raise ValueError(f'line {line_number + 1} exceeds {max_line_bytes} bytes')
+    if buffer:
+        yield line_number + 1, bytes(buffer)
+
+
+def _required_text(data: Dict, name: str, max_length: Optional[int] = None) -> str:
+    value = data.get(name)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f'{name} must be a non-empty string')
+    if max_length and len(value) > max_length:
+        raise ValueError(f'{name} exceeds {max_length} characters')
+    return value
+
+
+def parse_record(data) -> Dict:
+    """校验一行导入数据；分类按名称给出（category 或导出/接口格式中的 category_name），带 id 时更新已有条目"""
+    if not isinstance(data, dict):
+        raise ValueError('expected a JSON object')
+    category = data.get('category_name') or data.get('category')
+    if not isinstance(category, str) or not category.strip():
+        raise ValueError('category must be a category name')
+    if len(category.strip()) > 100:
+        raise ValueError('category exceeds 100 characters')
+    record = {
+        'category': category.strip(),
+        'title': _required_text(data, 'title', 200),
+        'symptoms': _required_text(data, 'symptoms'),
+        'solution': _required_text(data, 'solution'),
+        'id': None,
+    }
+    knowledge_id = data.get('id')
+    if knowledge_id is not None:
+        if isinstance(knowledge_id, bool) or not isinstance(knowledge_id, int):
+            raise ValueError('id must be an integer')
+        record['id'] = knowledge_id
+    return record
+
+
+class KnowledgeImporter:
+    """NDJSON 知识条目批量导入
+
+    逐行解析，每凑满 batch_size 条写入一次：
+    - 分类按名称解析，已解析的分类在导入期间缓存，每批最多一次查询未知分类，缺失的逐个 get_or_create
+    - 带 id 且已存在的条目 bulk_update，其余 bulk_create，整批在一个事务中写入
+    - 写入后整批编码并 upsert 到向量库（bulk 操作不触发 post_save，不会再进入索引队列）；
+      索引失败不回滚数据库，之后可用 sync_vector_db 补齐
+    格式错误的行跳过并记录行号。
+    """
+
+    def __init__(self, batch_size: int = 1000, index: bool = True, vector_db=None,
+                 progress: Optional[Callable[[Dict], None]] = None):
+        self.batch_size = max(1, batch_size)
+        self.index = index
+        self.vector_db = vector_db
+        self.progress = progress
+        self._categories: Dict[str, FaultCategory] = {}
+        self._batch: List[Tuple[int, Dict]] = []
+        self.stats = {
+            'lines': 0,
+            'created': 0,
+            'updated': 0,
+            'categories_created': 0,
+            'indexed': 0,
+            'index_failed': 0,
+            'errors': 0,
+            'error_samples': [],
+        }
+
+    def _error(self, line_number: Optional[int], message: str, count: int = 1) -> None:
+        self.stats['errors'] += count
+        if len(self.stats['error_samples']) < MAX_ERROR_SAMPLES:
+            self.stats['error_samples'].append({'line': line_number, 'error': message})
+
+    def run(self, read: Callable[[int], bytes]) -> Dict:
+        """从字节流读取并导入全部条目，返回导入统计"""
+        start = time.perf_counter()
+        try:
+            for line_number, line in iter_lines(read):
+                if not line.strip():
+                    continue
+                self.stats['lines'] += 1
+                try:
+                    record = parse_record(json.loads(line))
+                except ValueError as e:
+                    self._error(line_number, str(e))
+                    continue
+                self._batch.append((line_number, record))
+                if len(self._batch) >= self.batch_size:
+                    self.flush()
+        except (ValueError, zlib.error) as e:
+            # 流本身损坏（gzip 截断、超长行）时停止读取，已写入的批次保留
+            self._error(None, str(e))
+        self.flush()
+        if self.stats['indexed']:
+            # 知识库已变化，近期的诊断结果不再复用
+            from diagnosis.diagnosis_cache import get_diagnosis_cache
+            get_diagnosis_cache().invalidate()
+        self.stats['seconds'] = round(time.perf_counter() - start, 3)
+        return self.stats
+
+    def _resolve_categories(self, names) -> None:
+        missing = set(names) - self._categories.keys()
+        if not missing:
+            return
+        self._categories.update((c.name, c) for c in FaultCategory.objects.filter(name__in=missing))
+        missing -= self._categories.keys()
+        if not missing:
+            return
+        # 新分类很少，逐个 get_or_create：并发导入先创建了同名分类时取已有的那个，只统计本次实际创建的
+        for name in sorted(missing):
+            category, created = FaultCategory.objects.get_or_create(name=name)
+            self._categories[name] = category
+            self.stats['categories_created'] += created
+
+    def flush(self) -> None:
+        """写入当前批次并更新向量索引"""
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        first_line = batch[0][0]
+        try:
+            with transaction.atomic():
+                self._resolve_categories({record['category'] for _, record in batch})
+                ids = [record['id'] for _, record in batch if record['id'] is not None]
+                existing = FaultKnowledge.objects.in_bulk(ids) if ids else {}
+                now = timezone.now()
+                to_create: List[FaultKnowledge] = []
+                to_update: Dict[int, FaultKnowledge] = {}
+                for _, record in batch:
+                    knowledge = existing.get(record['id'])
+                    if knowledge is None:
+                        # 库中不存在的 id 不沿用，按新条目创建
+                        knowledge = FaultKnowledge()
+                        to_create.append(knowledge)
+                    else:
+                        # bulk_update 不会触发 auto_now，手动更新时间；同一 id 多次出现时以最后一行为准
+                        knowledge.updated_at = now
+                        to_update[knowledge.id] = knowledge
+                    knowledge.category = self._categories[record['category']]
+                    knowledge.title = record['title']
+                    knowledge.symptoms = record['symptoms']
+                    knowledge.solution = record['solution']
+                created = FaultKnowledge.objects.bulk_create(to_create)
+                if to_update:
+                    FaultKnowledge.objects.bulk_update(list(to_update.values()), UPDATE_FIELDS)
+        except Exception as e:
+            # 分类缓存可能包含已回滚的分类
+            self._categories.clear()
+            logger.error(f"Failed to import batch starting at line {first_line}: {str(e)}")
+            self._error(first_line, f'batch of {len(batch)} rows failed: {str(e)}', count=len(batch))
+            return
+        self.stats['created'] += len(created)
+        self.stats['updated'] += len(to_update)
+        if self.index:
+            self._index(first_line, created + list(to_update.values()))
+        if self.progress:
+            self.progress(self.stats)
+
+    def _index(self, first_line: int, entries: List[FaultKnowledge]) -> None:
+        from diagnosis.services import get_vector_db, knowledge_to_dict
+
+        # 不支持 bulk_create 返回主键的数据库上，新建条目留给 sync_vector_db 索引
+        entries = [knowledge for knowledge in entries if knowledge.pk is not None]
+        if not entries:
+            return
+        try:
+            if self.vector_db is None:
+                self.vector_db = get_vector_db()
+            self.stats['indexed'] += self.vector_db.upsert_knowledge_batch(
+                [knowledge_to_dict(knowledge) for knowledge in entries]
+            )
+        except Exception as e:
+            self.stats['index_failed'] += len(entries)
+            logger.error(f"Failed to index imported batch starting at line {first_line}: {str(e)}")
+
+
+def export_knowledge(queryset=None, compress: bool = False, chunk_size: int = 2000) -> Iterator[bytes]:
+    """按 id 顺序以 NDJSON 流式导出知识条目（分类为名称，可直接再导入），用 iterator() 分块读取，不加载整表"""
+    if queryset is None:
+        queryset = FaultKnowledge.objects.all()
+    rows = queryset.order_by('id').values_list(
+        'id', 'category__name', 'title', 'symptoms', 'solution', 'created_at', 'updated_at'
+    ).iterator(chunk_size=chunk_size)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS) if compress else None
+    buffer: List[bytes] = []
+    size = 0
+    for row in rows:
+        record = dict(zip(EXPORT_FIELDS, row))
+        record['created_at'] = record['created_at'].isoformat()
+        record['updated_at'] = record['updated_at'].isoformat()
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            data = b''.join(buffer)
+            buffer, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(buffer)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
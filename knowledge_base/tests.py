@@ -1,3 +1,99 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from .models import FaultCategory, FaultKnowledge
+from .ndjson import KnowledgeImporter, export_knowledge, iter_lines
+
+
+def _ndjson(records):
+    return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+
+
+def _record(index, category='内存'):
+    return {'category': category, 'title': f'标题{index}', 'symptoms': f'症状{index}', 'solution': f'方案{index}'}
+
+
+class IterLinesTests(SimpleTestCase):
+    def test_lines_split_across_chunks(self):
+        data = b'{"a": 1}\n\n{"b": 2}'
+        lines = list(iter_lines(io.BytesIO(data).read, chunk_size=3))
+        self.assertEqual(lines, [(1, b'{"a": 1}'), (2, b''), (3, b'{"b": 2}')])
+
+    def test_concatenated_gzip_members(self):
+        data = gzip.compress(b'one\ntw') + gzip.compress(b'o\nthree\n')
+        self.assertEqual([line for _, line in iter_lines(io.BytesIO(data).read, chunk_size=4)],
+                         [b'one', b'two', b'three'])
+
+    def test_line_limit(self):
+        with self.assertRaises(ValueError):
+            list(iter_lines(io.BytesIO(b'x' * 100).read, chunk_size=10, max_line_bytes=50))
+
+
+class KnowledgeImporterTests(TestCase):
+    def _run(self, data, **options):
+        importer = KnowledgeImporter(index=False, **options)
+        return importer.run(io.BytesIO(data).read)
+
+    def test_imports_plain_and_gzip(self):
+        for compress in (False, True):
+            with self.subTest(compress=compress):
+                FaultKnowledge.objects.all().delete()
+                data = _ndjson([_record(i, category=f'分类{i % 3}') for i in range(7)])
+                stats = self._run(gzip.compress(data) if compress else data, batch_size=3)
+                self.assertEqual((stats['created'], stats['updated'], stats['errors']), (7, 0, 0))
+                self.assertEqual(FaultKnowledge.objects.count(), 7)
+                self.assertEqual(set(FaultKnowledge.objects.values_list('category__name', flat=True)),
+                                 {'分类0', '分类1', '分类2'})
+
+    def test_malformed_lines_are_skipped_with_line_numbers(self):
+        lines = [
+            json.dumps(_record(0), ensure_ascii=False),
+            '{not json',
+            json.dumps({'title': '缺少分类', 'symptoms': 's', 'solution': 'x'}, ensure_ascii=False),
+            '',
+            json.dumps({**_record(1), 'id': 'abc'}, ensure_ascii=False),
+            '[1, 2]',
+            json.dumps(_record(2), ensure_ascii=False),
+        ]
+        stats = self._run(('\n'.join(lines) + '\n').encode('utf-8'))
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['errors'], 4)
+        self.assertEqual([sample['line'] for sample in stats['error_samples']], [2, 3, 5, 6])
+        self.assertEqual(stats['lines'], 6)
+
+    def test_truncated_gzip_keeps_written_batches(self):
+        data = gzip.compress(_ndjson([_record(i) for i in range(50)]))
+        stats = self._run(data[:len(data) - 8], batch_size=10)
+        self.assertGreater(stats['created'], 0)
+        self.assertEqual(stats['error_samples'][-1]['line'], None)
+
+    def test_counts_only_categories_it_created(self):
+        FaultCategory.objects.create(name='内存')
+        # 模拟并发导入：预先查询时分类还不存在，创建时已被其他导入写入
+        with mock.patch.object(FaultCategory.objects, 'filter', return_value=FaultCategory.objects.none()):
+            stats = self._run(_ndjson([_record(0, '内存'), _record(1, '网络')]))
+        self.assertEqual(stats['categories_created'], 1)
+        self.assertEqual(FaultCategory.objects.count(), 2)
+        self.assertEqual(FaultKnowledge.objects.filter(category__name='内存').count(), 1)
+
+    def test_existing_id_is_updated_and_unknown_id_created(self):
+        category = FaultCategory.objects.create(name='内存')
+        knowledge = FaultKnowledge.objects.create(category=category, title='旧', symptoms='s', solution='x')
+        stats = self._run(_ndjson([{**_record(0), 'id': knowledge.id}, {**_record(1), 'id': 99999}]))
+        self.assertEqual((stats['created'], stats['updated']), (1, 1))
+        knowledge.refresh_from_db()
+        self.assertEqual(knowledge.title, '标题0')
+        self.assertFalse(FaultKnowledge.objects.filter(id=99999).exists())
+
+    def test_export_round_trip(self):
+        category = FaultCategory.objects.create(name='磁盘')
+        FaultKnowledge.objects.create(category=category, title='t', symptoms='s', solution='x')
+        exported = b''.join(export_knowledge(compress=True))
+        FaultKnowledge.objects.all().delete()
+        stats = self._run(exported)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(FaultKnowledge.objects.get().category.name, '磁盘')
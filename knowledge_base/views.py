@@ -1,7 +1,12 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
-from rest_framework import viewsets
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
 from .models import FaultCategory, FaultKnowledge
+from .ndjson import KnowledgeImporter, export_knowledge
 from .serializers import FaultCategorySerializer, FaultKnowledgeSerializer
 
 # Create your views here.
@@ -22,3 +27,41 @@ class FaultKnowledgeViewSet(viewsets.ModelViewSet):
         if category_id is not None:
             queryset = queryset.filter(category_id=category_id)
         return queryset
+
+    @action(detail=False, methods=['get'], url_path='index-status')
+    def index_status(self, request):
+        """向量索引队列深度及索引相对数据库的滞后"""
+        from diagnosis.indexing import index_status
+        return Response(index_status())
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """以 NDJSON 流式导出知识条目，?gzip=true 时 gzip 压缩，可按 category_id 过滤"""
+        compress = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+        response = StreamingHttpResponse(
+            export_knowledge(self.get_queryset(), compress=compress,
+                             chunk_size=settings.KNOWLEDGE_EXPORT_CHUNK_SIZE),
+            content_type='application/gzip' if compress else 'application/x-ndjson'
+        )
+        filename = 'knowledge.ndjson.gz' if compress else 'knowledge.ndjson'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_ndjson(self, request):
+        """流式导入 NDJSON（可 gzip 压缩）知识条目，每行一个条目，分批写入数据库并更新向量索引；?index=false 时跳过索引"""
+        # 直接读取请求体流，不经过 DRF 解析器，避免整个请求体读入内存
+        stream = request.stream
+        if stream is None:
+            return Response({'error': '请求体不能为空'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            batch_size = int(request.query_params.get('batch_size', settings.KNOWLEDGE_IMPORT_BATCH_SIZE))
+        except ValueError:
+            return Response({'error': 'batch_size 必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        index = request.query_params.get('index', 'true').lower() not in ('0', 'false', 'no')
+        importer = KnowledgeImporter(batch_size=min(max(1, batch_size), settings.KNOWLEDGE_IMPORT_MAX_BATCH_SIZE),
+                                     index=index)
+        stats = importer.run(stream.read)
+        if stats['errors'] and not stats['created'] and not stats['updated']:
+            return Response(stats, status=status.HTTP_400_BAD_REQUEST)
+        return Response(stats)
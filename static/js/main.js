@@ -1,7 +1,8 @@
 // API endpoints
 const API = {
     diagnosis: {
-        analyze: '/api/diagnosis/cases/analyze/'
+        analyze: '/api/diagnosis/cases/analyze/',
+        analyzeStream: '/api/diagnosis/cases/analyze-stream/'
     },
     categories: {
         list: '/api/knowledge/categories/',
@@ -30,8 +31,8 @@ document.addEventListener('DOMContentLoaded', function() {
     loadKnowledge();
 });
 
-// 提交诊断表单
-$('#diagnosisForm').on('submit', function(e) {
+// 提交诊断表单（流式返回：先显示参考案例，再逐个显示生成完成的字段）
+$('#diagnosisForm').on('submit', async function(e) {
     e.preventDefault();
     
     const formData = {
@@ -40,52 +41,107 @@ $('#diagnosisForm').on('submit', function(e) {
         log_info: $('#logInfo').val()
     };
 
-    $.ajax({
-        url: API.diagnosis.analyze,
-        method: 'POST',
-        contentType: 'application/json',
-        data: JSON.stringify(formData),
-        success: function(response) {
-            // 显示诊断结果
-            $('#diagnosisResult').html(`
-                <div class="card">
-                    <div class="card-body">
-                        <h5 class="card-title">诊断结果</h5>
-                        <p><strong>故障分类：</strong>${response.category}</p>
-                        <p><strong>分析结果：</strong>${response.analysis}</p>
-                        <p><strong>解决方案：</strong>${response.solution}</p>
-                    </div>
-                </div>
-            `);
+    const resultFields = {
+        category: $('<p class="card-text"></p>').text('生成中...'),
+        analysis: $('<p class="card-text"></p>').text('生成中...'),
+        solution: $('<p class="card-text"></p>').text('生成中...')
+    };
+    const referenceContainer = $('<div class="mt-4"></div>');
+    const resultCard = $(`
+        <div class="card">
+            <div class="card-body">
+                <h5 class="card-title">诊断结果</h5>
+            </div>
+        </div>
+    `);
+    resultCard.find('.card-body')
+        .append($('<p><strong>故障分类：</strong></p>').append(resultFields.category))
+        .append($('<p><strong>分析结果：</strong></p>').append(resultFields.analysis))
+        .append($('<p><strong>解决方案：</strong></p>').append(resultFields.solution));
+    $('#diagnosisResult').empty().append(resultCard, referenceContainer).show();
 
-            // 显示参考案例
-            if (response.reference_cases && response.reference_cases.length > 0) {
-                let referenceCasesHtml = '<div class="mt-4"><h5>参考案例</h5>';
-                response.reference_cases.forEach(function(referenceCase) {
-                    referenceCasesHtml += `
-                        <div class="card mb-3">
-                            <div class="card-body">
-                                <h6 class="card-title">${referenceCase.title} <span class="badge bg-info">相似度: ${referenceCase.similarity}</span></h6>
-                                <p class="card-text"><strong>故障分类：</strong>${referenceCase.category}</p>
-                                <p class="card-text"><strong>症状描述：</strong>${referenceCase.symptoms}</p>
-                                <p class="card-text"><strong>解决方案：</strong>${referenceCase.solution}</p>
-                            </div>
-                        </div>
-                    `;
-                });
-                referenceCasesHtml += '</div>';
-                $('#diagnosisResult').append(referenceCasesHtml);
+    const handlers = {
+        references: function(data) {
+            referenceContainer.html(renderReferenceCases(data.reference_cases));
+        },
+        field: function(data) {
+            if (resultFields[data.name]) {
+                resultFields[data.name].text(data.value);
             }
-
-            // 清空表单
+        },
+        done: function(data) {
+            ['category', 'analysis', 'solution'].forEach(function(name) {
+                const value = data[name];
+                resultFields[name].text(typeof value === 'string' ? value : JSON.stringify(value));
+            });
             $('#diagnosisForm')[0].reset();
         },
-        error: function(xhr) {
-            alert('诊断失败：' + (xhr.responseJSON?.error || '未知错误'));
+        error: function(data) {
+            alert('诊断失败：' + (data.error || '未知错误'));
         }
-    });
+    };
+
+    try {
+        const response = await fetch(API.diagnosis.analyzeStream, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(formData)
+        });
+        if (!response.ok) {
+            const body = await response.json().catch(() => ({}));
+            alert('诊断失败：' + (body.error || '未知错误'));
+            return;
+        }
+
+        // 按 SSE 格式（事件之间以空行分隔）解析响应流
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const {value, done} = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, {stream: true});
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(function(line) {
+                    if (line.startsWith('event: ')) eventName = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                });
+                if (handlers[eventName]) {
+                    handlers[eventName](JSON.parse(data));
+                }
+            }
+        }
+    } catch (err) {
+        alert('诊断失败：' + err.message);
+    }
 });
 
+// 渲染参考案例
+function renderReferenceCases(referenceCases) {
+    if (!referenceCases || referenceCases.length === 0) {
+        return '';
+    }
+    let referenceCasesHtml = '<h5>参考案例</h5>';
+    referenceCases.forEach(function(referenceCase) {
+        referenceCasesHtml += `
+            <div class="card mb-3">
+                <div class="card-body">
+                    <h6 class="card-title">${referenceCase.title} <span class="badge bg-info">相似度: ${referenceCase.similarity}</span></h6>
+                    <p class="card-text"><strong>故障分类：</strong>${referenceCase.category}</p>
+                    <p class="card-text"><strong>症状描述：</strong>${referenceCase.symptoms}</p>
+                    <p class="card-text"><strong>解决方案：</strong>${referenceCase.solution}</p>
+                </div>
+            </div>
+        `;
+    });
+    return referenceCasesHtml;
+}
+
 // 加载分类列表
 function loadCategories() {
     $.get(API.categories.list, function(data) {